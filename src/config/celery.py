@@ -2,6 +2,7 @@ from celery import Celery
 import os
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
-app = Celery("config")
+# Tasks are checked against their query budget (`conversation.query_budget`).
+app = Celery("config", task_cls="conversation.query_budget:BudgetedTask")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
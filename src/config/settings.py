@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import sys
 import os
 from pathlib import Path
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "conversation.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -83,11 +85,42 @@ DATABASES = {
         "NAME": os.getenv("POSTGRES_DB"),
         "USER": os.getenv("POSTGRES_USER"),
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
-        "HOST": "db",
-        "PORT": 5432,
+        "HOST": os.getenv("POSTGRES_HOST", "db"),
+        "PORT": int(os.getenv("POSTGRES_PORT", "5432")),
+        # Connections are checked before being reused (or handed out by the pool),
+        # so one dropped by the server or a pooler fails over to a new one.
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# How database connections are managed:
+# - "pool": a psycopg connection pool in each process, holding between
+#   DATABASE_POOL_MIN_SIZE and DATABASE_POOL_MAX_SIZE connections. Requests and
+#   tasks borrow a connection and give it back when they end.
+# - "pgbouncer": POSTGRES_HOST is a transaction-level pooler (PgBouncer in
+#   `pool_mode = transaction`). Django keeps its connection to the pooler for
+#   DATABASE_CONN_MAX_AGE seconds. Server-side cursors do not survive the end of
+#   a transaction, so they are only read inside one (the export). Prepared
+#   statements are already off (psycopg's `prepare_threshold` defaults to None in
+#   Django).
+# - "off": one connection per request, closed at its end.
+DATABASE_POOL = os.getenv("DATABASE_POOL", "pool")
+if DATABASE_POOL == "pool":
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DATABASE_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DATABASE_POOL_MAX_SIZE", "10")),
+            # Seconds a request waits for a free connection before failing.
+            "timeout": float(os.getenv("DATABASE_POOL_TIMEOUT", "10")),
+            # Idle connections above min_size are closed after max_idle seconds,
+            # and every connection is replaced after max_lifetime seconds.
+            "max_idle": 300,
+            "max_lifetime": 1800,
+        }
+    }
+elif DATABASE_POOL == "pgbouncer":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DATABASE_CONN_MAX_AGE", "60"))
+
 if "test" in sys.argv:
     DATABASES["default"] = {
         "ENGINE": "django.db.backends.sqlite3",
@@ -135,14 +168,152 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# Celery configuration
-CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+# Redis connections. The cache, and every `get_redis_connection` of the app
+# (tasks, buffer, metrics...), share one bounded pool per process: when the
+# REDIS_MAX_CONNECTIONS connections are in use, callers wait up to
+# REDIS_POOL_TIMEOUT seconds for a free one instead of opening more. The asyncio
+# client (`conversation.async_redis`) uses a pool with the same bounds per event
+# loop. Pub/sub subscriptions, where each open `/events/` stream holds one
+# connection, have their own unbounded pool per event loop.
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REDIS_POOL_KWARGS = {
+    "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+    "timeout": float(os.getenv("REDIS_POOL_TIMEOUT", "5")),
+    "health_check_interval": 30,
+    "socket_keepalive": True,
+}
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://redis:6379/0",
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_POOL_CLASS": "redis.BlockingConnectionPool",
+            "CONNECTION_POOL_KWARGS": REDIS_POOL_KWARGS,
         },
     }
 }
+
+# Celery configuration
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+CELERY_TASK_ROUTES = ("conversation.routing.route_task",)
+# Bounds the broker connections of each process, like the cache pool above.
+CELERY_BROKER_POOL_LIMIT = int(os.getenv("CELERY_BROKER_POOL_LIMIT", "10"))
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "max_connections": REDIS_POOL_KWARGS["max_connections"],
+    "health_check_interval": REDIS_POOL_KWARGS["health_check_interval"],
+}
+CELERY_BEAT_SCHEDULE = {
+    "maintain-message-partitions": {
+        "task": "conversation.tasks.maintain_message_partitions",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "archive-closed-conversations": {
+        "task": "conversation.tasks.archive_closed_conversations",
+        "schedule": crontab(minute=30),
+    },
+}
+
+# How conversations are processed once their quiet window has expired:
+# - "task": each conversation gets its own debounced Celery task.
+# - "sweep": conversations only wait in the Redis due-set, and a sweeper run by
+#   Celery beat every CONVERSATION_SWEEP_INTERVAL seconds processes every due
+#   conversation, CONVERSATION_SWEEP_BATCH_SIZE at a time in one transaction.
+CONVERSATION_PROCESSING_MODE = os.getenv("CONVERSATION_PROCESSING_MODE", "task")
+CONVERSATION_SWEEP_INTERVAL = float(os.getenv("CONVERSATION_SWEEP_INTERVAL", "1"))
+CONVERSATION_SWEEP_BATCH_SIZE = int(os.getenv("CONVERSATION_SWEEP_BATCH_SIZE", "500"))
+if CONVERSATION_PROCESSING_MODE == "sweep":
+    CELERY_BEAT_SCHEDULE["sweep-due-conversations"] = {
+        "task": "conversation.tasks.sweep_due_conversations",
+        "schedule": CONVERSATION_SWEEP_INTERVAL,
+        # A sweep left waiting behind a busy worker is dropped, the next one
+        # picks up the same conversations.
+        "options": {"expires": CONVERSATION_SWEEP_INTERVAL},
+    }
+else:
+    # Schedules again the conversations whose debounced task was lost (a worker
+    # crash), overdue by more than DEBOUNCE_STALE_AFTER (300 s).
+    CELERY_BEAT_SCHEDULE["recover-lost-processing-jobs"] = {
+        "task": "conversation.tasks.recover_lost_processing_jobs",
+        "schedule": 60,
+        "options": {"expires": 60},
+    }
+
+# Number of queues the conversation tasks are sharded over, by conversation ID
+# (`conversation.0` to `conversation.{N-1}`). 0 keeps them on the default queue.
+CONVERSATION_QUEUES = int(os.getenv("CONVERSATION_QUEUES", "0"))
+
+# Webhook fast path: orjson parsing/rendering and a lightweight validation
+# that falls back to the DRF serializer whenever it cannot decide.
+WEBHOOK_FAST_PATH = os.getenv("WEBHOOK_FAST_PATH", "true").lower() == "true"
+
+# Prometheus metrics, kept in Redis and served on /metrics.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Publishes committed messages on Redis pub/sub for /conversations/{id}/events/.
+MESSAGE_EVENTS_ENABLED = os.getenv("MESSAGE_EVENTS_ENABLED", "true").lower() == "true"
+
+# Write-ahead ingestion: /webhook/ appends events to Redis Streams, applied to the
+# database by `manage.py ingest_worker`. Events are sharded by conversation.
+INGEST_ENABLED = os.getenv("WEBHOOK_INGEST", "false").lower() == "true"
+INGEST_STREAM_SHARDS = int(os.getenv("INGEST_STREAM_SHARDS", "8"))
+
+# Answers retried webhook deliveries of applied events from Redis.
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+
+# Refuses messages to closed conversations from a per-process LRU backed by Redis,
+# without reaching the database. Closes are spread to every process by pub/sub.
+STATUS_CACHE_ENABLED = (
+    os.getenv("CONVERSATION_STATUS_CACHE", "true").lower() == "true"
+)
+
+# Admission control of the webhook (`conversation.admission`): events are refused
+# with 503 while the Celery queues hold more than ADMISSION_MAX_QUEUE_DEPTH tasks
+# or processing lags more than ADMISSION_MAX_PROCESSING_LAG seconds (it must be
+# below DEBOUNCE_STALE_AFTER, 300 s, past which a deadline is a lost job, or the
+# startup fails), and with 429 when a conversation sends more than
+# CONVERSATION_RATE_LIMIT events per second, beyond bursts of
+# CONVERSATION_RATE_BURST. A threshold of 0 is not checked.
+ADMISSION_ENABLED = os.getenv("WEBHOOK_ADMISSION_CONTROL", "true").lower() == "true"
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "10000"))
+ADMISSION_MAX_PROCESSING_LAG = float(os.getenv("ADMISSION_MAX_PROCESSING_LAG", "60"))
+CONVERSATION_RATE_LIMIT = float(os.getenv("CONVERSATION_RATE_LIMIT", "10"))
+CONVERSATION_RATE_BURST = int(os.getenv("CONVERSATION_RATE_BURST", "50"))
+
+# Monthly partitions of the messages table (PostgreSQL): how many months ahead are
+# created, how many months are kept (0 keeps everything), and whether expired
+# partitions are dropped or only detached (left as standalone tables).
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", "3"))
+MESSAGES_RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", "0"))
+MESSAGES_RETENTION_DROP = (
+    os.getenv("MESSAGES_RETENTION_DROP", "false").lower() == "true"
+)
+
+# Closed conversations are archived (messages compacted into one compressed blob)
+# after this many days. 0 disables archiving.
+CONVERSATION_ARCHIVE_AFTER_DAYS = int(
+    os.getenv("CONVERSATION_ARCHIVE_AFTER_DAYS", "30")
+)
+
+# Opt-in cProfile profiling of a sample of the requests and Celery tasks. Profiles
+# of the ones that took at least PROFILING_MIN_DURATION_MS are written to
+# PROFILING_DIR, and summarized by `manage.py profile_summary`.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+PROFILING_MIN_DURATION_MS = float(os.getenv("PROFILING_MIN_DURATION_MS", "0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", str(BASE_DIR / "profiles"))
+
+# Query budgets of the endpoints and tasks (`conversation.query_budget`): "log"
+# overruns with their SQL, "raise" on query count overruns (tests), or "off".
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "log")
+
+if "test" in sys.argv:
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+    METRICS_ENABLED = False
+    MESSAGE_EVENTS_ENABLED = False
+    IDEMPOTENCY_ENABLED = False
+    STATUS_CACHE_ENABLED = False
+    ADMISSION_ENABLED = False
+    QUERY_BUDGET_MODE = "raise"
@@ -0,0 +1,299 @@
+import logging
+import math
+import time
+from collections import Counter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django_redis import get_redis_connection
+from redis import BlockingConnectionPool, Redis
+from redis.exceptions import RedisError
+from rest_framework import status
+from . import debounce, metrics
+from .async_redis import get_async_redis_connection
+from .constants import (
+    ADMISSION_CHECK_INTERVAL,
+    ADMISSION_RETRY_AFTER,
+    DEBOUNCE_STALE_AFTER,
+)
+from .routing import QUEUE_NAME
+
+# Admission control of the webhook, in front of the handlers. Events are refused,
+# with a `Retry-After` header, rather than accepted into a backlog the workers
+# cannot drain:
+#
+# - 503 when the workers fall behind: the Celery queues in the broker hold more
+#   than `ADMISSION_MAX_QUEUE_DEPTH` tasks, or the most overdue conversation has
+#   waited for processing more than `ADMISSION_MAX_PROCESSING_LAG` seconds
+#   (conversations overdue by more than `DEBOUNCE_STALE_AFTER`, whose job was
+#   lost, are left out). Both are read at most once per
+#   `ADMISSION_CHECK_INTERVAL` in each process;
+# - 429 when a conversation sends more than `CONVERSATION_RATE_LIMIT` events per
+#   second, beyond bursts of `CONVERSATION_RATE_BURST`: a token bucket per
+#   conversation, updated atomically by a Lua script.
+#
+# A threshold set to 0 is not checked. Admission fails open: when Redis cannot be
+# reached, events are handled as usual.
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = "conversation:ratelimit:{}"
+
+# Reason -> (status code, error).
+REJECTIONS = {
+    "queue_depth": (
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        "Processing queues are full",
+    ),
+    "processing_lag": (
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        "Processing is lagging behind",
+    ),
+    "rate_limit": (
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        "Too many events for this conversation",
+    ),
+}
+
+# Refills the bucket of KEYS[1] at ARGV[1] tokens per second up to ARGV[2], as of
+# ARGV[3], and takes up to ARGV[4] tokens. Returns the number of tokens taken and,
+# if some were missing, the wait for the next one in ms.
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or burst
+local elapsed = math.max(now - (tonumber(bucket[2]) or now), 0)
+tokens = math.min(burst, tokens + elapsed * rate)
+local taken = math.min(math.floor(tokens), tonumber(ARGV[4]))
+tokens = tokens - taken
+local wait = 0
+if taken < tonumber(ARGV[4]) then
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {taken, wait}
+"""
+
+# When the load was last checked (monotonic time), and the reason to refuse
+# events until the next check.
+_overload = {"checked_at": -math.inf, "reason": None}
+_broker = {}
+
+
+def _broker_connection() -> Redis:
+    client = _broker.get("client")
+    if client is None:
+        pool = BlockingConnectionPool.from_url(
+            settings.CELERY_BROKER_URL, **settings.REDIS_POOL_KWARGS
+        )
+        client = _broker["client"] = Redis.from_pool(pool)
+    return client
+
+
+def check_settings():
+    """
+    Refuses, at startup, a processing lag threshold the lag check can never reach:
+    deadlines overdue by `DEBOUNCE_STALE_AFTER` or more are lost jobs, left out.
+
+    Raises:
+        ImproperlyConfigured: If `ADMISSION_MAX_PROCESSING_LAG` is not below
+        `DEBOUNCE_STALE_AFTER`.
+    """
+    if settings.ADMISSION_MAX_PROCESSING_LAG >= DEBOUNCE_STALE_AFTER:
+        raise ImproperlyConfigured(
+            f"ADMISSION_MAX_PROCESSING_LAG must be below {DEBOUNCE_STALE_AFTER} "
+            "seconds (DEBOUNCE_STALE_AFTER), or 0 to disable the lag check."
+        )
+
+
+def _queues() -> list[str]:
+    default = getattr(settings, "CELERY_TASK_DEFAULT_QUEUE", "celery")
+    return [default] + [
+        QUEUE_NAME.format(shard) for shard in range(settings.CONVERSATION_QUEUES)
+    ]
+
+
+def _check_load() -> str | None:
+    if settings.ADMISSION_MAX_QUEUE_DEPTH:
+        pipe = _broker_connection().pipeline(transaction=False)
+        for queue in _queues():
+            pipe.llen(queue)
+        if sum(pipe.execute()) > settings.ADMISSION_MAX_QUEUE_DEPTH:
+            return "queue_depth"
+    if settings.ADMISSION_MAX_PROCESSING_LAG:
+        if debounce.processing_lag() > settings.ADMISSION_MAX_PROCESSING_LAG:
+            return "processing_lag"
+    return None
+
+
+def _refresh():
+    try:
+        reason = _check_load()
+    except RedisError as e:
+        logger.warning("Could not check the processing load: %s", e)
+        reason = None
+    _overload.update(checked_at=time.monotonic(), reason=reason)
+
+
+def _is_stale() -> bool:
+    return time.monotonic() - _overload["checked_at"] >= ADMISSION_CHECK_INTERVAL
+
+
+def _conversation_id(payload: dict) -> str:
+    data = payload["data"]
+    return str(data.get("conversation_id", data.get("id")))
+
+
+def _take_args(cost: int) -> list:
+    return [
+        settings.CONVERSATION_RATE_LIMIT,
+        settings.CONVERSATION_RATE_BURST,
+        time.time(),
+        cost,
+    ]
+
+
+def _rejection(reason: str, retry_after: float) -> tuple[int, str, int]:
+    status_code, error = REJECTIONS[reason]
+    return status_code, error, max(math.ceil(retry_after), 1)
+
+
+def admit(payload: dict) -> tuple[int, str, int] | None:
+    """
+    Tells whether a webhook event can be handled, or must be refused because the
+    workers fall behind or its conversation exceeds its rate.
+
+    Args:
+        payload (dict): The validated event payload.
+    Returns:
+        tuple[int, str, int] | None: None if the event is admitted. Otherwise the
+        status code, the error and the number of seconds to wait before retrying.
+    """
+    if not settings.ADMISSION_ENABLED:
+        return None
+    if _is_stale():
+        _refresh()
+    reason = _overload["reason"]
+    retry_after = ADMISSION_RETRY_AFTER
+    if reason is None and settings.CONVERSATION_RATE_LIMIT:
+        try:
+            script = get_redis_connection("default").register_script(_TAKE_SCRIPT)
+            taken, wait_ms = script(
+                keys=[BUCKET_KEY.format(_conversation_id(payload))],
+                args=_take_args(1),
+            )
+        except RedisError as e:
+            logger.warning("Could not check the conversation rate: %s", e)
+            taken = 1
+        if not taken:
+            reason, retry_after = "rate_limit", wait_ms / 1000
+    if reason is None:
+        return None
+    metrics.increment(
+        "conversation_admission_rejections_total", reason=reason, type=payload["type"]
+    )
+    return _rejection(reason, retry_after)
+
+
+async def aadmit(payload: dict) -> tuple[int, str, int] | None:
+    """
+    Asynchronous version of `admit`. The load is checked in a worker thread, at
+    most once per `ADMISSION_CHECK_INTERVAL`; the rate with the asyncio Redis
+    client.
+    """
+    if not settings.ADMISSION_ENABLED:
+        return None
+    if _is_stale():
+        await sync_to_async(_refresh, thread_sensitive=False)()
+    reason = _overload["reason"]
+    retry_after = ADMISSION_RETRY_AFTER
+    if reason is None and settings.CONVERSATION_RATE_LIMIT:
+        try:
+            redis_conn = get_async_redis_connection("default")
+            script = redis_conn.register_script(_TAKE_SCRIPT)
+            taken, wait_ms = await script(
+                keys=[BUCKET_KEY.format(_conversation_id(payload))],
+                args=_take_args(1),
+            )
+        except RedisError as e:
+            logger.warning("Could not check the conversation rate: %s", e)
+            taken = 1
+        if not taken:
+            reason, retry_after = "rate_limit", wait_ms / 1000
+    if reason is None:
+        return None
+    await metrics.aincrement(
+        "conversation_admission_rejections_total", reason=reason, type=payload["type"]
+    )
+    return _rejection(reason, retry_after)
+
+
+def admit_batch(payloads: list[dict]) -> list[tuple[int, str, int] | None]:
+    """
+    Batch version of `admit`, with one round trip for the rates of every
+    conversation of the batch. The events of a conversation are admitted in
+    order, while its bucket has tokens.
+
+    Args:
+        payloads (list[dict]): The validated payloads, in arrival order.
+    Returns:
+        list[tuple[int, str, int] | None]: The result of `admit` for each payload.
+    """
+    if not settings.ADMISSION_ENABLED or not payloads:
+        return [None] * len(payloads)
+    if _is_stale():
+        _refresh()
+    reason = _overload["reason"]
+    if reason is not None:
+        results = [_rejection(reason, ADMISSION_RETRY_AFTER)] * len(payloads)
+    elif settings.CONVERSATION_RATE_LIMIT:
+        reason = "rate_limit"
+        results = _take_batch(payloads)
+    else:
+        return [None] * len(payloads)
+
+    rejected = Counter(
+        payload["type"]
+        for payload, result in zip(payloads, results)
+        if result is not None
+    )
+    for event_type, count in rejected.items():
+        metrics.increment(
+            "conversation_admission_rejections_total",
+            count,
+            reason=reason,
+            type=event_type,
+        )
+    return results
+
+
+def _take_batch(payloads: list[dict]) -> list[tuple[int, str, int] | None]:
+    conversation_ids = [_conversation_id(payload) for payload in payloads]
+    counts = Counter(conversation_ids)
+    try:
+        redis_conn = get_redis_connection("default")
+        script = redis_conn.register_script(_TAKE_SCRIPT)
+        pipe = redis_conn.pipeline(transaction=False)
+        for conversation_id, count in counts.items():
+            script(
+                keys=[BUCKET_KEY.format(conversation_id)],
+                args=_take_args(count),
+                client=pipe,
+            )
+        buckets = dict(zip(counts, pipe.execute()))
+    except RedisError as e:
+        logger.warning("Could not check the conversation rate: %s", e)
+        return [None] * len(payloads)
+
+    results = []
+    for conversation_id in conversation_ids:
+        bucket = buckets[conversation_id]
+        if bucket[0] > 0:
+            bucket[0] -= 1
+            results.append(None)
+        else:
+            results.append(_rejection("rate_limit", bucket[1] / 1000))
+    return results
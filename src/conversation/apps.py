@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ConversationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'conversation'
+
+    def ready(self):
+        from . import admission, profiling
+
+        admission.check_settings()
+        profiling.connect_task_signals()
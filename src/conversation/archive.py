@@ -0,0 +1,98 @@
+import json
+import zlib
+from django.db import transaction
+from django.utils.timezone import now, timedelta
+from . import detail_cache
+from .constants import ARCHIVE_BATCH_SIZE, ARCHIVE_COMPRESSION_LEVEL
+from .models import Conversation, ConversationArchive, Message
+from .serializers import MessageSerializer
+
+# Closed conversations are rarely read again, so once they have been closed for a
+# while their messages are compacted into one zlib-compressed JSON blob per
+# conversation (`ConversationArchive`) and their rows are deleted, which keeps
+# the messages table and its indexes small. The conversation row itself is kept,
+# so messages to the closed conversation are still refused; the IDs of the
+# archived messages stay taken only on PostgreSQL, through the `message_ids`
+# table. `ConversationDetailView` and the export read the messages from the
+# archive.
+
+
+def compress(messages: list[dict]) -> bytes:
+    return zlib.compress(
+        json.dumps(messages, separators=(",", ":")).encode("utf-8"),
+        ARCHIVE_COMPRESSION_LEVEL,
+    )
+
+
+def decompress(blob) -> list[dict]:
+    return json.loads(zlib.decompress(bytes(blob)))
+
+
+def archived_messages(conversation: Conversation) -> list[dict] | None:
+    """
+    Returns the messages of an archived conversation.
+
+    Args:
+        conversation (Conversation): The conversation, ideally fetched with
+            `select_related("archive")`.
+    Returns:
+        list[dict] | None: The serialized messages (`MessageSerializer` data), ordered
+        by `(timestamp, id)`, or None if the conversation is not archived.
+    """
+    try:
+        return decompress(conversation.archive.messages)
+    except ConversationArchive.DoesNotExist:
+        return None
+
+
+def archive_conversation(conversation_id) -> bool:
+    """
+    Archives a closed conversation: stores its messages as a compressed blob and
+    deletes their rows, in one transaction.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    Returns:
+        bool: Whether the conversation was archived. False if it is not closed, is
+        already archived, or is being archived by another worker.
+    """
+    with transaction.atomic():
+        conversation = (
+            Conversation.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(id=conversation_id, status="CLOSED", archive__isnull=True)
+            .first()
+        )
+        if conversation is None:
+            return False
+        messages = MessageSerializer(
+            Message.objects.filter(conversation=conversation).order_by(
+                "timestamp", "id"
+            ),
+            many=True,
+        ).data
+        ConversationArchive.objects.create(
+            conversation=conversation,
+            messages=compress(messages),
+            message_count=len(messages),
+        )
+        Message.objects.filter(conversation=conversation).delete()
+        transaction.on_commit(lambda: detail_cache.invalidate(conversation.id))
+    return True
+
+
+def archive_closed_conversations(
+    closed_for: timedelta, limit: int = ARCHIVE_BATCH_SIZE
+) -> int:
+    """
+    Archives the conversations closed for longer than `closed_for`.
+
+    Args:
+        closed_for (timedelta): How long a conversation must have been closed.
+        limit (int): The maximum number of conversations to archive.
+    Returns:
+        int: The number of archived conversations.
+    """
+    candidates = Conversation.objects.filter(
+        status="CLOSED", updated_at__lt=now() - closed_for, archive__isnull=True
+    ).values_list("id", flat=True)[:limit]
+    return sum(archive_conversation(conversation_id) for conversation_id in candidates)
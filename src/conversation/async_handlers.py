@@ -0,0 +1,128 @@
+import uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from . import buffer, debounce, detail_cache, events, ingest, metrics, status_cache
+from .constants import PROCESSING_DELAY
+from .models import Conversation, Message
+from .serializers import MessageSerializer
+from .tasks import (
+    buffer_message_until_conversation_exists,
+    debounce_conversation_processing,
+    process_buffer_for_conversation,
+)
+
+# Asynchronous counterparts of the handlers in `handlers.py`, for the ASGI webhook.
+# Every write is a single autocommit statement, so no transaction is needed, and
+# Redis is reached through the asyncio client. Celery has no asyncio producer, so
+# tasks are published from a worker thread to keep the event loop free.
+
+
+async def _publish(task, *args, **options):
+    await sync_to_async(task.apply_async, thread_sensitive=False)(args=args, **options)
+
+
+async def handle_new_conversation(payload: dict):
+    """
+    Handle the creation of a new conversation.
+
+    Args:
+        payload (dict): The payload containing conversation data.
+    Raises:
+        ValueError: If the conversation already exists.
+    """
+    data = payload["data"]
+    try:
+        await Conversation.objects.acreate(id=data["id"], status="OPEN")
+    except IntegrityError:
+        raise ValueError("Conversation already exists")
+    await _publish(process_buffer_for_conversation, data["id"], payload["timestamp"])
+
+
+async def handle_new_message(payload: dict):
+    """
+    Handle the creation of a new message in an existing conversation.
+    Messages for a conversation that does not exist yet are buffered.
+
+    Args:
+        payload (dict): The payload containing message data.
+    Raises:
+        ValueError: If the conversation is closed or the message ID already exists.
+    """
+    data = payload["data"]
+    conv_id = uuid.UUID(str(data["conversation_id"]))
+    if await status_cache.ais_closed(conv_id):
+        raise ValueError("Conversation is closed")
+    message = await Message.objects.acreate_in_open_conversation(
+        id=uuid.UUID(str(data["id"])),
+        conversation_id=conv_id,
+        type="INBOUND",
+        content=data["content"],
+        timestamp=parse_datetime(payload["timestamp"]),
+    )
+    if message is not None:
+        status_cache.remember_open(conv_id)
+        serialized = MessageSerializer(message).data
+        await detail_cache.aappend_messages(conv_id, [serialized])
+        await events.apublish_messages(conv_id, [serialized])
+        await schedule_message_processing(conv_id)
+        return
+
+    conv_status = (
+        await Conversation.objects.filter(id=conv_id)
+        .values_list("status", flat=True)
+        .afirst()
+    )
+    if conv_status == "CLOSED":
+        await status_cache.amark_closed([conv_id])
+        raise ValueError("Conversation is closed")
+    if conv_status is not None:
+        raise ValueError("Message ID already exists")
+    if await buffer.apush(payload) is None:
+        await metrics.aincrement(
+            "conversation_buffer_messages_total", outcome="buffered"
+        )
+    else:
+        # The conversation was created meanwhile: let the buffer task apply
+        # the tolerance check and deliver the message.
+        await _publish(buffer_message_until_conversation_exists, payload)
+
+
+async def handle_close_conversation(payload: dict):
+    """
+    Handle the closure of an existing conversation.
+
+    Args:
+        payload (dict): The payload containing conversation data.
+    Raises:
+        ValueError: If the conversation does not exist or is already closed.
+    """
+    conv_id = uuid.UUID(str(payload["data"]["id"]))
+    updated = await Conversation.objects.filter(id=conv_id, status="OPEN").aupdate(
+        status="CLOSED", updated_at=now()
+    )
+    if not updated:
+        if await Conversation.objects.filter(id=conv_id).aexists():
+            raise ValueError("Already closed")
+        raise ValueError("Conversation not found")
+    await detail_cache.ainvalidate(conv_id)
+    await ingest.amark_closed([conv_id])
+    await status_cache.amark_closed([conv_id])
+
+
+async def schedule_message_processing(conversation_id):
+    """
+    Asynchronous version of `tasks.schedule_message_processing`.
+
+    Args:
+        conversation_id (str): The ID of the conversation to process messages for.
+    """
+    added = await debounce.atouch(conversation_id, PROCESSING_DELAY)
+    if added and settings.CONVERSATION_PROCESSING_MODE != "sweep":
+        await _publish(
+            debounce_conversation_processing,
+            str(conversation_id),
+            countdown=PROCESSING_DELAY,
+        )
@@ -0,0 +1,65 @@
+import asyncio
+import weakref
+import redis.asyncio as redis
+from django.conf import settings
+
+_clients = weakref.WeakKeyDictionary()
+
+# Pool options bounding how many connections a pool opens and how long callers
+# wait for a free one, left out of the pub/sub pool.
+_POOL_BOUNDS = ("max_connections", "timeout")
+
+
+def _get_client(key, build_pool) -> redis.Redis:
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = redis.Redis.from_pool(build_pool())
+    return client
+
+
+def _pool_kwargs(alias: str) -> dict:
+    return settings.CACHES[alias].get("OPTIONS", {}).get("CONNECTION_POOL_KWARGS", {})
+
+
+def get_async_redis_connection(alias: str = "default") -> redis.Redis:
+    """
+    Returns an asyncio Redis client for the given cache alias.
+    Clients are bound to the event loop they were created on, so one client is
+    kept per running loop. Its connection pool has the bounds of the cache
+    (`CONNECTION_POOL_KWARGS`).
+
+    Args:
+        alias (str): The alias of the Redis-backed cache in `settings.CACHES`.
+    """
+    return _get_client(
+        alias,
+        lambda: redis.BlockingConnectionPool.from_url(
+            settings.CACHES[alias]["LOCATION"], **_pool_kwargs(alias)
+        ),
+    )
+
+
+def get_async_pubsub_connection(alias: str = "default") -> redis.Redis:
+    """
+    Returns an asyncio Redis client for pub/sub subscriptions, one per running
+    loop. A subscription holds its connection for as long as it is open (an
+    `/events/` stream), so subscriptions get their own pool, without the bounds
+    of the cache: open streams never make the other commands of the loop wait
+    for a connection.
+
+    Args:
+        alias (str): The alias of the Redis-backed cache in `settings.CACHES`.
+    """
+    kwargs = {
+        key: value
+        for key, value in _pool_kwargs(alias).items()
+        if key not in _POOL_BOUNDS
+    }
+    return _get_client(
+        (alias, "pubsub"),
+        lambda: redis.ConnectionPool.from_url(
+            settings.CACHES[alias]["LOCATION"], **kwargs
+        ),
+    )
@@ -0,0 +1,325 @@
+import random
+import threading
+import uuid
+from collections import Counter
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.db import connection
+from django.utils.timezone import now, timedelta
+
+from .constants import BUFFER_TIMEOUT
+
+SCENARIOS = ("burst", "out_of_order", "close", "mixed")
+
+# Gap between the messages of a burst, in seconds of event time.
+BURST_INTERVAL = 0.5
+
+
+def build_events(
+    scenario: str, conversations: int, messages: int, seed: int = 0, start=None
+) -> list[dict]:
+    """
+    Builds a reproducible stream of webhook events.
+
+    Scenarios:
+        burst: each conversation is created and then receives a burst of messages.
+        out_of_order: messages arrive before their NEW_CONVERSATION. Half of the
+            conversations start within `BUFFER_TIMEOUT` of their messages, so the
+            messages are recovered from the buffer; the other half start later and
+            the messages are dropped.
+        close: conversations receive a burst, are closed, and then get one more
+            message, which is rejected.
+        mixed: the three scenarios above, spread over the conversations.
+
+    The events of different conversations are interleaved, while the events of a
+    single conversation keep the order of the scenario.
+
+    Args:
+        scenario (str): One of `SCENARIOS`.
+        conversations (int): The number of conversations.
+        messages (int): The number of messages per conversation.
+        seed (int): Seed for the generated ids.
+        start (datetime): Event time of the first event. Defaults to now.
+    Returns:
+        list[dict]: The webhook payloads, in sending order.
+    Raises:
+        ValueError: If the scenario is unknown.
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    rng = random.Random(seed)
+    start = start or now()
+    kinds = SCENARIOS[:-1] if scenario == "mixed" else (scenario,)
+
+    streams = []
+    for index in range(conversations):
+        kind = kinds[index % len(kinds)]
+        builder = _SCENARIO_BUILDERS[kind]
+        late = kind == "out_of_order" and (index // len(kinds)) % 2 == 1
+        streams.append(builder(rng, start, messages, late))
+
+    events = []
+    for position in range(max((len(stream) for stream in streams), default=0)):
+        events.extend(stream[position] for stream in streams if position < len(stream))
+    return events
+
+
+def _event(event_type: str, timestamp, data: dict) -> dict:
+    return {"type": event_type, "timestamp": timestamp.isoformat(), "data": data}
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _messages(rng: random.Random, conversation_id: str, start, count: int):
+    return [
+        _event(
+            "NEW_MESSAGE",
+            start + timedelta(seconds=i * BURST_INTERVAL),
+            {
+                "id": _uuid(rng),
+                "direction": "RECEIVED",
+                "content": f"Message {i}",
+                "conversation_id": conversation_id,
+            },
+        )
+        for i in range(count)
+    ]
+
+
+def _opened(rng: random.Random, conversation_id: str, start, count: int):
+    return [
+        _event("NEW_CONVERSATION", start, {"id": conversation_id}),
+        *_messages(rng, conversation_id, start, count),
+    ]
+
+
+def _burst(rng, start, messages, late):
+    return _opened(rng, _uuid(rng), start, messages)
+
+
+def _out_of_order(rng, start, messages, late):
+    conversation_id = _uuid(rng)
+    offset = (messages - 1) * BURST_INTERVAL + BUFFER_TIMEOUT + 1 if late else 1
+    return [
+        *_messages(rng, conversation_id, start, messages),
+        _event(
+            "NEW_CONVERSATION",
+            start + timedelta(seconds=offset),
+            {"id": conversation_id},
+        ),
+    ]
+
+
+def _close(rng, start, messages, late):
+    conversation_id = _uuid(rng)
+    end = start + timedelta(seconds=messages * BURST_INTERVAL)
+    return [
+        *_opened(rng, conversation_id, start, messages),
+        _event("CLOSE_CONVERSATION", end, {"id": conversation_id}),
+        *_messages(rng, conversation_id, end + timedelta(seconds=1), 1),
+    ]
+
+
+_SCENARIO_BUILDERS = {
+    "burst": _burst,
+    "out_of_order": _out_of_order,
+    "close": _close,
+}
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    """
+    Returns the percentile of the values, interpolating between the closest ranks.
+
+    Args:
+        values (list[float]): The samples.
+        fraction (float): The percentile, between 0 and 1.
+    Returns:
+        float | None: The percentile, or None if there are no samples.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * fraction
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(seconds: list[float]) -> dict:
+    """
+    Summarizes durations as milliseconds.
+
+    Args:
+        seconds (list[float]): The durations, in seconds.
+    Returns:
+        dict: The p50, p95, p99, mean and max of the durations, in milliseconds.
+    """
+    if not seconds:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": percentile(seconds, 0.50) * 1000,
+        "p95": percentile(seconds, 0.95) * 1000,
+        "p99": percentile(seconds, 0.99) * 1000,
+        "mean": sum(seconds) / len(seconds) * 1000,
+        "max": max(seconds) * 1000,
+    }
+
+
+def compare(baseline: dict, current: dict) -> list[tuple]:
+    """
+    Compares the numeric metrics of two benchmark results.
+
+    Args:
+        baseline (dict): The previous result.
+        current (dict): The new result.
+    Returns:
+        list[tuple]: `(metric, baseline, current, change)` rows, where `change` is
+        the relative change or None if it cannot be computed.
+    """
+    before = _flatten(baseline.get("metrics", {}))
+    after = _flatten(current.get("metrics", {}))
+    rows = []
+    for metric in sorted(before.keys() | after.keys()):
+        old, new = before.get(metric), after.get(metric)
+        change = (new - old) / old if old and new is not None else None
+        rows.append((metric, old, new, change))
+    return rows
+
+
+def _flatten(metrics: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries it lets through.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class TaskMonitor:
+    """
+    Counts the Celery tasks published and run while it is active, along with the
+    database queries of each task run, and tells when no task is left.
+    Used as a context manager, so the signal receivers are always disconnected.
+    """
+
+    def __init__(self):
+        self.enqueued = Counter()
+        self.executed = Counter()
+        self.queries = Counter()
+        self._pending = 0
+        self._counters = {}
+        self._idle = threading.Condition()
+
+    def __enter__(self):
+        before_task_publish.connect(self._on_publish, weak=False)
+        task_prerun.connect(self._on_prerun, weak=False)
+        task_postrun.connect(self._on_postrun, weak=False)
+        return self
+
+    def __exit__(self, *exc_info):
+        before_task_publish.disconnect(self._on_publish)
+        task_prerun.disconnect(self._on_prerun)
+        task_postrun.disconnect(self._on_postrun)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits until every published task has run.
+
+        Args:
+            timeout (float): The maximum time to wait, in seconds.
+        Returns:
+            bool: Whether all the tasks ran in time.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def report(self) -> dict:
+        return {
+            name: {
+                "enqueued": self.enqueued[name],
+                "executed": self.executed[name],
+                "db_queries_per_run": (
+                    self.queries[name] / self.executed[name]
+                    if self.executed[name]
+                    else None
+                ),
+            }
+            for name in sorted(self.enqueued.keys() | self.executed.keys())
+        }
+
+    def _on_publish(self, sender=None, **kwargs):
+        with self._idle:
+            self.enqueued[sender] += 1
+            self._pending += 1
+
+    def _on_prerun(self, task_id=None, **kwargs):
+        counter = QueryCounter()
+        connection.execute_wrappers.append(counter)
+        self._counters[task_id] = counter
+
+    def _on_postrun(self, task_id=None, task=None, **kwargs):
+        counter = self._counters.pop(task_id, None)
+        if counter is not None:
+            connection.execute_wrappers.remove(counter)
+        with self._idle:
+            self.executed[task.name] += 1
+            self.queries[task.name] += counter.count if counter else 0
+            self._pending -= 1
+            self._idle.notify_all()
+
+
+CONNECTION_MODES = ("off", "persistent", "pool")
+
+
+def connection_modes(database: dict, pool_size: int) -> dict[str, dict]:
+    """
+    Builds the settings of a database for each way of managing its connections.
+
+    Modes:
+        off: a new connection per request (`CONN_MAX_AGE = 0`).
+        persistent: one connection per thread, kept across requests.
+        pool: a psycopg connection pool of `pool_size` connections.
+
+    Args:
+        database (dict): The settings of the database (`settings.DATABASES` entry).
+        pool_size (int): The number of connections of the pool.
+    Returns:
+        dict[str, dict]: The database settings of each mode in `CONNECTION_MODES`.
+    """
+    options = {
+        key: value
+        for key, value in database.get("OPTIONS", {}).items()
+        if key != "pool"
+    }
+    base = {**database, "OPTIONS": options, "CONN_HEALTH_CHECKS": True}
+    return {
+        "off": {**base, "CONN_MAX_AGE": 0},
+        "persistent": {**base, "CONN_MAX_AGE": None},
+        "pool": {
+            **base,
+            "CONN_MAX_AGE": 0,
+            "OPTIONS": {
+                **options,
+                "pool": {"min_size": pool_size, "max_size": pool_size},
+            },
+        },
+    }
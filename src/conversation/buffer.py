@@ -0,0 +1,85 @@
+import json
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from .async_redis import get_async_redis_connection
+from .constants import BUFFER_TIMEOUT, BUFFER_DRAINED_TTL
+
+BUFFER_KEY = "conversation:buffer:{}"
+DRAINED_KEY = "conversation:buffer:{}:drained"
+
+# Adds the message to the conversation's buffer, unless the buffer was already
+# drained, in which case the conversation timestamp stored on drain is returned.
+_PUSH_SCRIPT = """
+local drained = redis.call('GET', KEYS[2])
+if drained then
+    return drained
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return nil
+"""
+
+# Pops every buffered message, ordered by event timestamp, and marks the buffer
+# as drained so late writers deliver their message directly.
+_DRAIN_SCRIPT = """
+local messages = redis.call('ZRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+return messages
+"""
+
+
+def push(payload: dict) -> str | None:
+    """
+    Buffers a message whose conversation does not exist yet.
+    Messages are kept in a sorted set per conversation, scored by event timestamp.
+
+    Args:
+        payload (dict): The payload containing message data.
+    Returns:
+        str | None: None if the message was buffered. If the conversation was created
+        (and its buffer drained) in the meantime, the conversation timestamp.
+    """
+    conv_id = payload["data"]["conversation_id"]
+    score = parse_datetime(payload["timestamp"]).timestamp()
+    redis_conn = get_redis_connection("default")
+    script = redis_conn.register_script(_PUSH_SCRIPT)
+    drained = script(
+        keys=[BUFFER_KEY.format(conv_id), DRAINED_KEY.format(conv_id)],
+        args=[score, json.dumps(payload), BUFFER_TIMEOUT],
+    )
+    return drained.decode("utf-8") if drained is not None else None
+
+
+async def apush(payload: dict) -> str | None:
+    """
+    Asynchronous version of `push`, using the asyncio Redis client.
+    """
+    conv_id = payload["data"]["conversation_id"]
+    score = parse_datetime(payload["timestamp"]).timestamp()
+    redis_conn = get_async_redis_connection("default")
+    script = redis_conn.register_script(_PUSH_SCRIPT)
+    drained = await script(
+        keys=[BUFFER_KEY.format(conv_id), DRAINED_KEY.format(conv_id)],
+        args=[score, json.dumps(payload), BUFFER_TIMEOUT],
+    )
+    return drained.decode("utf-8") if drained is not None else None
+
+
+def drain(conversation_id: str, timestamp: str) -> list[dict]:
+    """
+    Pops the buffered messages of a conversation in a single round trip.
+
+    Args:
+        conversation_id (str): The ID of the conversation.
+        timestamp (str): The timestamp when the conversation was created.
+    Returns:
+        list[dict]: The buffered payloads, ordered by event timestamp.
+    """
+    redis_conn = get_redis_connection("default")
+    script = redis_conn.register_script(_DRAIN_SCRIPT)
+    messages = script(
+        keys=[BUFFER_KEY.format(conversation_id), DRAINED_KEY.format(conversation_id)],
+        args=[timestamp, BUFFER_DRAINED_TTL],
+    )
+    return [json.loads(message) for message in messages]
@@ -0,0 +1,68 @@
+from django.db import connection
+
+# Bulk writes of plain rows, without building model instances: COPY on PostgreSQL
+# (psycopg 3) and `executemany` elsewhere, which psycopg 3 pipelines. They skip
+# field defaults, `auto_now` and signals, so callers pass every column they need.
+# Used by the event replay and the batch processing of conversations.
+
+
+def _prepare(fields: list, rows: list[tuple]) -> list[list]:
+    return [
+        [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+        for row in rows
+    ]
+
+
+def copy_rows(model, field_names: list[str], rows: list[tuple]):
+    """
+    Inserts rows into the table of a model, with COPY on PostgreSQL (psycopg 3)
+    and a batched INSERT elsewhere. Field defaults and `auto_now` are not applied.
+
+    Args:
+        model: The model class.
+        field_names (list[str]): The fields of the row values.
+        rows (list[tuple]): The row values, in the order of `field_names`.
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in field_names]
+    table = qn(model._meta.db_table)
+    columns = ", ".join(qn(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql" and hasattr(cursor.cursor, "copy"):
+            # psycopg adapts the Python values (UUID, aware datetime) itself.
+            with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            cursor.executemany(
+                f"INSERT INTO {table} ({columns}) "
+                f"VALUES ({', '.join(['%s'] * len(fields))})",
+                _prepare(fields, rows),
+            )
+
+
+def update_rows(model, field_names: list[str], rows: list[tuple]):
+    """
+    Updates rows of the table of a model by primary key, with one statement run
+    for all the rows (pipelined by psycopg 3). `auto_now` is not applied.
+
+    Args:
+        model: The model class.
+        field_names (list[str]): The updated fields.
+        rows (list[tuple]): The primary key followed by the values of
+            `field_names`, for each row.
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    meta = model._meta
+    fields = [meta.pk, *(meta.get_field(name) for name in field_names)]
+    assignments = ", ".join(f"{qn(field.column)} = %s" for field in fields[1:])
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {qn(meta.db_table)} SET {assignments} "
+            f"WHERE {qn(meta.pk.column)} = %s",
+            [[*row[1:], row[0]] for row in _prepare(fields, rows)],
+        )
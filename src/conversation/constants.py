@@ -1,2 +1,32 @@
 BUFFER_TIMEOUT = 6
 INVALID_TIMEOUT = 99999
+BATCH_MAX_SIZE = 1000
+PROCESSING_DELAY = 5
+DEBOUNCE_KEY = "conversation:processing:due"
+DEBOUNCE_STALE_AFTER = 300
+DEBOUNCE_RECOVERY_BATCH_SIZE = 500
+BUFFER_DRAINED_TTL = 60
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+DETAIL_CACHE_TIMEOUT = 300
+DETAIL_VERSION_TIMEOUT = 86400
+EXPORT_CHUNK_SIZE = 2000
+EVENTS_HEARTBEAT_INTERVAL = 15
+EVENTS_RETRY_MS = 3000
+EVENTS_REPLAY_LIMIT = 500
+INGEST_GROUP = "ingest"
+INGEST_STATE_TTL = 7 * 86400
+INGEST_BATCH_SIZE = 500
+INGEST_BLOCK_MS = 1000
+INGEST_LEASE_TTL = 30
+IDEMPOTENCY_TTL = 3600
+IDEMPOTENCY_BUCKET = 600
+ARCHIVE_BATCH_SIZE = 100
+ARCHIVE_COMPRESSION_LEVEL = 9
+REPLAY_CHUNK_SIZE = 5000
+REPLAY_REORDER_WINDOW = 10000
+STATUS_CACHE_SIZE = 50000
+STATUS_CACHE_TTL = 7 * 86400
+STATUS_CACHE_RETRY = 5
+ADMISSION_CHECK_INTERVAL = 1
+ADMISSION_RETRY_AFTER = 5
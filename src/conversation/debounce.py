@@ -0,0 +1,190 @@
+import time
+from django_redis import get_redis_connection
+from .async_redis import get_async_redis_connection
+from .constants import DEBOUNCE_KEY, DEBOUNCE_STALE_AFTER
+
+# Sets the processing deadline of a conversation to ARGV[2]. Returns 1 if the
+# conversation had no pending deadline, or if its deadline was already overdue by
+# more than ARGV[4] seconds at ARGV[3]: its processing job was lost (a worker
+# crash), and a new one must be scheduled. Otherwise returns 0.
+_TOUCH_SCRIPT = """
+local deadline = redis.call('ZSCORE', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+if not deadline then
+    return 1
+end
+if tonumber(ARGV[3]) - tonumber(deadline) > tonumber(ARGV[4]) then
+    return 1
+end
+return 0
+"""
+
+# Removes the conversation from the due-set once its deadline has passed and
+# returns how late it is (<= 0, in ms). If the deadline was pushed forward,
+# returns the remaining quiet window (> 0, in ms). Returns nil if another job
+# already claimed it.
+_CLAIM_SCRIPT = """
+local deadline = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not deadline then
+    return nil
+end
+local remaining = tonumber(deadline) - tonumber(ARGV[2])
+if remaining > 0 then
+    return math.ceil(remaining * 1000)
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+return math.floor(remaining * 1000)
+"""
+
+# Removes up to ARGV[2] conversations whose deadline has passed (<= ARGV[1]) from
+# the due-set, most overdue first, and returns them with their deadlines.
+_CLAIM_DUE_SCRIPT = """
+local due = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2]
+)
+for i = 1, #due, 2 do
+    redis.call('ZREM', KEYS[1], due[i])
+end
+return due
+"""
+
+# Makes up to ARGV[3] conversations whose deadline is overdue by more than
+# ARGV[2] seconds at ARGV[1] due right away, and returns them: their processing
+# job was lost, and a new one must be scheduled.
+_RECOVER_SCRIPT = """
+local lost = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]),
+    'LIMIT', 0, ARGV[3]
+)
+for i = 1, #lost do
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[1], lost[i])
+end
+return lost
+"""
+
+
+def _touch_args(conversation_id, delay: float) -> list:
+    now = time.time()
+    return [str(conversation_id), now + delay, now, DEBOUNCE_STALE_AFTER]
+
+
+def touch(conversation_id, delay: float) -> bool:
+    """
+    Pushes the processing deadline of a conversation to `delay` seconds from now.
+
+    Args:
+        conversation_id: The ID of the conversation.
+        delay (float): The quiet window, in seconds.
+    Returns:
+        bool: True if the conversation had no pending deadline, or a deadline
+        overdue by more than `DEBOUNCE_STALE_AFTER` seconds (its job was lost),
+        meaning the caller is responsible for scheduling the processing job.
+    """
+    redis_conn = get_redis_connection("default")
+    script = redis_conn.register_script(_TOUCH_SCRIPT)
+    return bool(script(keys=[DEBOUNCE_KEY], args=_touch_args(conversation_id, delay)))
+
+
+async def atouch(conversation_id, delay: float) -> bool:
+    """
+    Asynchronous version of `touch`, using the asyncio Redis client.
+    """
+    redis_conn = get_async_redis_connection("default")
+    script = redis_conn.register_script(_TOUCH_SCRIPT)
+    return bool(
+        await script(keys=[DEBOUNCE_KEY], args=_touch_args(conversation_id, delay))
+    )
+
+
+def claim(conversation_id) -> float | None:
+    """
+    Atomically claims a conversation whose quiet window has expired.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    Returns:
+        float | None: None if there is nothing to claim, the remaining quiet window
+        in seconds (> 0) if the deadline was pushed forward, or how late the claim
+        is in seconds (<= 0) once the conversation was claimed.
+    """
+    redis_conn = get_redis_connection("default")
+    script = redis_conn.register_script(_CLAIM_SCRIPT)
+    remaining = script(keys=[DEBOUNCE_KEY], args=[str(conversation_id), time.time()])
+    if remaining is None:
+        return None
+    return int(remaining) / 1000
+
+
+def claim_due(limit: int) -> list[tuple[str, float]]:
+    """
+    Atomically claims the conversations whose quiet window has expired, most
+    overdue first, for the batch processing.
+
+    Args:
+        limit (int): The maximum number of conversations to claim.
+    Returns:
+        list[tuple[str, float]]: The IDs of the claimed conversations, with how
+        late each claim is, in seconds (>= 0).
+    """
+    redis_conn = get_redis_connection("default")
+    script = redis_conn.register_script(_CLAIM_DUE_SCRIPT)
+    claimed_at = time.time()
+    due = script(keys=[DEBOUNCE_KEY], args=[claimed_at, limit])
+    return [
+        (conversation_id.decode("utf-8"), claimed_at - float(deadline))
+        for conversation_id, deadline in zip(due[::2], due[1::2])
+    ]
+
+
+def recover_lost(limit: int) -> list[str]:
+    """
+    Atomically picks the conversations whose deadline is overdue by more than
+    `DEBOUNCE_STALE_AFTER` seconds, most overdue first, and makes them due right
+    away, so they are not picked again while their new job is pending.
+
+    Args:
+        limit (int): The maximum number of conversations to pick.
+    Returns:
+        list[str]: The IDs of the conversations whose job was lost.
+    """
+    redis_conn = get_redis_connection("default")
+    script = redis_conn.register_script(_RECOVER_SCRIPT)
+    lost = script(keys=[DEBOUNCE_KEY], args=[time.time(), DEBOUNCE_STALE_AFTER, limit])
+    return [conversation_id.decode("utf-8") for conversation_id in lost]
+
+
+def processing_lag() -> float:
+    """
+    Tells how long the most overdue conversation has been waiting for processing.
+    Deadlines overdue by more than `DEBOUNCE_STALE_AFTER` belong to lost jobs, left
+    to `recover_lost`: they tell nothing about how far behind the workers are, and
+    are left out.
+
+    Returns:
+        float: The wait, in seconds (0 if no conversation is overdue).
+    """
+    now = time.time()
+    oldest = get_redis_connection("default").zrangebyscore(
+        DEBOUNCE_KEY, now - DEBOUNCE_STALE_AFTER, now, start=0, num=1, withscores=True
+    )
+    return now - oldest[0][1] if oldest else 0
+
+
+def release(conversation_ids: list):
+    """
+    Puts claimed conversations back in the due-set, due right away, so a failed
+    batch is picked up again. Conversations pushed back meanwhile by a new message
+    keep their later deadline.
+
+    Args:
+        conversation_ids (list): The IDs of the conversations.
+    """
+    if not conversation_ids:
+        return
+    now = time.time()
+    redis_conn = get_redis_connection("default")
+    redis_conn.zadd(
+        DEBOUNCE_KEY,
+        {str(conversation_id): now for conversation_id in conversation_ids},
+        nx=True,
+    )
@@ -0,0 +1,130 @@
+import bisect
+import time
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from .constants import DETAIL_CACHE_TIMEOUT, DETAIL_VERSION_TIMEOUT
+
+VERSION_KEY = "conversation:{}:version"
+DETAIL_KEY = "conversation:{}:detail"
+
+
+def _message_sort_key(message: dict):
+    return parse_datetime(message["timestamp"]), message["id"]
+
+
+def etag(conversation_id, version: int, variant: str = "") -> str:
+    """
+    Builds the ETag of a conversation representation.
+
+    Args:
+        conversation_id: The ID of the conversation.
+        version (int): The version of the conversation.
+        variant (str): Distinguishes alternative representations (e.g. `?recent=N`).
+    """
+    return f'"{conversation_id}-{version}{variant}"'
+
+
+def get(conversation_id) -> tuple[int | None, dict | None]:
+    """
+    Reads the version and the cached representation of a conversation in one round trip.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    Returns:
+        tuple[int | None, dict | None]: The current version, if known, and the cached
+        representation, if it matches that version.
+    """
+    version_key = VERSION_KEY.format(conversation_id)
+    detail_key = DETAIL_KEY.format(conversation_id)
+    values = cache.get_many([version_key, detail_key])
+    version = values.get(version_key)
+    detail = values.get(detail_key)
+    if version is None or detail is None or detail["version"] != version:
+        return version, None
+    return version, detail["data"]
+
+
+def current_version(conversation_id) -> int:
+    """
+    Returns the current version of a conversation, initializing it if unknown.
+    Versions start from the current time in ms, so they keep increasing even after
+    the version key expires.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    """
+    version_key = VERSION_KEY.format(conversation_id)
+    cache.add(version_key, int(time.time() * 1000), timeout=DETAIL_VERSION_TIMEOUT)
+    return cache.get(version_key)
+
+
+def store(conversation_id, version: int, data: dict):
+    """
+    Caches the rendered representation of a conversation at the given version.
+
+    Args:
+        conversation_id: The ID of the conversation.
+        version (int): The version read before loading the conversation.
+        data (dict): The serialized conversation.
+    """
+    cache.set(
+        DETAIL_KEY.format(conversation_id),
+        {"version": version, "data": data},
+        timeout=DETAIL_CACHE_TIMEOUT,
+    )
+
+
+def invalidate(conversation_id) -> int:
+    """
+    Bumps the version of a conversation, which invalidates its cached representation
+    and the ETags handed out so far.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    Returns:
+        int: The new version.
+    """
+    version_key = VERSION_KEY.format(conversation_id)
+    cache.add(version_key, int(time.time() * 1000), timeout=DETAIL_VERSION_TIMEOUT)
+    return cache.incr(version_key)
+
+
+def append_messages(conversation_id, messages: list[dict]):
+    """
+    Bumps the version of a conversation and appends new messages to its cached
+    representation, if it was up to date, instead of dropping it.
+
+    Args:
+        conversation_id: The ID of the conversation.
+        messages (list[dict]): The serialized messages.
+    """
+    version = invalidate(conversation_id)
+    detail = cache.get(DETAIL_KEY.format(conversation_id))
+    if detail is None or detail["version"] != version - 1:
+        return
+
+    # A reader may have rendered the conversation after the messages were
+    # committed but before this call, and cached them already.
+    data = detail["data"]
+    cached_ids = {message["id"] for message in data["messages"]}
+    for message in messages:
+        if message["id"] not in cached_ids:
+            bisect.insort(data["messages"], message, key=_message_sort_key)
+    store(conversation_id, version, data)
+
+
+async def ainvalidate(conversation_id) -> int:
+    """
+    Asynchronous version of `invalidate`.
+    """
+    return await sync_to_async(invalidate, thread_sensitive=False)(conversation_id)
+
+
+async def aappend_messages(conversation_id, messages: list[dict]):
+    """
+    Asynchronous version of `append_messages`.
+    """
+    await sync_to_async(append_messages, thread_sensitive=False)(
+        conversation_id, messages
+    )
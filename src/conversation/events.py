@@ -0,0 +1,97 @@
+import json
+import logging
+from contextlib import asynccontextmanager
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from .async_redis import get_async_pubsub_connection, get_async_redis_connection
+
+# New messages are announced on a Redis pub/sub channel per conversation once
+# they are committed, so subscribers (the `/conversations/{id}/events/` stream)
+# see them right away without polling the database. Publishing is best effort:
+# a Redis failure never fails the write, subscribers can catch up with
+# `Last-Event-ID`.
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "conversation:{}:messages"
+
+
+def publish_messages(conversation_id, messages: list[dict]):
+    """
+    Publishes messages committed for a conversation to its subscribers.
+
+    Args:
+        conversation_id: The ID of the conversation.
+        messages (list[dict]): The serialized messages (`MessageSerializer` data).
+    """
+    if not settings.MESSAGE_EVENTS_ENABLED or not messages:
+        return
+    try:
+        get_redis_connection("default").publish(
+            CHANNEL.format(conversation_id), json.dumps(messages)
+        )
+    except RedisError as e:
+        logger.warning("Could not publish messages: %s", e)
+
+
+async def apublish_messages(conversation_id, messages: list[dict]):
+    """
+    Asynchronous version of `publish_messages`, using the asyncio Redis client.
+    """
+    if not settings.MESSAGE_EVENTS_ENABLED or not messages:
+        return
+    try:
+        await get_async_redis_connection("default").publish(
+            CHANNEL.format(conversation_id), json.dumps(messages)
+        )
+    except RedisError as e:
+        logger.warning("Could not publish messages: %s", e)
+
+
+class Subscription:
+    """
+    Subscription to the messages published for a conversation.
+    """
+
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    async def get(self, timeout: float) -> list[dict] | None:
+        """
+        Waits for the next batch of published messages.
+
+        Args:
+            timeout (float): The maximum time to wait, in seconds.
+        Returns:
+            list[dict] | None: The serialized messages, or None if nothing was
+            published in time.
+        """
+        message = await self._pubsub.get_message(
+            ignore_subscribe_messages=True, timeout=timeout
+        )
+        if message is None:
+            return None
+        return json.loads(message["data"])
+
+
+@asynccontextmanager
+async def subscribe(conversation_id):
+    """
+    Subscribes to the messages published for a conversation. Messages published
+    once the context is entered are delivered, and the Redis connection (from the
+    pub/sub pool) is given back when it exits.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    Yields:
+        Subscription: The subscription.
+    """
+    pubsub = get_async_pubsub_connection("default").pubsub()
+    channel = CHANNEL.format(conversation_id)
+    await pubsub.subscribe(channel)
+    try:
+        yield Subscription(pubsub)
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.aclose()
@@ -0,0 +1,132 @@
+import csv
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.utils import json
+from . import archive
+from .constants import EXPORT_CHUNK_SIZE
+from .models import Conversation
+
+EXPORT_FIELDS = [
+    "conversation_id",
+    "status",
+    "created_at",
+    "updated_at",
+    "message_id",
+    "type",
+    "content",
+    "timestamp",
+]
+
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+_datetime_field = serializers.DateTimeField()
+
+
+def export_rows(status=None, since=None, until=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterates over every message of the selected conversations, joined with its
+    conversation, as one row per message. The messages of archived conversations
+    are read from their archive, in the same shape. Conversations without messages
+    yield a single row with empty message columns.
+
+    The rows come from a single query read through a server-side cursor, so only
+    `chunk_size` rows, and the archive of one conversation, are held in memory at
+    a time. The cursor is read in a transaction: outside of one, PostgreSQL would
+    materialize the whole result to keep the cursor open past the commit, and a
+    transaction-level pooler (PgBouncer) would not keep it at all.
+
+    Args:
+        status (str): Only export conversations with this status.
+        since (datetime): Only export conversations created at or after this time.
+        until (datetime): Only export conversations created before this time.
+        chunk_size (int): The number of rows fetched from the database at a time.
+    Yields:
+        list: The row values, in the order of `EXPORT_FIELDS`.
+    """
+    conversations = Conversation.objects.all()
+    if status is not None:
+        conversations = conversations.filter(status=status)
+    if since is not None:
+        conversations = conversations.filter(created_at__gte=since)
+    if until is not None:
+        conversations = conversations.filter(created_at__lt=until)
+
+    rows = conversations.order_by(
+        "created_at", "id", "messages__timestamp", "messages__id"
+    ).values_list(
+        "id",
+        "status",
+        "created_at",
+        "updated_at",
+        "messages__id",
+        "messages__type",
+        "messages__content",
+        "messages__timestamp",
+        # Archived conversations have no message rows left, so their archive is
+        # joined to their single row.
+        "archive__messages",
+    )
+    with transaction.atomic():
+        for *row, archived in rows.iterator(chunk_size=chunk_size):
+            conversation = [_format_value(value) for value in row[:4]]
+            if archived is None:
+                yield conversation + [_format_value(value) for value in row[4:]]
+                continue
+            for message in archive.decompress(archived):
+                yield conversation + [
+                    message["id"],
+                    message["type"],
+                    message["content"],
+                    message["timestamp"],
+                ]
+
+
+def _format_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    if hasattr(value, "isoformat"):
+        return _datetime_field.to_representation(value)
+    return str(value)
+
+
+class _Echo:
+    """
+    File-like object handing back what is written, so `csv.writer` can format
+    rows one at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_export(export_format: str, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Formats export rows as NDJSON or CSV, in chunks of `chunk_size` rows.
+
+    Args:
+        export_format (str): "ndjson" or "csv".
+        rows: The rows, as returned by `export_rows`.
+        chunk_size (int): The number of rows per yielded chunk.
+    Yields:
+        str: The formatted chunks. CSV output starts with a header line.
+    """
+    if export_format == "csv":
+        writer = csv.writer(_Echo())
+        format_row = writer.writerow
+        yield format_row(EXPORT_FIELDS)
+    else:
+
+        def format_row(row):
+            return json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+    lines = []
+    for row in rows:
+        lines.append(format_row(row))
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
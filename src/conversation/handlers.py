@@ -1,7 +1,12 @@
+import uuid
+from collections import Counter, defaultdict
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 from django.db import transaction, IntegrityError
+from . import detail_cache, events, ingest, metrics, status_cache
+from .constants import BUFFER_TIMEOUT
 from .models import Conversation, Message
+from .serializers import MessageSerializer
 from .tasks import (
     schedule_message_processing,
     buffer_message_until_conversation_exists,
@@ -19,10 +24,10 @@ def handle_new_conversation(payload: dict):
     Raises:
         ValueError: If the conversation already exists.
     """
+    metrics.time_transaction("new_conversation")
     data = payload["data"]
-    if Conversation.objects.filter(id=data["id"]).exists():
+    if not Conversation.objects.create_if_absent(_parse_id(data["id"])):
         raise ValueError("Conversation already exists")
-    Conversation.objects.create(id=data["id"], status="OPEN")
     process_buffer_for_conversation.delay(data["id"], payload["timestamp"])
 
 
@@ -30,57 +35,257 @@ def handle_new_conversation(payload: dict):
 def handle_new_message(payload: dict, from_buffer=False):
     """
     Handle the creation of a new message in an existing conversation.
+    The message is inserted if its conversation is open, in a single statement.
+    The conversation is only read when the insert is refused, to tell why.
+    Messages to conversations known to be closed (`status_cache`) are refused
+    without reaching the database.
 
     Args:
         payload (dict): The payload containing message data.
         from_buffer (bool): Indicates if the message is being processed from a buffer.
     Raises:
-        ValueError: If the conversation does not exist or is closed.
-        IntegrityError: If the message ID already exists.
+        ValueError: If the conversation does not exist or is closed, or if the
+        message ID already exists.
     """
+    metrics.time_transaction("new_message")
     data = payload["data"]
-    conv_id = data["conversation_id"]
-    ts = parse_datetime(payload["timestamp"])
-    try:
-        conversation = Conversation.objects.get(id=conv_id)
-        if conversation.status == "CLOSED":
+    conv_id = _parse_id(data["conversation_id"])
+    if status_cache.is_closed(conv_id):
+        raise ValueError("Conversation is closed")
+    message = Message.objects.create_in_open_conversation(
+        id=_parse_id(data["id"]),
+        conversation_id=conv_id,
+        type="INBOUND",
+        content=data["content"],
+        timestamp=parse_datetime(payload["timestamp"]),
+    )
+    if message is None:
+        conv_status = (
+            Conversation.objects.filter(id=conv_id)
+            .values_list("status", flat=True)
+            .first()
+        )
+        if conv_status == "CLOSED":
+            status_cache.mark_closed([conv_id])
             raise ValueError("Conversation is closed")
-    except Conversation.DoesNotExist:
+        if conv_status is not None:
+            raise ValueError("Message ID already exists")
         if from_buffer:
             raise ValueError("Conversation does not exist and exceeded delay tolerance")
         buffer_message_until_conversation_exists.delay(payload)
         return
 
-    try:
-        Message.objects.create(
-            id=data["id"],
-            conversation=conversation,
-            type="INBOUND",
-            content=data["content"],
-            timestamp=ts,
-        )
-    except IntegrityError:
-        raise ValueError("Message ID already exists")
-
-    schedule_message_processing(conversation.id)
+    status_cache.remember_open(conv_id)
+    serialized = MessageSerializer(message).data
+    transaction.on_commit(lambda: detail_cache.append_messages(conv_id, [serialized]))
+    transaction.on_commit(lambda: events.publish_messages(conv_id, [serialized]))
+    schedule_message_processing(conv_id)
 
 
 @transaction.atomic
 def handle_close_conversation(payload: dict):
     """
-    Handle the closure of an existing conversation.
+    Handle the closure of an existing conversation, with a single conditional
+    update. The conversation is only read when nothing was updated, to tell why.
 
     Args:
         payload (dict): The payload containing conversation data.
     Raises:
         ValueError: If the conversation does not exist or is already closed.
     """
-    data = payload["data"]
-    try:
-        conv = Conversation.objects.get(id=data["id"])
-        if conv.status == "CLOSED":
+    metrics.time_transaction("close_conversation")
+    conv_id = _parse_id(payload["data"]["id"])
+    if not Conversation.objects.close(conv_id):
+        if Conversation.objects.filter(id=conv_id).exists():
             raise ValueError("Already closed")
-        conv.status = "CLOSED"
-        conv.save()
-    except Conversation.DoesNotExist:
         raise ValueError("Conversation not found")
+    transaction.on_commit(lambda: detail_cache.invalidate(conv_id))
+    transaction.on_commit(lambda: ingest.mark_closed([conv_id]))
+    transaction.on_commit(lambda: status_cache.mark_closed([conv_id]))
+
+
+def _parse_id(value) -> uuid.UUID:
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise ValueError("Invalid ID")
+
+
+def _handle_single(payload: dict):
+    handler = {
+        "NEW_CONVERSATION": handle_new_conversation,
+        "NEW_MESSAGE": handle_new_message,
+        "CLOSE_CONVERSATION": handle_close_conversation,
+    }[payload["type"]]
+    handler(payload)
+
+
+def handle_batch(payloads: list[dict]) -> list[str | None]:
+    """
+    Handle a batch of validated webhook events in a single transaction.
+
+    Events are applied in order against an in-memory view of the referenced
+    conversations and messages, which is loaded with one query each. The
+    resulting rows are written with bulk inserts/updates, so a batch costs a
+    constant number of round trips regardless of its size. The per-event
+    outcome follows the same rules as the single-event handlers.
+
+    If a concurrent writer makes the bulk insert fail, the batch is replayed
+    event by event through the single-event handlers.
+
+    Args:
+        payloads (list[dict]): The validated event payloads, in arrival order.
+    Returns:
+        list[str | None]: For each payload, None on success or the error message.
+    """
+    try:
+        return _apply_batch(payloads)
+    except IntegrityError:
+        pass
+
+    results = []
+    for payload in payloads:
+        try:
+            _handle_single(payload)
+            results.append(None)
+        except ValueError as e:
+            results.append(str(e))
+    return results
+
+
+def _on_batch_commit(closed_conversations: set, created: dict):
+    for conv_id in closed_conversations:
+        detail_cache.invalidate(conv_id)
+    for conv_id, messages in created.items():
+        if conv_id not in closed_conversations:
+            detail_cache.append_messages(conv_id, messages)
+        events.publish_messages(conv_id, messages)
+    ingest.mark_closed(closed_conversations)
+    status_cache.mark_closed(closed_conversations)
+
+
+def _apply_batch(payloads: list[dict]) -> list[str | None]:
+    conversation_ids = set()
+    message_ids = set()
+    for payload in payloads:
+        data = payload["data"]
+        try:
+            if payload["type"] == "NEW_MESSAGE":
+                conversation_ids.add(_parse_id(data["conversation_id"]))
+                message_ids.add(_parse_id(data["id"]))
+            else:
+                conversation_ids.add(_parse_id(data["id"]))
+        except ValueError:
+            continue
+
+    results = []
+    created_conversations = {}
+    closed_conversations = set()
+    new_messages = {}
+    pending = defaultdict(list)
+    buffer_outcomes = Counter()
+
+    with transaction.atomic():
+        metrics.time_transaction("batch")
+        statuses = dict(
+            Conversation.objects.select_for_update()
+            .filter(id__in=conversation_ids)
+            .values_list("id", "status")
+        )
+        known_messages = Message.objects.existing_ids(message_ids)
+
+        def add_message(conversation_id, message_id, payload):
+            if message_id in known_messages:
+                raise ValueError("Message ID already exists")
+            known_messages.add(message_id)
+            new_messages[message_id] = Message(
+                id=message_id,
+                conversation_id=conversation_id,
+                type="INBOUND",
+                content=payload["data"]["content"],
+                timestamp=parse_datetime(payload["timestamp"]),
+            )
+
+        for payload in payloads:
+            data = payload["data"]
+            event_type = payload["type"]
+            try:
+                if event_type == "NEW_CONVERSATION":
+                    conv_id = _parse_id(data["id"])
+                    if conv_id in statuses:
+                        raise ValueError("Conversation already exists")
+                    statuses[conv_id] = "OPEN"
+                    created_conversations[conv_id] = payload
+                    conversation_ts = parse_datetime(payload["timestamp"])
+                    for message_id, buffered in pending.pop(conv_id, []):
+                        message_ts = parse_datetime(buffered["timestamp"])
+                        if (
+                            conversation_ts - message_ts
+                        ).total_seconds() > BUFFER_TIMEOUT:
+                            buffer_outcomes["expired"] += 1
+                            continue
+                        try:
+                            add_message(conv_id, message_id, buffered)
+                            buffer_outcomes["recovered"] += 1
+                        except ValueError:
+                            buffer_outcomes["failed"] += 1
+
+                elif event_type == "NEW_MESSAGE":
+                    conv_id = _parse_id(data["conversation_id"])
+                    message_id = _parse_id(data["id"])
+                    conv_status = statuses.get(conv_id)
+                    if conv_status is None:
+                        pending[conv_id].append((message_id, payload))
+                    elif conv_status == "CLOSED":
+                        raise ValueError("Conversation is closed")
+                    else:
+                        add_message(conv_id, message_id, payload)
+
+                elif event_type == "CLOSE_CONVERSATION":
+                    conv_id = _parse_id(data["id"])
+                    conv_status = statuses.get(conv_id)
+                    if conv_status is None:
+                        raise ValueError("Conversation not found")
+                    if conv_status == "CLOSED":
+                        raise ValueError("Already closed")
+                    statuses[conv_id] = "CLOSED"
+                    closed_conversations.add(conv_id)
+
+                results.append(None)
+            except ValueError as e:
+                results.append(str(e))
+
+        Conversation.objects.bulk_create(
+            [
+                Conversation(id=conv_id, status="OPEN")
+                for conv_id in created_conversations
+            ]
+        )
+        Message.objects.bulk_create(new_messages.values())
+        if closed_conversations:
+            Conversation.objects.filter(id__in=closed_conversations).update(
+                status="CLOSED", updated_at=now()
+            )
+
+        created = defaultdict(list)
+        for message in new_messages.values():
+            created[message.conversation_id].append(MessageSerializer(message).data)
+        transaction.on_commit(lambda: _on_batch_commit(closed_conversations, created))
+        for outcome, count in buffer_outcomes.items():
+            transaction.on_commit(
+                lambda outcome=outcome, count=count: metrics.increment(
+                    "conversation_buffer_messages_total", count, outcome=outcome
+                )
+            )
+
+    for payload in created_conversations.values():
+        process_buffer_for_conversation.delay(
+            payload["data"]["id"], payload["timestamp"]
+        )
+    for buffered in pending.values():
+        for _, payload in buffered:
+            buffer_message_until_conversation_exists.delay(payload)
+    for conv_id in {message.conversation_id for message in new_messages.values()}:
+        schedule_message_processing(conv_id)
+
+    return results
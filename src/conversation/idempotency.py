@@ -0,0 +1,123 @@
+import logging
+import time
+import uuid
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from .async_redis import get_async_redis_connection
+from .constants import IDEMPOTENCY_BUCKET, IDEMPOTENCY_TTL
+
+# Filter for webhook deliveries the gateway retries. The events applied with
+# success are recorded in Redis, and a known event is answered as a duplicate
+# without reaching the database, with the status the handler would have returned.
+# The unique constraints of the database remain the final guarantee: an event
+# missing from the filter (expired, or Redis down) goes through the handlers.
+#
+# Events are kept in one Redis set per `IDEMPOTENCY_BUCKET` seconds, expiring
+# after `IDEMPOTENCY_TTL`: a lookup checks the sets of the window in one pipelined
+# round trip, and members are 17 bytes (an event code and the binary UUID).
+
+logger = logging.getLogger(__name__)
+
+KEY = "idempotency:{}"
+
+_EVENT_CODES = {
+    "NEW_CONVERSATION": b"c",
+    "NEW_MESSAGE": b"m",
+    "CLOSE_CONVERSATION": b"x",
+}
+
+
+def _member(payload: dict) -> bytes | None:
+    code = _EVENT_CODES.get(payload.get("type"))
+    if code is None:
+        return None
+    data = payload["data"]
+    try:
+        return code + uuid.UUID(str(data["id"])).bytes
+    except (KeyError, ValueError):
+        return None
+
+
+def _keys() -> list[str]:
+    current = int(time.time()) // IDEMPOTENCY_BUCKET
+    # One more bucket than the TTL spans, as the current one is only partly elapsed.
+    buckets = IDEMPOTENCY_TTL // IDEMPOTENCY_BUCKET + 1
+    return [KEY.format(bucket) for bucket in range(current, current - buckets, -1)]
+
+
+def seen(payload: dict) -> bool:
+    """
+    Tells whether an event was already applied.
+
+    Args:
+        payload (dict): The validated event payload.
+    Returns:
+        bool: True if the event is a known duplicate. False if it is not, if the
+        filter is disabled or if Redis cannot be reached.
+    """
+    member = _member(payload)
+    if not settings.IDEMPOTENCY_ENABLED or member is None:
+        return False
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for key in _keys():
+            pipe.sismember(key, member)
+        return any(pipe.execute())
+    except RedisError as e:
+        logger.warning("Could not check for duplicate events: %s", e)
+        return False
+
+
+async def aseen(payload: dict) -> bool:
+    """
+    Asynchronous version of `seen`, using the asyncio Redis client.
+    """
+    member = _member(payload)
+    if not settings.IDEMPOTENCY_ENABLED or member is None:
+        return False
+    try:
+        pipe = get_async_redis_connection("default").pipeline(transaction=False)
+        for key in _keys():
+            pipe.sismember(key, member)
+        return any(await pipe.execute())
+    except RedisError as e:
+        logger.warning("Could not check for duplicate events: %s", e)
+        return False
+
+
+def record(payload: dict):
+    """
+    Records an applied event, so its retries are answered as duplicates.
+
+    Args:
+        payload (dict): The validated event payload.
+    """
+    member = _member(payload)
+    if not settings.IDEMPOTENCY_ENABLED or member is None:
+        return
+    key = _keys()[0]
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        pipe.sadd(key, member)
+        pipe.expire(key, IDEMPOTENCY_TTL + IDEMPOTENCY_BUCKET)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record event: %s", e)
+
+
+async def arecord(payload: dict):
+    """
+    Asynchronous version of `record`, using the asyncio Redis client.
+    """
+    member = _member(payload)
+    if not settings.IDEMPOTENCY_ENABLED or member is None:
+        return
+    key = _keys()[0]
+    try:
+        pipe = get_async_redis_connection("default").pipeline(transaction=False)
+        pipe.sadd(key, member)
+        pipe.expire(key, IDEMPOTENCY_TTL + IDEMPOTENCY_BUCKET)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record event: %s", e)
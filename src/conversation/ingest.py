@@ -0,0 +1,329 @@
+import json
+import logging
+import uuid
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError, ResponseError
+from . import handlers
+from .async_redis import get_async_redis_connection
+from .constants import (
+    INGEST_BATCH_SIZE,
+    INGEST_BLOCK_MS,
+    INGEST_GROUP,
+    INGEST_LEASE_TTL,
+    INGEST_STATE_TTL,
+)
+from .models import Conversation
+from .sharding import shard_for
+
+# Write-ahead ingestion: `/webhook/` checks an event against the conversation and
+# message state kept in Redis, appends it to a Redis Stream and answers right away.
+# `ingest_worker` processes apply the streams to the database in micro-batches
+# through `handlers.handle_batch`, so the business rules are the ones of the
+# direct handlers.
+#
+# Events are sharded by conversation over `INGEST_STREAM_SHARDS` streams, and a
+# shard is consumed by a single worker at a time (a lease in Redis), so the events
+# of a conversation are applied in arrival order. Entries are acknowledged once
+# their batch is committed: after a crash, the next owner of the shard claims the
+# pending entries and applies them again, which the handlers turn into no-ops.
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "ingest:events:{}"
+STATUS_KEY = "ingest:conversation:{}"
+MESSAGE_KEY = "ingest:message:{}"
+LEASE_KEY = "ingest:lease:{}"
+
+# Status passed to the append script for a conversation that is not in the database.
+ABSENT = "ABSENT"
+
+# Checks an event against the known state, records its effect on the state and
+# appends it to the stream. KEYS: conversation status, message ID (only read for
+# NEW_MESSAGE), stream. ARGV: event type, payload, state TTL, conversation status
+# read from the database ('' if it was not read yet).
+# Returns {'miss'} if the conversation status is unknown, {'error', message} if the
+# event breaks a rule, or {'ok', entry ID}.
+_APPEND_SCRIPT = """
+local status = redis.call('GET', KEYS[1])
+if not status then
+    if ARGV[4] == '' then
+        return {'miss'}
+    end
+    if ARGV[4] ~= 'ABSENT' then
+        status = ARGV[4]
+        redis.call('SET', KEYS[1], status, 'EX', ARGV[3])
+    end
+end
+
+local event_type = ARGV[1]
+if event_type == 'NEW_CONVERSATION' then
+    if status then
+        return {'error', 'Conversation already exists'}
+    end
+    status = 'OPEN'
+elseif event_type == 'NEW_MESSAGE' then
+    if status == 'CLOSED' then
+        return {'error', 'Conversation is closed'}
+    end
+    if not redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[3]) then
+        return {'error', 'Message ID already exists'}
+    end
+else
+    if not status then
+        return {'error', 'Conversation not found'}
+    end
+    if status == 'CLOSED' then
+        return {'error', 'Already closed'}
+    end
+    status = 'CLOSED'
+end
+
+if status then
+    redis.call('SET', KEYS[1], status, 'EX', ARGV[3])
+end
+return {'ok', redis.call('XADD', KEYS[3], '*', 'event', ARGV[2])}
+"""
+
+# Extends a lease, if it is still held by the caller.
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Releases a lease, if it is still held by the caller.
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _parse_id(value) -> str:
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise ValueError("Invalid ID")
+
+
+def append(payload: dict) -> str | None:
+    """
+    Checks a webhook event against the ingestion state and appends it to the stream
+    of its conversation shard. The conversation status is read from the database
+    the first time the conversation is seen.
+
+    Args:
+        payload (dict): The validated event payload.
+    Returns:
+        str | None: None if the event was appended, or the error message of the
+        rule it breaks.
+    Raises:
+        ValueError: If an ID is not a valid UUID.
+    """
+    data = payload["data"]
+    if payload["type"] == "NEW_MESSAGE":
+        conv_id = _parse_id(data["conversation_id"])
+        message_key = MESSAGE_KEY.format(_parse_id(data["id"]))
+    else:
+        conv_id = _parse_id(data["id"])
+        message_key = STATUS_KEY.format(conv_id)
+    keys = [
+        STATUS_KEY.format(conv_id),
+        message_key,
+        STREAM_KEY.format(shard_for(conv_id, settings.INGEST_STREAM_SHARDS)),
+    ]
+    event = json.dumps(payload, cls=DjangoJSONEncoder)
+
+    redis_conn = get_redis_connection("default")
+    script = redis_conn.register_script(_APPEND_SCRIPT)
+    result = script(keys=keys, args=[payload["type"], event, INGEST_STATE_TTL, ""])
+    if result[0] == b"miss":
+        known = (
+            Conversation.objects.filter(id=conv_id)
+            .values_list("status", flat=True)
+            .first()
+        )
+        result = script(
+            keys=keys,
+            args=[payload["type"], event, INGEST_STATE_TTL, known or ABSENT],
+        )
+    if result[0] == b"error":
+        return result[1].decode("utf-8")
+    return None
+
+
+def mark_closed(conversation_ids):
+    """
+    Records conversations closed outside of the ingestion log (batch and ASGI
+    webhooks), so later events are checked against the right status. Conversations
+    unknown to the ingestion state are left out, they are read from the database.
+
+    Args:
+        conversation_ids: The IDs of the closed conversations.
+    """
+    if not settings.INGEST_ENABLED:
+        return
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for conv_id in conversation_ids:
+            pipe.set(STATUS_KEY.format(conv_id), "CLOSED", xx=True, ex=INGEST_STATE_TTL)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record closed conversations: %s", e)
+
+
+async def amark_closed(conversation_ids):
+    """
+    Asynchronous version of `mark_closed`, using the asyncio Redis client.
+    """
+    if not settings.INGEST_ENABLED:
+        return
+    try:
+        pipe = get_async_redis_connection("default").pipeline(transaction=False)
+        for conv_id in conversation_ids:
+            pipe.set(STATUS_KEY.format(conv_id), "CLOSED", xx=True, ex=INGEST_STATE_TTL)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record closed conversations: %s", e)
+
+
+class IngestWorker:
+    """
+    Applies the ingestion streams to the database. Each worker holds leases on a
+    share of the shards and only reads the streams of the shards it holds.
+
+    Args:
+        consumer (str): The name of the worker in the consumer group, unique among
+            the running workers.
+        shards (int): The number of shards. Defaults to `INGEST_STREAM_SHARDS`.
+        batch_size (int): The maximum number of entries applied per batch.
+        block_ms (int): How long to wait for new entries, in milliseconds.
+    """
+
+    def __init__(
+        self,
+        consumer: str,
+        shards: int | None = None,
+        batch_size: int = INGEST_BATCH_SIZE,
+        block_ms: int = INGEST_BLOCK_MS,
+    ):
+        self.consumer = consumer
+        self.shards = shards or settings.INGEST_STREAM_SHARDS
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.owned = set()
+        self.redis = get_redis_connection("default")
+        self._renew = self.redis.register_script(_RENEW_SCRIPT)
+        self._release = self.redis.register_script(_RELEASE_SCRIPT)
+
+    def setup(self):
+        """
+        Creates the consumer group of every stream, if it does not exist yet.
+        """
+        for shard in range(self.shards):
+            try:
+                self.redis.xgroup_create(
+                    STREAM_KEY.format(shard), INGEST_GROUP, id="0", mkstream=True
+                )
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def acquire(self):
+        """
+        Renews the leases held by the worker and takes the free ones. The entries
+        left pending by the previous owner of a newly taken shard are claimed, so
+        they are applied before the new entries.
+        """
+        lease_ms = INGEST_LEASE_TTL * 1000
+        for shard in range(self.shards):
+            key = LEASE_KEY.format(shard)
+            if shard in self.owned:
+                if not self._renew(keys=[key], args=[self.consumer, lease_ms]):
+                    logger.warning("Lost the lease on ingestion shard %s", shard)
+                    self.owned.discard(shard)
+            elif self.redis.set(key, self.consumer, nx=True, px=lease_ms):
+                self.owned.add(shard)
+                self.claim(shard)
+
+    def claim(self, shard: int):
+        stream = STREAM_KEY.format(shard)
+        start = "0-0"
+        while True:
+            start, *_ = self.redis.xautoclaim(
+                stream,
+                INGEST_GROUP,
+                self.consumer,
+                min_idle_time=0,
+                start_id=start,
+                count=self.batch_size,
+            )
+            if start == b"0-0":
+                return
+
+    def release(self):
+        """
+        Releases the leases held by the worker, so other workers take the shards
+        right away.
+        """
+        for shard in self.owned:
+            self._release(keys=[LEASE_KEY.format(shard)], args=[self.consumer])
+        self.owned.clear()
+
+    def run_once(self) -> int:
+        """
+        Applies one batch per owned stream: the entries left pending by a failed
+        batch if there are any, or else the new entries, waiting up to `block_ms`.
+
+        Returns:
+            int: The number of entries applied.
+        Raises:
+            DatabaseError: If a batch could not be applied. Its entries stay
+            pending and are applied again on the next run.
+        """
+        self.acquire()
+        streams = [STREAM_KEY.format(shard) for shard in sorted(self.owned)]
+        if not streams:
+            return 0
+
+        entries = self.redis.xreadgroup(
+            INGEST_GROUP,
+            self.consumer,
+            {stream: "0" for stream in streams},
+            count=self.batch_size,
+        )
+        entries = [(stream, messages) for stream, messages in entries if messages]
+        if not entries:
+            entries = self.redis.xreadgroup(
+                INGEST_GROUP,
+                self.consumer,
+                {stream: ">" for stream in streams},
+                count=self.batch_size,
+                block=self.block_ms,
+            )
+        return sum(self.apply(stream, messages) for stream, messages in entries or [])
+
+    def apply(self, stream, messages: list) -> int:
+        ids, payloads = [], []
+        for entry_id, fields in messages:
+            ids.append(entry_id)
+            # Entries deleted after being read have no fields.
+            if fields:
+                payloads.append(json.loads(fields[b"event"]))
+
+        if payloads:
+            for payload, error in zip(payloads, handlers.handle_batch(payloads)):
+                if error is not None:
+                    logger.info(
+                        "Ingested %s event rejected: %s", payload["type"], error
+                    )
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xack(stream, INGEST_GROUP, *ids)
+        pipe.xdel(stream, *ids)
+        pipe.execute()
+        return len(payloads)
@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.db.utils import ConnectionHandler
+
+from conversation.benchmark import CONNECTION_MODES, connection_modes, summarize
+
+# Alias of the benchmarked connections, so their pool is not the one of `default`.
+ALIAS = "bench"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the cost of database connections: runs short requests from "
+        "concurrent threads against PostgreSQL with a new connection per request, "
+        "persistent connections and a connection pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode", choices=CONNECTION_MODES, action="append", dest="modes"
+        )
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument(
+            "--query", default="SELECT 1", help="The query run by each request."
+        )
+        parser.add_argument("--output", help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        database = settings.DATABASES["default"]
+        if database["ENGINE"] != "django.db.backends.postgresql":
+            raise CommandError("The connection benchmark needs PostgreSQL.")
+
+        threads = options["threads"]
+        per_thread = max(options["requests"] // threads, 1)
+        modes = connection_modes(database, pool_size=threads)
+        results = {
+            mode: self.run(modes[mode], threads, per_thread, options["query"])
+            for mode in options["modes"] or CONNECTION_MODES
+        }
+
+        self.stdout.write(json.dumps(results, indent=2))
+        if "off" in results:
+            baseline = results["off"]["requests_per_second"]
+            for mode, metrics in results.items():
+                self.stdout.write(
+                    f"  {mode:<10} {metrics['requests_per_second']:>10.0f} req/s "
+                    f"x{metrics['requests_per_second'] / baseline:.2f}"
+                )
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(results, indent=2))
+
+    def run(self, database: dict, threads: int, per_thread: int, query: str) -> dict:
+        """
+        Runs `per_thread` requests from each thread, every request doing what a
+        view does with the database: get a connection, run a query, and give the
+        connection back (`close_if_unusable_or_obsolete`, as at the end of a
+        request).
+        """
+        # ConnectionHandler requires a default database, which is never used.
+        handler = ConnectionHandler(
+            {"default": {"ENGINE": "django.db.backends.dummy"}, ALIAS: database}
+        )
+        latencies, connects, errors = [], [], []
+        opened = [0]
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+
+        def on_connect(sender, connection, **kwargs):
+            if connection.alias == ALIAS:
+                with lock:
+                    opened[0] += 1
+
+        def client():
+            connection = handler[ALIAS]
+            own_latencies, own_connects = [], []
+            try:
+                # A first request outside of the measures opens the pool.
+                self.request(connection, query)
+                start.wait()
+                for _ in range(per_thread):
+                    sent = time.perf_counter()
+                    own_connects.append(self.request(connection, query))
+                    own_latencies.append(time.perf_counter() - sent)
+            except threading.BrokenBarrierError:
+                return
+            except Exception as e:
+                errors.append(e)
+                start.abort()
+                return
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(own_latencies)
+                connects.extend(own_connects)
+
+        workers = [threading.Thread(target=client) for _ in range(threads)]
+        connection_created.connect(on_connect, weak=False)
+        try:
+            for worker in workers:
+                worker.start()
+            start.wait()
+            started = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+        except threading.BrokenBarrierError:
+            for worker in workers:
+                worker.join()
+        finally:
+            connection_created.disconnect(on_connect)
+        if errors:
+            raise CommandError(f"A request failed: {errors[0]}")
+
+        connection = handler[ALIAS]
+        if connection.pool is not None:
+            # Connections handed out by a pool also send `connection_created`.
+            opened[0] = connection.pool.get_stats().get("connections_num", 0)
+            connection.close_pool()
+
+        return {
+            "requests": len(latencies),
+            "elapsed_seconds": elapsed,
+            "requests_per_second": len(latencies) / elapsed if elapsed else None,
+            "latency_ms": summarize(latencies),
+            "connect_ms": summarize(connects),
+            "server_connections_opened": opened[0],
+        }
+
+    @staticmethod
+    def request(connection, query: str) -> float:
+        """
+        Runs one request, and returns the time spent getting a connection.
+        """
+        started = time.perf_counter()
+        connection.ensure_connection()
+        connected = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            cursor.fetchall()
+        connection.close_if_unusable_or_obsolete()
+        return connected - started
@@ -0,0 +1,284 @@
+import json
+import logging
+import subprocess
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.timezone import now
+
+from config import celery_app
+from conversation.benchmark import (
+    SCENARIOS,
+    QueryCounter,
+    TaskMonitor,
+    build_events,
+    compare,
+    summarize,
+)
+from conversation.models import Message
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the webhook pipeline: sends a generated event stream to "
+        "/webhook/ and runs the Celery tasks in an in-process worker, against a "
+        "throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", choices=SCENARIOS, default="mixed")
+        parser.add_argument("--conversations", type=int, default=50)
+        parser.add_argument(
+            "--messages", type=int, default=10, help="Messages per conversation."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--redis-url",
+            help="Use this Redis server instead of an in-memory fakeredis.",
+        )
+        parser.add_argument(
+            "--pool",
+            choices=["solo", "threads"],
+            default="solo",
+            help="Pool of the in-process Celery worker.",
+        )
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument(
+            "--drain-timeout",
+            type=float,
+            default=60,
+            help="Seconds to wait for the queued tasks after the last request.",
+        )
+        parser.add_argument("--output-dir", default="bench-results")
+        parser.add_argument(
+            "--compare", metavar="RESULT", help="A previous result file to compare."
+        )
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        baseline = self.load(options["compare"]) if options["compare"] else None
+        events = build_events(
+            options["scenario"],
+            options["conversations"],
+            options["messages"],
+            seed=options["seed"],
+        )
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options["keepdb"]
+        )
+        try:
+            with override_settings(CACHES=self.caches(options["redis_url"])):
+                with TaskMonitor() as monitor, self.worker(options):
+                    metrics = self.run(events, monitor, options["drain_timeout"])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"]
+            )
+            teardown_test_environment()
+
+        commit, dirty = self.revision()
+        result = {
+            "commit": commit,
+            "dirty": dirty,
+            "created_at": now().isoformat(),
+            "scenario": options["scenario"],
+            "options": {
+                key: options[key]
+                for key in (
+                    "conversations",
+                    "messages",
+                    "seed",
+                    "pool",
+                    "concurrency",
+                    "redis_url",
+                )
+            },
+            "database": connection.vendor,
+            "metrics": metrics,
+        }
+
+        output_dir = Path(options["output_dir"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / (
+            f"{options['scenario']}-{commit}{'-dirty' if dirty else ''}.json"
+        )
+        path.write_text(json.dumps(result, indent=2))
+
+        self.stdout.write(json.dumps(metrics, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Saved results to {path}"))
+        if baseline is not None:
+            self.print_comparison(baseline, result)
+
+    def run(self, events: list[dict], monitor: TaskMonitor, drain_timeout: float):
+        client = Client()
+        url = reverse("webhook")
+        latencies, statuses = [], Counter()
+        queries = 0
+        messages = 0
+        last_message_at = {}
+
+        # Messages sent to closed conversations are expected to be rejected.
+        logging.getLogger("django.request").setLevel(logging.ERROR)
+        started = time.perf_counter()
+        for event in events:
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                sent = time.perf_counter()
+                response = client.post(url, event, content_type="application/json")
+                latencies.append(time.perf_counter() - sent)
+            queries += counter.count
+            statuses[str(response.status_code)] += 1
+            if event["type"] == "NEW_MESSAGE":
+                messages += 1
+                if response.status_code < 400:
+                    last_message_at[event["data"]["conversation_id"]] = now()
+        elapsed = time.perf_counter() - started
+
+        drained = monitor.wait(drain_timeout)
+        if not drained:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"Tasks still pending after {drain_timeout}s, results are partial."
+                )
+            )
+
+        replied = dict(
+            Message.objects.filter(
+                type="OUTBOUND", conversation_id__in=list(last_message_at)
+            )
+            .values_list("conversation_id")
+            .annotate(last=Max("timestamp"))
+        )
+        time_to_outbound = [
+            (last - last_message_at[str(conversation_id)]).total_seconds()
+            for conversation_id, last in replied.items()
+        ]
+        enqueued = sum(monitor.enqueued.values())
+
+        return {
+            "events": len(events),
+            "elapsed_seconds": elapsed,
+            "requests_per_second": len(events) / elapsed if elapsed else None,
+            "latency_ms": summarize(latencies),
+            "status_codes": dict(sorted(statuses.items())),
+            "db_queries_per_event": queries / len(events) if events else None,
+            "tasks_enqueued_per_message": enqueued / messages if messages else None,
+            "tasks": monitor.report(),
+            "time_to_outbound_ms": summarize(time_to_outbound),
+            "conversations_without_outbound": len(last_message_at) - len(replied),
+            "drained": drained,
+        }
+
+    def caches(self, redis_url: str | None) -> dict:
+        """
+        Points the default cache (and so every Redis helper of the app) at the
+        Redis used by the benchmark.
+        """
+        default = dict(settings.CACHES["default"])
+        options = dict(default.get("OPTIONS", {}))
+        if redis_url:
+            default["LOCATION"] = redis_url
+        else:
+            if fakeredis is None:
+                raise CommandError(
+                    "fakeredis is not installed, pass --redis-url to use a Redis server."
+                )
+            default["LOCATION"] = "redis://fakeredis:6379/0"
+            options["CONNECTION_POOL_KWARGS"] = {
+                "connection_class": fakeredis.FakeConnection,
+                "server": fakeredis.FakeServer(),
+            }
+        default["BACKEND"] = "django_redis.cache.RedisCache"
+        default["OPTIONS"] = options
+        return {**settings.CACHES, "default": default}
+
+    @contextmanager
+    def worker(self, options: dict):
+        """
+        Runs a Celery worker in a thread, consuming from an in-memory broker.
+
+        An eager setup is not offered: the debounced processing task reschedules
+        itself with a countdown, which eager mode would run right away, in a loop.
+        """
+        from celery.contrib.testing.worker import start_worker
+
+        # The app reads its configuration from the CELERY_ namespace of the settings.
+        overrides = {
+            "CELERY_BROKER_URL": "memory://",
+            "CELERY_TASK_ALWAYS_EAGER": False,
+            "CELERY_TASK_IGNORE_RESULT": True,
+        }
+        previous = {key: celery_app.conf.get(key) for key in overrides}
+        celery_app.conf.update(overrides)
+        try:
+            with start_worker(
+                celery_app,
+                pool=options["pool"],
+                concurrency=options["concurrency"],
+                perform_ping_check=False,
+            ):
+                yield
+        finally:
+            celery_app.conf.update(previous)
+
+    def load(self, path: str) -> dict:
+        try:
+            return json.loads(Path(path).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {path}: {e}")
+
+    def revision(self) -> tuple[str, bool]:
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            dirty = bool(
+                subprocess.run(
+                    ["git", "status", "--porcelain", "--untracked-files=no"],
+                    cwd=settings.BASE_DIR,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout.strip()
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return "unknown", False
+        return commit, dirty
+
+    def print_comparison(self, baseline: dict, result: dict):
+        self.stdout.write(
+            f"\nCompared to {baseline.get('commit', 'unknown')} "
+            f"({baseline.get('scenario', '?')}):"
+        )
+        rows = compare(baseline, result)
+        width = max((len(metric) for metric, *_ in rows), default=0)
+        for metric, old, new, change in rows:
+            delta = f"{change:+.1%}" if change is not None else "-"
+            self.stdout.write(
+                f"  {metric:<{width}} {self.number(old):>12} "
+                f"{self.number(new):>12} {delta:>9}"
+            )
+
+    @staticmethod
+    def number(value) -> str:
+        return "-" if value is None else f"{value:.6g}"
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from conversation.constants import EXPORT_CHUNK_SIZE
+from conversation.export import export_rows, stream_export
+from conversation.serializers import ExportQuerySerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports conversations and their messages as NDJSON or CSV, one row per "
+        "message, streaming from a server-side cursor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument("--status", help="OPEN or CLOSED.")
+        parser.add_argument(
+            "--since", help="Only conversations created at or after this time."
+        )
+        parser.add_argument(
+            "--until", help="Only conversations created before this time."
+        )
+        parser.add_argument(
+            "--output", help="File to write to. Defaults to the standard output."
+        )
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        query = ExportQuerySerializer(
+            data={
+                key: options[key]
+                for key in ("format", "status", "since", "until")
+                if options[key] is not None
+            }
+        )
+        if not query.is_valid():
+            raise CommandError(query.errors)
+        filters = query.validated_data
+        export_format = filters.pop("format")
+
+        chunks = stream_export(
+            export_format,
+            export_rows(chunk_size=options["chunk_size"], **filters),
+            chunk_size=options["chunk_size"],
+        )
+        if options["output"] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["output"], "w", encoding="utf-8", newline="") as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported to {options['output']}"))
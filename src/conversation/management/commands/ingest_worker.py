@@ -0,0 +1,73 @@
+import logging
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+from redis.exceptions import RedisError
+
+from conversation.constants import INGEST_BATCH_SIZE, INGEST_BLOCK_MS
+from conversation.ingest import IngestWorker
+
+logger = logging.getLogger(__name__)
+
+# Longest pause between attempts while the database or Redis is failing.
+MAX_BACKOFF = 30
+
+
+class Command(BaseCommand):
+    help = (
+        "Applies the webhook events of the ingestion log (Redis Streams) to the "
+        "database, in ordered micro-batches per conversation shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--consumer",
+            default=f"{socket.gethostname()}-{os.getpid()}",
+            help="Name of the worker in the consumer group. Must be unique.",
+        )
+        parser.add_argument(
+            "--shards", type=int, help="Defaults to INGEST_STREAM_SHARDS."
+        )
+        parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+        parser.add_argument("--block-ms", type=int, default=INGEST_BLOCK_MS)
+
+    def handle(self, *args, **options):
+        worker = IngestWorker(
+            options["consumer"],
+            shards=options["shards"],
+            batch_size=options["batch_size"],
+            block_ms=options["block_ms"],
+        )
+        worker.setup()
+
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.stderr.write(f"Ingestion worker {options['consumer']} started")
+        backoff = 0
+        try:
+            while self.running:
+                close_old_connections()
+                try:
+                    worker.run_once()
+                    backoff = 0
+                except (DatabaseError, RedisError) as e:
+                    backoff = min(max(backoff * 2, 1), MAX_BACKOFF)
+                    logger.error(
+                        "Ingestion batch failed, retrying in %ss: %s", backoff, e
+                    )
+                    time.sleep(backoff)
+                if not worker.owned:
+                    # Every shard is held by other workers, wait for a free one.
+                    time.sleep(options["block_ms"] / 1000)
+        finally:
+            worker.release()
+        self.stderr.write(f"Ingestion worker {options['consumer']} stopped")
+
+    def stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,82 @@
+import io
+import pstats
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from conversation.profiling import PROFILE_PATTERN
+
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarizes the profiles written by the profiling middleware and task "
+        "signals: the profiled requests and tasks by event, and the functions "
+        "where their time went, across all of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directory",
+            nargs="?",
+            help="The directory of the profiles. Defaults to PROFILING_DIR.",
+        )
+        parser.add_argument("--kind", choices=("request", "task"))
+        parser.add_argument(
+            "--event", help="Only the profiles of this event type, URL or task name."
+        )
+        parser.add_argument(
+            "--min-duration",
+            type=int,
+            default=0,
+            help="Only the profiles that took at least this many milliseconds.",
+        )
+        parser.add_argument("--sort", choices=SORT_KEYS, default="cumulative")
+        parser.add_argument("--limit", type=int, default=25, help="Functions to list.")
+        parser.add_argument(
+            "--full-paths",
+            action="store_true",
+            help="Keep the directories in the function locations.",
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(options["directory"] or settings.PROFILING_DIR)
+        files = []
+        durations = defaultdict(list)
+        for path in sorted(directory.glob("*.prof")):
+            match = PROFILE_PATTERN.match(path.name)
+            if match is None:
+                continue
+            duration = int(match["duration"])
+            if (
+                (options["kind"] and match["kind"] != options["kind"])
+                or (options["event"] and match["event"] != options["event"])
+                or duration < options["min_duration"]
+            ):
+                continue
+            files.append(str(path))
+            durations[(match["kind"], match["event"])].append(duration)
+        if not files:
+            raise CommandError(f"No matching profiles in {directory}.")
+
+        self.stdout.write(f"{len(files)} profiles in {directory}\n")
+        self.stdout.write(
+            f"  {'kind':<8} {'event':<40} {'count':>6} {'avg ms':>8} {'max ms':>8}"
+        )
+        for (kind, event), values in sorted(
+            durations.items(), key=lambda item: -sum(item[1])
+        ):
+            self.stdout.write(
+                f"  {kind:<8} {event:<40} {len(values):>6} "
+                f"{sum(values) / len(values):>8.0f} {max(values):>8}"
+            )
+
+        output = io.StringIO()
+        stats = pstats.Stats(*files, stream=output)
+        if not options["full_paths"]:
+            stats.strip_dirs()
+        stats.sort_stats(options["sort"]).print_stats(options["limit"])
+        self.stdout.write(output.getvalue())
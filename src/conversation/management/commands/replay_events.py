@@ -0,0 +1,92 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from conversation.constants import REPLAY_CHUNK_SIZE, REPLAY_REORDER_WINDOW
+from conversation.replay import Replayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays recorded webhook events (JSON lines) into the database in "
+        "timestamp order, with bulk writes, following the rules of the webhook."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="The JSON lines file, or - for stdin.")
+        parser.add_argument(
+            "--outbound",
+            action="store_true",
+            help=(
+                "Answer the inbound messages with OUTBOUND messages. Without it, "
+                "they are marked as processed and left unanswered."
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=REPLAY_CHUNK_SIZE,
+            help="Events applied per transaction.",
+        )
+        parser.add_argument(
+            "--window",
+            type=int,
+            default=REPLAY_REORDER_WINDOW,
+            help="Events held to put them back in timestamp order.",
+        )
+        parser.add_argument(
+            "--progress-every",
+            type=float,
+            default=5,
+            help="Seconds between progress reports.",
+        )
+
+    def handle(self, *args, **options):
+        replayer = Replayer(
+            outbound=options["outbound"],
+            chunk_size=options["chunk_size"],
+            window=options["window"],
+        )
+        self.started = self.reported = time.perf_counter()
+        self.every = options["progress_every"]
+
+        try:
+            if options["file"] == "-":
+                replayer.run(sys.stdin.buffer, self.progress)
+            else:
+                with open(options["file"], "rb") as lines:
+                    replayer.run(lines, self.progress)
+        except OSError as e:
+            raise CommandError(f"Could not read {options['file']}: {e}")
+        except DatabaseError as e:
+            # The chunks written so far are committed. Events replayed again are
+            # rejected as duplicates, so the file can be replayed from the start.
+            raise CommandError(
+                f"Replay stopped after {replayer.stats['events']} events: {e}"
+            )
+
+        elapsed = time.perf_counter() - self.started
+        report = {
+            **dict(sorted(replayer.stats.items())),
+            "rejected": dict(sorted(replayer.rejected.items())),
+            "elapsed_seconds": elapsed,
+            "events_per_second": (
+                replayer.stats["events"] / elapsed if elapsed else None
+            ),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def progress(self, stats):
+        now = time.perf_counter()
+        if now - self.reported < self.every:
+            return
+        self.reported = now
+        elapsed = now - self.started
+        self.stderr.write(
+            f"{stats['events']} events in {elapsed:.0f}s "
+            f"({stats['events'] / elapsed:.0f}/s), {stats['applied']} applied, "
+            f"{stats['outbound']} outbound"
+        )
@@ -0,0 +1,251 @@
+import logging
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from . import debounce
+from .async_redis import get_async_redis_connection
+
+# Metrics are kept in Redis hashes rather than in process memory, so the values
+# written by every gunicorn, uvicorn and Celery worker process add up, and any web
+# process can serve the whole picture on `/metrics`. Every write is a single
+# pipelined round trip, and a Redis failure never fails the instrumented code.
+#
+# Hash fields are `<name>|<labels>` for counters and
+# `<name>|<labels>|<bucket index, "sum" or "count">` for histograms, where
+# `<labels>` is already in the Prometheus text format.
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_KEY = "metrics:counters"
+HISTOGRAMS_KEY = "metrics:histograms"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DELAY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRICS = {
+    "conversation_event_duration_seconds": (
+        "histogram",
+        "Time spent handling a webhook event, by event type and response status.",
+        LATENCY_BUCKETS,
+    ),
+    "conversation_transaction_duration_seconds": (
+        "histogram",
+        "Time a handler holds its database transaction, until commit.",
+        LATENCY_BUCKETS,
+    ),
+    "conversation_buffer_messages_total": (
+        "counter",
+        "Messages received before their conversation, by outcome "
+        "(buffered, recovered, expired or failed).",
+        None,
+    ),
+    "conversation_duplicate_events_total": (
+        "counter",
+        "Webhook events answered as known duplicates, without reaching the database.",
+        None,
+    ),
+    "conversation_outbound_messages_total": (
+        "counter",
+        "OUTBOUND messages created.",
+        None,
+    ),
+    "conversation_processing_delay_seconds": (
+        "histogram",
+        "How late the processing of a conversation started after its quiet window.",
+        DELAY_BUCKETS,
+    ),
+    "conversation_query_budget_overruns_total": (
+        "counter",
+        "Requests and tasks that ran more queries or DB time than their budget.",
+        None,
+    ),
+    "conversation_admission_rejections_total": (
+        "counter",
+        "Webhook events refused by admission control, by reason (queue_depth, "
+        "processing_lag or rate_limit) and event type.",
+        None,
+    ),
+    "conversation_processing_lag_seconds": (
+        "gauge",
+        "How long the most overdue conversation has been waiting for processing "
+        "(conversations whose job was lost are left out).",
+        None,
+    ),
+}
+
+
+def _format_labels(labels: dict) -> str:
+    return ",".join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for key, value in sorted(labels.items())
+    )
+
+
+def _series(name: str, labels: str) -> str:
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _increment_commands(name: str, value: float, labels: dict) -> list[tuple]:
+    field = f"{name}|{_format_labels(labels)}"
+    return [("hincrbyfloat", COUNTERS_KEY, field, value)]
+
+
+def _observe_commands(name: str, values: list[float], labels: dict) -> list[tuple]:
+    buckets = METRICS[name][2]
+    # Only the first matching bucket is stored, the counts are accumulated on render.
+    # Values above every bound go to the +Inf bucket, at index `len(buckets)`.
+    counts = Counter(
+        next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+        for value in values
+    )
+    prefix = f"{name}|{_format_labels(labels)}|"
+    return [
+        *(
+            ("hincrby", HISTOGRAMS_KEY, prefix + str(index), count)
+            for index, count in sorted(counts.items())
+        ),
+        ("hincrbyfloat", HISTOGRAMS_KEY, prefix + "sum", sum(values)),
+        ("hincrby", HISTOGRAMS_KEY, prefix + "count", len(values)),
+    ]
+
+
+def _write(commands: list[tuple]):
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for command, *args in commands:
+            getattr(pipe, command)(*args)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record metrics: %s", e)
+
+
+async def _awrite(commands: list[tuple]):
+    try:
+        pipe = get_async_redis_connection("default").pipeline(transaction=False)
+        for command, *args in commands:
+            getattr(pipe, command)(*args)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record metrics: %s", e)
+
+
+def increment(name: str, value: float = 1, **labels):
+    """
+    Increments a counter.
+
+    Args:
+        name (str): The name of the counter, one of `METRICS`.
+        value (float): The amount to add.
+        **labels: The labels of the series.
+    """
+    if settings.METRICS_ENABLED:
+        _write(_increment_commands(name, value, labels))
+
+
+async def aincrement(name: str, value: float = 1, **labels):
+    """
+    Asynchronous version of `increment`, using the asyncio Redis client.
+    """
+    if settings.METRICS_ENABLED:
+        await _awrite(_increment_commands(name, value, labels))
+
+
+def observe(name: str, value: float, **labels):
+    """
+    Records a value in a histogram.
+
+    Args:
+        name (str): The name of the histogram, one of `METRICS`.
+        value (float): The observed value.
+        **labels: The labels of the series.
+    """
+    if settings.METRICS_ENABLED:
+        _write(_observe_commands(name, [value], labels))
+
+
+async def aobserve(name: str, value: float, **labels):
+    """
+    Asynchronous version of `observe`, using the asyncio Redis client.
+    """
+    if settings.METRICS_ENABLED:
+        await _awrite(_observe_commands(name, [value], labels))
+
+
+def observe_many(name: str, values: list[float], **labels):
+    """
+    Records several values in a histogram, with one write whatever their number.
+
+    Args:
+        name (str): The name of the histogram, one of `METRICS`.
+        values (list[float]): The observed values.
+        **labels: The labels of the series.
+    """
+    if settings.METRICS_ENABLED and values:
+        _write(_observe_commands(name, values, labels))
+
+
+def time_transaction(handler: str):
+    """
+    Records how long the current transaction is held, from now until it commits.
+    The value is recorded by an on-commit callback, so it must be called first
+    thing in the transaction, before other callbacks are registered.
+
+    Args:
+        handler (str): The name of the handler, used as label.
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    start = time.perf_counter()
+    transaction.on_commit(
+        lambda: observe(
+            "conversation_transaction_duration_seconds",
+            time.perf_counter() - start,
+            handler=handler,
+        )
+    )
+
+
+def render() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics, ready to be scraped.
+    """
+    pipe = get_redis_connection("default").pipeline(transaction=False)
+    pipe.hgetall(COUNTERS_KEY)
+    pipe.hgetall(HISTOGRAMS_KEY)
+    counters, histograms = pipe.execute()
+
+    series = {name: {} for name in METRICS}
+    for field, value in counters.items():
+        name, labels = field.decode("utf-8").split("|", 1)
+        series.setdefault(name, {})[labels] = float(value)
+    for field, value in histograms.items():
+        name, labels, slot = field.decode("utf-8").split("|", 2)
+        series.setdefault(name, {}).setdefault(labels, {})[slot] = float(value)
+    series["conversation_processing_lag_seconds"] = {"": debounce.processing_lag()}
+
+    lines = []
+    for name, (kind, documentation, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series[name].items()):
+            if kind != "histogram":
+                lines.append(f"{_series(name, labels)} {value}")
+                continue
+            separator = "," if labels else ""
+            cumulative = 0
+            for index, bound in enumerate((*buckets, "+Inf")):
+                cumulative += value.get(str(index), 0)
+                le = f'{labels}{separator}le="{bound}"'
+                lines.append(f"{name}_bucket{{{le}}} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {value.get('sum', 0)}")
+            lines.append(f"{_series(name + '_count', labels)} {value.get('count', 0)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:07
+
+from django.db import migrations, models
+
+
+def backfill_watermark(apps, schema_editor):
+    """Marks inbound messages already answered by an OUTBOUND message as processed."""
+    Conversation = apps.get_model("conversation", "Conversation")
+    Message = apps.get_model("conversation", "Message")
+
+    for conversation in Conversation.objects.iterator():
+        latest_outbound = (
+            Message.objects.filter(conversation=conversation, type="OUTBOUND")
+            .order_by("-timestamp")
+            .first()
+        )
+        if latest_outbound is None:
+            continue
+        last_processed = (
+            Message.objects.filter(
+                conversation=conversation,
+                type="INBOUND",
+                timestamp__lte=latest_outbound.timestamp,
+            )
+            .order_by("-timestamp", "-id")
+            .first()
+        )
+        if last_processed is None:
+            continue
+        Conversation.objects.filter(id=conversation.id).update(
+            last_processed_timestamp=last_processed.timestamp,
+            last_processed_message_id=last_processed.id,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversation', '0002_message_messages_conv_ts_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_processed_message_id',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_processed_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'type', 'timestamp'], name='messages_conv_type_ts_idx'),
+        ),
+        migrations.RunPython(backfill_watermark, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+import datetime
+
+from django.db import migrations
+
+# Partitions the messages table by `timestamp` month on PostgreSQL. The table is
+# rebuilt: the monthly partitions cover the last months of existing data up to a
+# few months ahead, older rows go to the default partition, and the
+# `maintain_message_partitions` task keeps creating partitions from there.
+# The primary key becomes `(id, timestamp)`, as it must include the partition key.
+# Other databases keep the plain table.
+
+BACKFILL_MONTHS = 12
+AHEAD_MONTHS = 3
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _rebuild(cursor, create_table, primary_key, after_create=()):
+    """
+    Rebuilds the messages table with `create_table`, keeping its rows, secondary
+    indexes and foreign keys.
+    """
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = 'public' "
+        "AND tablename = 'messages' AND indexname <> 'messages_pkey'"
+    )
+    indexes = [indexdef for (indexdef,) in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'messages'::regclass AND contype = 'f'"
+    )
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute("ALTER TABLE messages RENAME TO messages_previous")
+    cursor.execute(create_table)
+    for statement in after_create:
+        cursor.execute(statement)
+    cursor.execute("INSERT INTO messages SELECT * FROM messages_previous")
+    cursor.execute("DROP TABLE messages_previous")
+    # The names of the constraints and indexes are free again.
+    cursor.execute(f"ALTER TABLE messages ADD PRIMARY KEY ({primary_key})")
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE messages ADD CONSTRAINT {name} {definition}")
+
+
+def partition_messages(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min("timestamp") FROM messages')
+        (oldest,) = cursor.fetchone()
+        today = datetime.date.today()
+        current = datetime.date(today.year, today.month, 1)
+        first = _add_months(current, -BACKFILL_MONTHS)
+        if oldest is not None:
+            first = max(first, datetime.date(oldest.year, oldest.month, 1))
+
+        partitions = ["CREATE TABLE messages_default PARTITION OF messages DEFAULT"]
+        month = first
+        while month <= _add_months(current, AHEAD_MONTHS):
+            following = _add_months(month, 1)
+            partitions.append(
+                f"CREATE TABLE messages_p{month:%Y%m} PARTITION OF messages "
+                f"FOR VALUES FROM ('{month}') TO ('{following}')"
+            )
+            month = following
+
+        _rebuild(
+            cursor,
+            "CREATE TABLE messages (LIKE messages_previous INCLUDING DEFAULTS) "
+            'PARTITION BY RANGE ("timestamp")',
+            'id, "timestamp"',
+            partitions,
+        )
+
+
+def unpartition_messages(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _rebuild(
+            cursor,
+            "CREATE TABLE messages (LIKE messages_previous INCLUDING DEFAULTS)",
+            "id",
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0003_conversation_processing_watermark"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
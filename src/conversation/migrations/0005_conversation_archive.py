@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0004_partition_messages"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationArchive",
+            fields=[
+                (
+                    "conversation",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="archive",
+                        serialize=False,
+                        to="conversation.conversation",
+                    ),
+                ),
+                ("messages", models.BinaryField()),
+                ("message_count", models.PositiveIntegerField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "conversation_archives",
+            },
+        ),
+    ]
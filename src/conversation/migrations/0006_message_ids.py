@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# On PostgreSQL, the primary key of the partitioned messages table is
+# `(id, timestamp)`, so the uniqueness of message IDs is kept by a plain
+# `message_ids` table: a trigger reserves the ID of every message inserted, in the
+# same statement, and fails it if the ID is taken. Every write path (single
+# inserts, bulk inserts, COPY) goes through it. Other databases keep `id` as the
+# primary key of the messages table.
+
+
+def create_message_ids(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("CREATE TABLE message_ids (id uuid PRIMARY KEY)")
+        cursor.execute(
+            "INSERT INTO message_ids SELECT id FROM messages ON CONFLICT DO NOTHING"
+        )
+        cursor.execute(
+            "CREATE FUNCTION messages_reserve_id() RETURNS trigger "
+            "LANGUAGE plpgsql AS $$ BEGIN "
+            "INSERT INTO message_ids (id) VALUES (NEW.id); RETURN NEW; "
+            "END $$"
+        )
+        cursor.execute(
+            "CREATE TRIGGER messages_reserve_id BEFORE INSERT ON messages "
+            "FOR EACH ROW EXECUTE FUNCTION messages_reserve_id()"
+        )
+
+
+def drop_message_ids(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TRIGGER messages_reserve_id ON messages")
+        cursor.execute("DROP FUNCTION messages_reserve_id()")
+        cursor.execute("DROP TABLE message_ids")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0005_conversation_archive"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_message_ids, drop_message_ids),
+    ]
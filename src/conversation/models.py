@@ -1,5 +1,164 @@
 import uuid
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, connections, models
+from django.utils import timezone
+
+# The handlers write with conditional single statements, so an event costs one
+# round trip when it succeeds and the checks cannot race with other writers.
+# `INSERT ... ON CONFLICT DO NOTHING RETURNING` is supported by PostgreSQL and
+# SQLite (3.35+), and tells whether the row was written.
+#
+# On PostgreSQL, the messages table is partitioned and its primary key is
+# `(id, timestamp)`: message IDs are reserved in the plain `message_ids` table by
+# a trigger (migration 0006), which is also where their existence is checked.
+
+MESSAGE_IDS_TABLE = "message_ids"
+
+
+def _insert_values(obj: models.Model, fields: list, connection) -> list:
+    return [
+        field.get_db_prep_save(field.pre_save(obj, True), connection)
+        for field in fields
+    ]
+
+
+class ConversationManager(models.Manager):
+    def create_if_absent(self, conversation_id) -> bool:
+        """
+        Creates an OPEN conversation, unless one with the same ID exists.
+
+        Args:
+            conversation_id: The ID of the conversation.
+        Returns:
+            bool: Whether the conversation was created.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        fields = meta.concrete_fields
+        conversation = self.model(id=conversation_id, status="OPEN")
+        sql = "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO NOTHING RETURNING {}".format(
+            qn(meta.db_table),
+            ", ".join(qn(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)),
+            qn(meta.pk.column),
+            qn(meta.pk.column),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, _insert_values(conversation, fields, connection))
+            return cursor.fetchone() is not None
+
+    def close(self, conversation_id) -> bool:
+        """
+        Closes a conversation if it is OPEN.
+
+        Args:
+            conversation_id: The ID of the conversation.
+        Returns:
+            bool: Whether the conversation was closed. False if it does not exist or
+            was already closed.
+        """
+        return bool(
+            self.filter(id=conversation_id, status="OPEN").update(
+                status="CLOSED", updated_at=timezone.now()
+            )
+        )
+
+
+class MessageManager(models.Manager):
+    def _ids_table(self, connection) -> str:
+        if connection.vendor == "postgresql":
+            return MESSAGE_IDS_TABLE
+        return self.model._meta.db_table
+
+    def existing_ids(self, ids) -> set:
+        """
+        Returns the message IDs that are taken. On PostgreSQL, they are read from
+        `message_ids`, with one index lookup each whatever the number of
+        partitions.
+
+        Args:
+            ids: The message IDs to look up.
+        Returns:
+            set: The IDs among `ids` that belong to a message.
+        """
+        connection = connections[self.db]
+        if not ids:
+            return set()
+        if connection.vendor != "postgresql":
+            return set(self.filter(id__in=ids).values_list("id", flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM {MESSAGE_IDS_TABLE} WHERE id = ANY(%s::uuid[])",
+                [list(ids)],
+            )
+            return {message_id for (message_id,) in cursor.fetchall()}
+
+    def create_in_open_conversation(self, **fields) -> "Message | None":
+        """
+        Creates a message if its conversation exists and is OPEN and its ID is not
+        taken, checking both in the INSERT statement. The ID is checked explicitly
+        as well as through the conflict clause: on PostgreSQL, the table is
+        partitioned and its primary key is `(id, timestamp)`, so the ID is looked
+        up in `message_ids`.
+
+        Args:
+            **fields: The fields of the message, including `conversation_id`.
+        Returns:
+            Message | None: The message, or None if it was not created.
+        Raises:
+            ValueError: If a concurrent transaction took the message ID between the
+            check and the insert (PostgreSQL).
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        conversation_meta = Conversation._meta
+        message = self.model(**fields)
+        values = [
+            field
+            for field in meta.concrete_fields
+            if field.attname != "conversation_id"
+        ]
+        sql = (
+            "INSERT INTO {table} ({columns}, {fk}) SELECT {values}, {pk} FROM {conversations} "
+            "WHERE {pk} = %s AND {status} = %s "
+            "AND NOT EXISTS (SELECT 1 FROM {ids_table} WHERE {message_pk} = %s) "
+            "ON CONFLICT DO NOTHING RETURNING {message_pk}"
+        ).format(
+            table=qn(meta.db_table),
+            columns=", ".join(qn(field.column) for field in values),
+            fk=qn(meta.get_field("conversation").column),
+            values=", ".join(["%s"] * len(values)),
+            pk=qn(conversation_meta.pk.column),
+            conversations=qn(conversation_meta.db_table),
+            status=qn(conversation_meta.get_field("status").column),
+            ids_table=qn(self._ids_table(connection)),
+            message_pk=qn(meta.pk.column),
+        )
+        params = [
+            *_insert_values(message, values, connection),
+            conversation_meta.pk.get_db_prep_value(message.conversation_id, connection),
+            "OPEN",
+            meta.pk.get_db_prep_value(message.id, connection),
+        ]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                if cursor.fetchone() is None:
+                    return None
+        except IntegrityError:
+            # Raised out of the caller's transaction, which is rolled back.
+            raise ValueError("Message ID already exists")
+        message._state.adding = False
+        message._state.db = self.db
+        return message
+
+    async def acreate_in_open_conversation(self, **fields) -> "Message | None":
+        """
+        Asynchronous version of `create_in_open_conversation`.
+        """
+        return await sync_to_async(self.create_in_open_conversation)(**fields)
 
 
 class Conversation(models.Model):
@@ -11,6 +170,10 @@ class Conversation(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="OPEN")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    last_processed_timestamp = models.DateTimeField(null=True, blank=True)
+    last_processed_message_id = models.UUIDField(null=True, blank=True)
+
+    objects = ConversationManager()
 
     class Meta:
         db_table = "conversations"
@@ -29,5 +192,37 @@ class Message(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField()
 
+    objects = MessageManager()
+
     class Meta:
         db_table = "messages"
+        indexes = [
+            models.Index(
+                fields=["conversation", "timestamp", "id"],
+                name="messages_conv_ts_id_idx",
+            ),
+            models.Index(
+                fields=["conversation", "type", "timestamp"],
+                name="messages_conv_type_ts_idx",
+            ),
+        ]
+
+
+class ConversationArchive(models.Model):
+    """
+    The messages of an archived conversation, compacted into a single compressed
+    blob once the conversation has been closed for a while (see `archive.py`).
+    """
+
+    conversation = models.OneToOneField(
+        Conversation,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="archive",
+    )
+    messages = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "conversation_archives"
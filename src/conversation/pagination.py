@@ -0,0 +1,120 @@
+import base64
+import uuid
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from .constants import MESSAGES_PAGE_SIZE, MESSAGES_MAX_PAGE_SIZE
+
+
+def encode_position(timestamp, message_id) -> str:
+    """
+    Encodes the `(timestamp, id)` position of a message as an opaque cursor.
+
+    Args:
+        timestamp (datetime): The timestamp of the message.
+        message_id: The ID of the message.
+    """
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode("ascii")).decode("ascii")
+
+
+def decode_position(encoded: str):
+    """
+    Decodes a cursor built by `encode_position`.
+
+    Args:
+        encoded (str): The cursor.
+    Returns:
+        tuple: The `(timestamp, id)` position of the message.
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    try:
+        decoded = base64.urlsafe_b64decode(encoded.encode("ascii")).decode("ascii")
+        timestamp, message_id = decoded.split("|")
+        timestamp = parse_datetime(timestamp)
+        message_id = uuid.UUID(message_id)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if timestamp is None:
+        raise ValueError("Invalid cursor")
+    return timestamp, message_id
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over messages ordered by `(timestamp, id)`.
+
+    The cursor encodes the position of the last message of the page, so fetching
+    any page is an index range scan, no matter how deep it is in the conversation.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = MESSAGES_PAGE_SIZE
+    max_page_size = MESSAGES_MAX_PAGE_SIZE
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        queryset = queryset.order_by("timestamp", "id")
+        if position is not None:
+            timestamp, message_id = position
+            queryset = queryset.filter(timestamp__gte=timestamp).exclude(
+                timestamp=timestamp, id__lte=message_id
+            )
+
+        page = list(queryset[: self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[: self.page_size]
+        self.next_position = (
+            (page[-1].timestamp, page[-1].id) if self.has_next else None
+        )
+        return page
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self) -> str | None:
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            return decode_position(encoded)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position) -> str:
+        return encode_position(*position)
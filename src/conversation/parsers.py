@@ -0,0 +1,63 @@
+import codecs
+import io
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser, get_encoding
+from rest_framework.settings import api_settings
+from rest_framework.utils import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON (one event per line) into a list of objects.
+    Blank lines are ignored.
+    """
+
+    media_type = "application/x-ndjson"
+    strict = api_settings.STRICT_JSON
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """
+        Parses the incoming bytestream as NDJSON and returns the list of parsed lines.
+        """
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", "utf-8")
+        parse_constant = json.strict_constant if self.strict else None
+
+        events = []
+        decoded_stream = codecs.getreader(encoding)(stream)
+        for line_number, line in enumerate(decoded_stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line, parse_constant=parse_constant))
+            except ValueError as exc:
+                raise ParseError(
+                    "NDJSON parse error on line %d - %s" % (line_number, str(exc))
+                )
+        return events
+
+
+class FastJSONParser(JSONParser):
+    """
+    Parses JSON with orjson. Bodies orjson rejects are handed to `JSONParser`,
+    so malformed payloads get exactly the same error messages.
+    """
+
+    available = orjson is not None
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        raw = stream.read()
+        if get_encoding(parser_context).lower() in ("utf-8", "utf8"):
+            try:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse(io.BytesIO(raw), media_type, parser_context)
@@ -0,0 +1,191 @@
+import datetime
+import logging
+import re
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import MESSAGE_IDS_TABLE
+
+# On PostgreSQL, the `messages` table is partitioned by `timestamp` month
+# (migration 0004): `messages_pYYYYMM` holds the messages of a month and
+# `messages_default` the ones outside of every partition. The maintenance task
+# creates the partitions of the coming months ahead of time, and detaches or drops
+# the ones past the retention, so the size of the hot partitions and of their
+# indexes stays bounded. Other databases keep a plain table and skip all of this.
+#
+# The primary key of a partitioned table must include the partition key, so it is
+# `(id, timestamp)` there. Message IDs stay unique through the plain `message_ids`
+# table, filled by a trigger on every insert (migration 0006). The IDs of an
+# expired partition are released along with it.
+
+logger = logging.getLogger(__name__)
+
+TABLE = "messages"
+PARTITION_NAME = "messages_p{:%Y%m}"
+DEFAULT_PARTITION = "messages_default"
+_PARTITION_PATTERN = re.compile(r"^messages_p(\d{4})(\d{2})$")
+
+
+def month_start(value: datetime.date) -> datetime.date:
+    """
+    Returns the first day of the month of a date.
+    """
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    """
+    Returns the first day of the month `months` after (or before, if negative) the
+    month of a date.
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def plan(
+    existing: list[datetime.date],
+    today: datetime.date,
+    ahead: int,
+    retention: int,
+) -> tuple[list[datetime.date], list[datetime.date]]:
+    """
+    Decides which monthly partitions to create and which ones to expire.
+
+    Args:
+        existing (list[date]): The months with a partition.
+        today (date): The current date.
+        ahead (int): How many months after the current one must have a partition.
+        retention (int): How many months of messages to keep, counting the current
+            one. 0 keeps every month.
+    Returns:
+        tuple[list[date], list[date]]: The months to create and the months to
+        expire, in chronological order.
+    """
+    current = month_start(today)
+    wanted = [add_months(current, offset) for offset in range(ahead + 1)]
+    to_create = [month for month in wanted if month not in existing]
+    if not retention:
+        return to_create, []
+    oldest_kept = add_months(current, 1 - retention)
+    return to_create, sorted(month for month in existing if month < oldest_kept)
+
+
+def is_partitioned() -> bool:
+    """
+    Tells whether the messages table is partitioned (PostgreSQL only).
+    """
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def existing_partitions() -> list[datetime.date]:
+    """
+    Returns the months with an attached partition.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [TABLE],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+    months = []
+    for name in names:
+        match = _PARTITION_PATTERN.match(name)
+        if match:
+            months.append(datetime.date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+def create_partition(cursor, month: datetime.date):
+    """
+    Creates the partition of a month, moving its rows out of the default partition.
+
+    Args:
+        cursor: A cursor on the PostgreSQL database.
+        month (date): The first day of the month.
+    """
+    name = PARTITION_NAME.format(month)
+    bounds = [month.isoformat(), add_months(month, 1).isoformat()]
+    # A partition cannot be attached while the default partition holds rows of its
+    # range, so they are moved out first.
+    cursor.execute(
+        f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+        f"INSERT INTO {name} SELECT * FROM moved",
+        bounds,
+    )
+    cursor.execute(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{bounds[0]}') TO ('{bounds[1]}')"
+    )
+
+
+def expire_partition(cursor, month: datetime.date, drop: bool):
+    """
+    Detaches the partition of a month, and drops it if asked to. The IDs of its
+    messages are released.
+
+    Args:
+        cursor: A cursor on the PostgreSQL database.
+        month (date): The first day of the month.
+        drop (bool): Whether to drop the detached table.
+    """
+    name = PARTITION_NAME.format(month)
+    cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+    cursor.execute(
+        f"DELETE FROM {MESSAGE_IDS_TABLE} USING {name} "
+        f"WHERE {MESSAGE_IDS_TABLE}.id = {name}.id"
+    )
+    if drop:
+        cursor.execute(f"DROP TABLE {name}")
+
+
+def maintain(
+    ahead: int, retention: int, drop: bool, today: datetime.date | None = None
+) -> dict:
+    """
+    Creates the partitions of the coming months and expires the ones past the
+    retention. Each partition is changed in its own transaction.
+
+    Args:
+        ahead (int): How many months after the current one must have a partition.
+        retention (int): How many months of messages to keep, 0 to keep every month.
+        drop (bool): Whether expired partitions are dropped, or only detached.
+        today (date): The current date. Defaults to today.
+    Returns:
+        dict: The names of the created and expired partitions.
+    """
+    if not is_partitioned():
+        return {"created": [], "expired": []}
+
+    to_create, to_expire = plan(
+        existing_partitions(), today or timezone.now().date(), ahead, retention
+    )
+    for month in to_create:
+        with transaction.atomic(), connection.cursor() as cursor:
+            create_partition(cursor, month)
+    for month in to_expire:
+        with transaction.atomic(), connection.cursor() as cursor:
+            expire_partition(cursor, month, drop)
+    if to_create or to_expire:
+        logger.info(
+            "Created %d and expired %d message partitions",
+            len(to_create),
+            len(to_expire),
+        )
+    return {
+        "created": [PARTITION_NAME.format(month) for month in to_create],
+        "expired": [PARTITION_NAME.format(month) for month in to_expire],
+    }
@@ -0,0 +1,187 @@
+import cProfile
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .routing import CONVERSATION_TASKS
+
+# Opt-in profiling of requests and Celery tasks (`PROFILING_ENABLED`), to see
+# where the time of a slow webhook or task goes. A `PROFILING_SAMPLE_RATE`
+# fraction of the requests and tasks runs under cProfile, and the profiles of the
+# ones that took at least `PROFILING_MIN_DURATION_MS` are written to
+# `PROFILING_DIR` in the pstats format (`snakeviz`, `python -m pstats`...).
+# `manage.py profile_summary` aggregates them.
+#
+# File names carry what was profiled, `PROFILE_NAME` below: the kind (request or
+# task), the event type (or URL name / task name), the conversation ID and the
+# duration. The views tag the event with `tag_event`.
+#
+# Turned off, the middleware removes itself (`MiddlewareNotUsed`) and the task
+# signals are not connected, so only `tag_event` runs, as a context lookup.
+# cProfile follows one thread: requests of the ASGI application also record the
+# other coroutines the event loop runs meanwhile.
+
+logger = logging.getLogger(__name__)
+
+PROFILE_NAME = "{started}-{kind}-{event}-{conversation}-{duration}ms-{suffix}.prof"
+PROFILE_PATTERN = re.compile(
+    r"^(?P<started>\d{8}T\d{6})-(?P<kind>request|task)-(?P<event>[\w.]+)-"
+    r"(?P<conversation>[\w-]+)-(?P<duration>\d+)ms-\w+\.prof$"
+)
+
+# The labels of the profiled request, filled by `tag_event`.
+_labels: ContextVar[dict | None] = ContextVar("profiling_labels", default=None)
+# cProfile allows one profiler per thread at a time.
+_thread = threading.local()
+# Task ID -> running profile.
+_tasks = {}
+
+
+class _Profile:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.profiler = cProfile.Profile()
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        _thread.active = True
+        self.profiler.enable()
+
+    def finish(self, event: str | None, conversation_id) -> Path | None:
+        """
+        Stops profiling and writes the profile if it took long enough.
+
+        Returns:
+            Path | None: The profile file, if it was written.
+        """
+        self.profiler.disable()
+        _thread.active = False
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        if duration_ms < settings.PROFILING_MIN_DURATION_MS:
+            return None
+        path = Path(settings.PROFILING_DIR) / PROFILE_NAME.format(
+            started=time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.started_at)),
+            kind=self.kind,
+            event=re.sub(r"[^\w.]+", "_", event or "unknown")[:64],
+            conversation=re.sub(r"[^\w-]+", "_", str(conversation_id or "none"))[:64],
+            duration=round(duration_ms),
+            suffix=uuid.uuid4().hex[:8],
+        )
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.profiler.dump_stats(path)
+        except OSError as e:
+            logger.warning("Could not write profile %s: %s", path, e)
+            return None
+        return path
+
+
+def _start(kind: str) -> _Profile | None:
+    if getattr(_thread, "active", False):
+        return None
+    if random.random() >= settings.PROFILING_SAMPLE_RATE:
+        return None
+    return _Profile(kind)
+
+
+def tag_event(payload: dict):
+    """
+    Labels the profile of the current request with a webhook event. Does nothing
+    when the request is not profiled.
+
+    Args:
+        payload (dict): The validated event payload.
+    """
+    labels = _labels.get()
+    if labels is None:
+        return
+    data = payload.get("data") or {}
+    labels["event"] = payload.get("type")
+    labels["conversation"] = data.get("conversation_id", data.get("id"))
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of the requests, for the WSGI and the ASGI applications.
+    Removed from the middleware chain unless `PROFILING_ENABLED`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = _start("request")
+        if profile is None:
+            return self.get_response(request)
+        labels = {}
+        token = _labels.set(labels)
+        try:
+            return self.get_response(request)
+        finally:
+            _labels.reset(token)
+            self.finish(profile, request, labels)
+
+    async def __acall__(self, request):
+        profile = _start("request")
+        if profile is None:
+            return await self.get_response(request)
+        labels = {}
+        token = _labels.set(labels)
+        try:
+            return await self.get_response(request)
+        finally:
+            _labels.reset(token)
+            self.finish(profile, request, labels)
+
+    @staticmethod
+    def finish(profile: _Profile, request, labels: dict):
+        match = request.resolver_match
+        event = labels.get("event") or (match and match.url_name) or request.path
+        profile.finish(event, labels.get("conversation"))
+
+
+def _on_task_prerun(task_id, task, args=None, kwargs=None, **extra):
+    profile = _start("task")
+    if profile is not None:
+        _tasks[task_id] = profile
+
+
+def _on_task_postrun(task_id, task, args=None, kwargs=None, **extra):
+    profile = _tasks.pop(task_id, None)
+    if profile is None:
+        return
+    conversation_id = None
+    get_conversation_id = CONVERSATION_TASKS.get(task.name)
+    if get_conversation_id is not None:
+        try:
+            conversation_id = get_conversation_id(args or (), kwargs or {})
+        except (IndexError, KeyError, TypeError):
+            pass
+    profile.finish(task.name.rsplit(".", 1)[-1], conversation_id)
+
+
+def connect_task_signals():
+    """
+    Profiles a sample of the Celery tasks run by this process, if
+    `PROFILING_ENABLED`. Called once the app is ready.
+    """
+    if settings.PROFILING_ENABLED:
+        task_prerun.connect(_on_task_prerun, weak=False)
+        task_postrun.connect(_on_task_postrun, weak=False)
@@ -0,0 +1,120 @@
+import logging
+import time
+from contextlib import contextmanager
+from celery import Task
+from django.conf import settings
+from django.db import connection
+from . import metrics
+
+# Query budgets: the maximum number of queries, and of milliseconds spent in the
+# database, of the webhook (per event type), of the conversation detail and of the
+# per-conversation tasks. Work is measured through a database execute wrapper, so
+# every query counts, including the ones of code paths added later. Savepoints
+# are not counted, so tests (run inside a transaction) count as production does.
+#
+# With `QUERY_BUDGET_MODE`:
+# - "log" (default): overruns are logged with their SQL and counted in the
+#   `conversation_query_budget_overruns_total` metric;
+# - "raise" (tests and CI): a query count overrun also raises
+#   `QueryBudgetExceeded`, failing the test that triggered it. DB time depends on
+#   the machine, so time overruns are only logged;
+# - "off": nothing is measured.
+#
+# Only the current thread's connection is measured: the ASGI webhook, whose
+# queries run in worker threads, is not covered.
+
+logger = logging.getLogger(__name__)
+
+# Name -> (maximum queries, maximum DB time in milliseconds).
+BUDGETS = {
+    "webhook.NEW_CONVERSATION": (2, 50),
+    "webhook.NEW_MESSAGE": (2, 50),
+    "webhook.CLOSE_CONVERSATION": (2, 50),
+    "conversation_detail": (2, 100),
+    "conversation.tasks.debounce_conversation_processing": (4, 200),
+    "conversation.tasks.process_conversation_messages": (4, 200),
+}
+
+# Queries listed in an overrun report.
+REPORTED_QUERIES = 20
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when a unit of work runs more queries than its budget, in "raise" mode.
+    """
+
+
+class _Usage:
+    """
+    Database execute wrapper recording the queries run and their duration.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(("SAVEPOINT", "RELEASE", "ROLLBACK TO")):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries.append(sql)
+
+    def check(self, name: str, max_queries: int, max_ms: float):
+        """
+        Reports the overruns of a budget.
+
+        Raises:
+            QueryBudgetExceeded: If there are more queries than the budget, in
+            "raise" mode.
+        """
+        duration_ms = self.duration * 1000
+        too_many = len(self.queries) > max_queries
+        if not too_many and duration_ms <= max_ms:
+            return
+        report = (
+            f"Query budget of {name} exceeded: {len(self.queries)} queries "
+            f"(budget {max_queries}) in {duration_ms:.1f} ms (budget {max_ms} ms)\n"
+            + "\n".join(self.queries[:REPORTED_QUERIES])
+        )
+        metrics.increment("conversation_query_budget_overruns_total", budget=name)
+        if too_many and settings.QUERY_BUDGET_MODE == "raise":
+            raise QueryBudgetExceeded(report)
+        logger.warning(report)
+
+
+@contextmanager
+def track(name: str):
+    """
+    Checks the queries run in the context against the budget of `name`. Does
+    nothing if `name` has no budget or `QUERY_BUDGET_MODE` is "off". Nothing is
+    checked when the context exits with an exception.
+
+    Args:
+        name (str): The name of the budget, one of `BUDGETS`.
+    Raises:
+        QueryBudgetExceeded: See `_Usage.check`.
+    """
+    budget = BUDGETS.get(name)
+    if budget is None or settings.QUERY_BUDGET_MODE == "off":
+        yield
+        return
+    usage = _Usage()
+    with connection.execute_wrapper(usage):
+        yield
+    usage.check(name, *budget)
+
+
+class BudgetedTask(Task):
+    """
+    Base class of the Celery tasks (`task_cls` of the app): tasks with a budget
+    are checked against it, whether run by a worker or called directly.
+    """
+
+    def __call__(self, *args, **kwargs):
+        with track(self.name):
+            return super().__call__(*args, **kwargs)
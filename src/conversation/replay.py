@@ -0,0 +1,436 @@
+import heapq
+import itertools
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Callable, Iterable, Iterator
+
+import orjson
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from . import detail_cache, ingest, status_cache
+from .bulk import copy_rows, update_rows
+from .constants import (
+    BUFFER_TIMEOUT,
+    PROCESSING_DELAY,
+    REPLAY_CHUNK_SIZE,
+    REPLAY_REORDER_WINDOW,
+)
+from .models import Conversation, Message
+from .serializers import WebhookBaseSerializer, validate_webhook_event
+from .tasks import build_outbound_content_for_ids
+
+# Bulk replay of recorded webhook events (`manage.py replay_events`), for
+# backfills and recoveries. Events are read as a stream, put back in timestamp
+# order through a bounded reordering window, and applied in chunks of one
+# transaction each, with the rules of the webhook:
+#
+# - a message sent before its conversation exists is held until the conversation
+#   is created, and kept if that happens within `BUFFER_TIMEOUT` seconds of the
+#   message (the Redis buffer of the live path);
+# - with `outbound`, inbound messages less than `PROCESSING_DELAY` seconds apart
+#   are answered by one OUTBOUND message, as `process_conversation_messages`
+#   would when the events arrive at their timestamps, and the processing
+#   watermark of the conversation is moved past them;
+# - without `outbound`, the replayed messages are left unanswered: the processing
+#   watermark is moved past them, so the live processing does not answer the
+#   whole history at once on the next message.
+#
+# Watermarks only move forward: replaying older events does not make the live
+# processing answer its messages again.
+#
+# The held messages and the open groups are kept in memory across chunks, and
+# both are bounded by the event time. Rows are written with COPY on PostgreSQL
+# (psycopg 3) and with batched INSERTs elsewhere, and the conversations keep
+# the event timestamps (`created_at`, `updated_at`). Celery, the Redis buffer
+# and the pub/sub events are not involved; cached conversation details are
+# invalidated and closes recorded in the status cache as by the handlers.
+#
+# Rejected events (existing conversation or message ID...) change nothing, so
+# a replay can be run again over the same file.
+
+
+class _Group:
+    """
+    Inbound messages of a conversation waiting for their OUTBOUND answer.
+    """
+
+    def __init__(self):
+        self.message_ids = []
+        self.last_timestamp = None
+
+    def add(self, message_id: uuid.UUID, timestamp):
+        self.message_ids.append(message_id)
+        self.last_timestamp = timestamp
+
+
+def read_events(lines: Iterable[bytes | str], stats: Counter) -> Iterator[tuple]:
+    """
+    Parses and validates JSON lines of webhook events. Blank lines are skipped,
+    and the invalid ones counted in `stats["invalid"]`.
+
+    Args:
+        lines: The JSON lines.
+        stats (Counter): The counters to update.
+    Yields:
+        tuple: `(timestamp, payload)`, with the validated payload.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            data = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            stats["invalid"] += 1
+            continue
+        payload = validate_webhook_event(data)
+        if payload is None:
+            serializer = WebhookBaseSerializer(data=data)
+            if not serializer.is_valid():
+                stats["invalid"] += 1
+                continue
+            payload = serializer.data
+        yield parse_datetime(payload["timestamp"]), payload
+
+
+def reorder(events: Iterable[tuple], window: int, stats: Counter) -> Iterator[tuple]:
+    """
+    Puts events back in timestamp order, holding up to `window` of them. Events
+    later than that are yielded as they come, and counted in `stats["late"]`.
+
+    Args:
+        events: `(timestamp, payload)` pairs, roughly in timestamp order.
+        window (int): The number of events held to reorder them.
+        stats (Counter): The counters to update.
+    Yields:
+        tuple: `(timestamp, payload)`, in timestamp then arrival order.
+    """
+    heap = []
+    latest = None
+    for position, (timestamp, payload) in enumerate(events):
+        heapq.heappush(heap, (timestamp, position, payload))
+        if len(heap) > window:
+            timestamp, _, payload = heapq.heappop(heap)
+            if latest is not None and timestamp < latest:
+                stats["late"] += 1
+            latest = max(latest, timestamp) if latest is not None else timestamp
+            yield timestamp, payload
+    while heap:
+        timestamp, _, payload = heapq.heappop(heap)
+        if latest is not None and timestamp < latest:
+            stats["late"] += 1
+        latest = max(latest, timestamp) if latest is not None else timestamp
+        yield timestamp, payload
+
+
+def advance_watermarks(rows: list[tuple]):
+    """
+    Moves the processing watermarks of conversations forward, leaving the ones
+    already past the given position, with one statement run for all the rows.
+
+    Args:
+        rows (list[tuple]): `(conversation ID, timestamp, message ID)` for each
+            conversation.
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    meta = Conversation._meta
+    fields = [
+        meta.get_field(name)
+        for name in ("last_processed_timestamp", "last_processed_message_id")
+    ]
+    timestamp, message_id = (qn(field.column) for field in fields)
+    params = []
+    for conversation_id, *watermark in rows:
+        ts, last_id = (
+            field.get_db_prep_save(value, connection)
+            for field, value in zip(fields, watermark)
+        )
+        pk = meta.pk.get_db_prep_save(conversation_id, connection)
+        params.append([ts, last_id, pk, ts, ts, last_id])
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {qn(meta.db_table)} SET {timestamp} = %s, {message_id} = %s "
+            f"WHERE {qn(meta.pk.column)} = %s AND ({timestamp} IS NULL "
+            f"OR {timestamp} < %s OR ({timestamp} = %s AND {message_id} < %s))",
+            params,
+        )
+
+
+class Replayer:
+    """
+    Applies recorded webhook events to the database in bulk. See the module
+    comment for the rules.
+
+    Args:
+        outbound (bool): Whether to answer the inbound messages with OUTBOUND ones.
+        chunk_size (int): The number of events applied per transaction.
+        window (int): The number of events held to put them in timestamp order.
+    """
+
+    def __init__(
+        self,
+        outbound: bool = False,
+        chunk_size: int = REPLAY_CHUNK_SIZE,
+        window: int = REPLAY_REORDER_WINDOW,
+    ):
+        self.outbound = outbound
+        self.chunk_size = chunk_size
+        self.window = window
+        self.stats = Counter()
+        self.rejected = Counter()
+        # Messages of conversations that do not exist yet, by conversation ID.
+        self.held = defaultdict(list)
+        # Inbound messages not answered yet, by conversation ID.
+        self.groups = {}
+        self.start_chunk(set())
+
+    def start_chunk(self, known_messages: set):
+        # The rows written by the current chunk.
+        self.known_messages = known_messages
+        self.new_conversations = {}
+        self.closed = {}
+        self.messages = []
+        self.watermarks = {}
+
+    def run(self, lines: Iterable, progress: Callable[[Counter], None] | None = None):
+        """
+        Replays JSON lines of webhook events. The outcome is counted in `stats`
+        (events read, applied, invalid and late, messages held and then recovered,
+        expired or failed, OUTBOUND messages) and `rejected` (by error).
+
+        Args:
+            lines: The JSON lines.
+            progress: Called with `stats` after each chunk.
+        """
+        events = reorder(read_events(lines, self.stats), self.window, self.stats)
+        while chunk := list(itertools.islice(events, self.chunk_size)):
+            self.apply(chunk)
+            if progress is not None:
+                progress(self.stats)
+        self.finish()
+
+    def apply(self, chunk: list[tuple]):
+        """
+        Applies a chunk of events, ordered by timestamp, in one transaction.
+
+        Args:
+            chunk (list[tuple]): `(timestamp, payload)` pairs.
+        """
+        events = []
+        conversation_ids, message_ids = set(), set()
+        for timestamp, payload in chunk:
+            data = payload["data"]
+            try:
+                if payload["type"] == "NEW_MESSAGE":
+                    conversation_id = uuid.UUID(str(data["conversation_id"]))
+                    message_id = uuid.UUID(str(data["id"]))
+                    message_ids.add(message_id)
+                else:
+                    conversation_id = uuid.UUID(str(data["id"]))
+                    message_id = None
+                    if payload["type"] == "NEW_CONVERSATION":
+                        message_ids.update(
+                            held[1] for held in self.held.get(conversation_id, ())
+                        )
+            except ValueError:
+                self.rejected["Invalid ID"] += 1
+                continue
+            conversation_ids.add(conversation_id)
+            events.append((timestamp, payload, conversation_id, message_id))
+        self.stats["events"] += len(chunk)
+        if not events:
+            return
+
+        with transaction.atomic():
+            statuses = dict(
+                Conversation.objects.select_for_update()
+                .filter(id__in=conversation_ids)
+                .values_list("id", "status")
+            )
+            self.start_chunk(Message.objects.existing_ids(message_ids))
+
+            for timestamp, payload, conversation_id, message_id in events:
+                try:
+                    self.apply_event(
+                        timestamp, payload, conversation_id, message_id, statuses
+                    )
+                except ValueError as e:
+                    self.rejected[str(e)] += 1
+            self.expire(max(event[0] for event in events))
+            self.write()
+
+            # Conversations created by this chunk cannot be cached yet.
+            touched = ({row[1] for row in self.messages} | set(self.closed)) - set(
+                self.new_conversations
+            )
+            closed = set(self.closed) | {
+                conversation_id
+                for conversation_id, row in self.new_conversations.items()
+                if row[1] == "CLOSED"
+            }
+            transaction.on_commit(lambda: self.on_commit(touched, closed))
+
+    def apply_event(self, timestamp, payload, conversation_id, message_id, statuses):
+        event_type = payload["type"]
+        status = statuses.get(conversation_id)
+        if event_type == "NEW_CONVERSATION":
+            if status is not None:
+                raise ValueError("Conversation already exists")
+            statuses[conversation_id] = "OPEN"
+            self.new_conversations[conversation_id] = [
+                conversation_id,
+                "OPEN",
+                timestamp,
+                timestamp,
+            ]
+            self.stats["applied"] += 1
+            for held_timestamp, held_id, content in self.held.pop(conversation_id, ()):
+                if (timestamp - held_timestamp).total_seconds() > BUFFER_TIMEOUT:
+                    self.stats["expired"] += 1
+                    continue
+                try:
+                    self.add_message(conversation_id, held_id, content, held_timestamp)
+                    self.stats["recovered"] += 1
+                except ValueError:
+                    self.stats["failed"] += 1
+
+        elif event_type == "NEW_MESSAGE":
+            if status is None:
+                self.held[conversation_id].append(
+                    (timestamp, message_id, payload["data"]["content"])
+                )
+                self.stats["held"] += 1
+                return
+            if status == "CLOSED":
+                raise ValueError("Conversation is closed")
+            self.add_message(
+                conversation_id, message_id, payload["data"]["content"], timestamp
+            )
+            self.stats["applied"] += 1
+
+        elif event_type == "CLOSE_CONVERSATION":
+            if status is None:
+                raise ValueError("Conversation not found")
+            if status == "CLOSED":
+                raise ValueError("Already closed")
+            statuses[conversation_id] = "CLOSED"
+            if conversation_id in self.new_conversations:
+                row = self.new_conversations[conversation_id]
+                row[1], row[3] = "CLOSED", timestamp
+            else:
+                self.closed[conversation_id] = timestamp
+            self.stats["applied"] += 1
+
+    def add_message(self, conversation_id, message_id, content: str, timestamp):
+        if message_id in self.known_messages:
+            raise ValueError("Message ID already exists")
+        self.known_messages.add(message_id)
+        self.messages.append(
+            (message_id, conversation_id, "INBOUND", content, timestamp)
+        )
+        if not self.outbound:
+            watermark = self.watermarks.get(conversation_id)
+            if watermark is None or (timestamp, message_id) > watermark:
+                self.watermarks[conversation_id] = (timestamp, message_id)
+            return
+        group = self.groups.get(conversation_id)
+        if (
+            group is not None
+            and (timestamp - group.last_timestamp).total_seconds() > PROCESSING_DELAY
+        ):
+            self.answer(conversation_id, self.groups.pop(conversation_id))
+            group = None
+        if group is None:
+            group = self.groups[conversation_id] = _Group()
+        group.add(message_id, timestamp)
+
+    def answer(self, conversation_id, group: _Group):
+        # The live path answers once the conversation has been quiet for
+        # `PROCESSING_DELAY` seconds.
+        self.messages.append(
+            (
+                uuid.uuid4(),
+                conversation_id,
+                "OUTBOUND",
+                build_outbound_content_for_ids(group.message_ids),
+                group.last_timestamp + timedelta(seconds=PROCESSING_DELAY),
+            )
+        )
+        self.watermarks[conversation_id] = (
+            group.last_timestamp,
+            group.message_ids[-1],
+        )
+        self.stats["outbound"] += 1
+
+    def expire(self, now):
+        """
+        Drops the held messages that can no longer be recovered, and answers the
+        groups that cannot grow anymore, as of the event time `now`.
+        """
+        for conversation_id in list(self.held):
+            kept = [
+                held
+                for held in self.held[conversation_id]
+                if (now - held[0]).total_seconds() <= BUFFER_TIMEOUT
+            ]
+            self.stats["expired"] += len(self.held[conversation_id]) - len(kept)
+            if kept:
+                self.held[conversation_id] = kept
+            else:
+                del self.held[conversation_id]
+        for conversation_id, group in list(self.groups.items()):
+            if (now - group.last_timestamp).total_seconds() > PROCESSING_DELAY:
+                self.answer(conversation_id, self.groups.pop(conversation_id))
+
+    def write(self):
+        copy_rows(
+            Conversation,
+            ["id", "status", "created_at", "updated_at"],
+            list(self.new_conversations.values()),
+        )
+        copy_rows(
+            Message,
+            ["id", "conversation", "type", "content", "timestamp"],
+            self.messages,
+        )
+        update_rows(
+            Conversation,
+            ["status", "updated_at"],
+            [
+                (conversation_id, "CLOSED", ts)
+                for conversation_id, ts in self.closed.items()
+            ],
+        )
+        advance_watermarks(
+            [
+                (conversation_id, timestamp, message_id)
+                for conversation_id, (timestamp, message_id) in self.watermarks.items()
+            ]
+        )
+
+    def finish(self):
+        """
+        Ends the replay: the messages still held are dropped, and the open groups
+        answered.
+        """
+        self.stats["expired"] += sum(len(held) for held in self.held.values())
+        self.held.clear()
+        if not self.groups:
+            return
+        with transaction.atomic():
+            self.start_chunk(set())
+            for conversation_id, group in self.groups.items():
+                self.answer(conversation_id, group)
+            self.groups = {}
+            self.write()
+            touched = {row[1] for row in self.messages}
+            transaction.on_commit(lambda: self.on_commit(touched, set()))
+
+    @staticmethod
+    def on_commit(touched: set, closed: set):
+        for conversation_id in touched:
+            detail_cache.invalidate(conversation_id)
+        ingest.mark_closed(closed)
+        status_cache.mark_closed(closed)
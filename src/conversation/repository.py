@@ -1,4 +1,6 @@
-from . import handlers
+import time
+from . import async_handlers, handlers, idempotency, ingest, metrics
+from django.http import HttpResponse, JsonResponse
 from rest_framework import status
 from rest_framework.response import Response
 
@@ -9,16 +11,44 @@ class Repository:
     This class provides methods to handle incoming webhook payloads for conversation events.
     """
 
+    SUCCESS_STATUS = {
+        "NEW_CONVERSATION": status.HTTP_201_CREATED,
+        "NEW_MESSAGE": status.HTTP_202_ACCEPTED,
+        "CLOSE_CONVERSATION": status.HTTP_200_OK,
+    }
+
     @staticmethod
     def handle_hook(payload: dict) -> Response:
         """
         Handle incoming webhook payloads for conversation events.
+        Retries of an event that was already applied are answered from the
+        idempotency filter, without reaching the database.
 
         Args:
             payload (dict): The payload containing event data.
         Returns:
             Response: HTTP response indicating the result of the operation.
         """
+        start = time.perf_counter()
+        if idempotency.seen(payload):
+            metrics.increment(
+                "conversation_duplicate_events_total", type=payload["type"]
+            )
+            response = Response(status=status.HTTP_400_BAD_REQUEST)
+        else:
+            response = Repository._handle_hook(payload)
+            if status.is_success(response.status_code):
+                idempotency.record(payload)
+        metrics.observe(
+            "conversation_event_duration_seconds",
+            time.perf_counter() - start,
+            type=payload.get("type"),
+            status=response.status_code,
+        )
+        return response
+
+    @staticmethod
+    def _handle_hook(payload: dict) -> Response:
         hook_type = payload.get("type")
         if hook_type == "NEW_CONVERSATION":
             try:
@@ -40,3 +70,94 @@ class Repository:
                 return Response(status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"error": "Unknow type"}, status=status.HTTP_400_BAD_REQUEST)
+
+    @staticmethod
+    def enqueue_hook(payload: dict) -> Response:
+        """
+        Checks a webhook payload against the ingestion state and appends it to the
+        ingestion log, to be applied by the `ingest_worker` processes. Answers with
+        the status `handle_hook` would have returned.
+
+        Args:
+            payload (dict): The payload containing event data.
+        Returns:
+            Response: HTTP response indicating the result of the operation.
+        """
+        start = time.perf_counter()
+        if ingest.append(payload) is None:
+            response = Response(status=Repository.SUCCESS_STATUS[payload["type"]])
+        else:
+            response = Response(status=status.HTTP_400_BAD_REQUEST)
+        metrics.observe(
+            "conversation_event_duration_seconds",
+            time.perf_counter() - start,
+            type=payload.get("type"),
+            status=response.status_code,
+        )
+        return response
+
+    @staticmethod
+    async def ahandle_hook(payload: dict) -> HttpResponse:
+        """
+        Asynchronous version of `handle_hook`, for the ASGI webhook view.
+
+        Args:
+            payload (dict): The payload containing event data.
+        Returns:
+            HttpResponse: HTTP response indicating the result of the operation.
+        """
+        start = time.perf_counter()
+        if await idempotency.aseen(payload):
+            await metrics.aincrement(
+                "conversation_duplicate_events_total", type=payload["type"]
+            )
+            response = HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+        else:
+            response = await Repository._ahandle_hook(payload)
+            if status.is_success(response.status_code):
+                await idempotency.arecord(payload)
+        await metrics.aobserve(
+            "conversation_event_duration_seconds",
+            time.perf_counter() - start,
+            type=payload.get("type"),
+            status=response.status_code,
+        )
+        return response
+
+    @staticmethod
+    async def _ahandle_hook(payload: dict) -> HttpResponse:
+        hook_type = payload.get("type")
+        handler = {
+            "NEW_CONVERSATION": async_handlers.handle_new_conversation,
+            "NEW_MESSAGE": async_handlers.handle_new_message,
+            "CLOSE_CONVERSATION": async_handlers.handle_close_conversation,
+        }.get(hook_type)
+        if handler is None:
+            return JsonResponse(
+                {"error": "Unknow type"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            await handler(payload)
+        except ValueError:
+            return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+        return HttpResponse(status=Repository.SUCCESS_STATUS[hook_type])
+
+    @staticmethod
+    def handle_batch(payloads: list[dict]) -> list[dict]:
+        """
+        Handle a batch of validated webhook payloads.
+
+        Args:
+            payloads (list[dict]): The validated payloads, in arrival order.
+        Returns:
+            list[dict]: The result of each payload, with the HTTP status code the
+            single-event endpoint would have returned and, on failure, the error.
+        """
+        results = []
+        for payload, error in zip(payloads, handlers.handle_batch(payloads)):
+            if error is None:
+                results.append({"status": Repository.SUCCESS_STATUS[payload["type"]]})
+            else:
+                results.append({"status": status.HTTP_400_BAD_REQUEST, "error": error})
+        return results
@@ -0,0 +1,63 @@
+from django.conf import settings
+from .sharding import shard_for
+
+# Celery router sending the tasks of a conversation to one of
+# `CONVERSATION_QUEUES` queues, picked from the conversation ID. With one worker
+# process consuming each queue, the tasks of a conversation run one at a time and
+# in order, while different conversations are spread over the workers.
+
+QUEUE_NAME = "conversation.{}"
+
+
+def _conversation_argument(name: str):
+    def get(args, kwargs):
+        return kwargs[name] if name in kwargs else args[0]
+
+    return get
+
+
+def _payload_conversation(args, kwargs):
+    payload = kwargs["payload"] if "payload" in kwargs else args[0]
+    return payload["data"]["conversation_id"]
+
+
+# Task name -> how to read the conversation ID from the task arguments.
+CONVERSATION_TASKS = {
+    "conversation.tasks.buffer_message_until_conversation_exists": (
+        _payload_conversation
+    ),
+    "conversation.tasks.process_buffer_for_conversation": _conversation_argument(
+        "conversation_id"
+    ),
+    "conversation.tasks.debounce_conversation_processing": _conversation_argument(
+        "conversation_id"
+    ),
+    "conversation.tasks.process_conversation_messages": _conversation_argument(
+        "conversation_id"
+    ),
+}
+
+
+def route_task(name, args, kwargs, options, task=None, **kw) -> dict | None:
+    """
+    Celery router (`task_routes`) for the conversation tasks.
+
+    Args:
+        name (str): The name of the task.
+        args (tuple): The positional arguments of the task.
+        kwargs (dict): The keyword arguments of the task.
+        options (dict): The options the task is published with.
+    Returns:
+        dict | None: The queue of the task, or None to leave it to the next router
+        (the default queue) if it is not a conversation task, routing is disabled
+        or the conversation ID cannot be read.
+    """
+    get_conversation_id = CONVERSATION_TASKS.get(name)
+    if get_conversation_id is None or not settings.CONVERSATION_QUEUES:
+        return None
+    try:
+        conversation_id = get_conversation_id(args or (), kwargs or {})
+        shard = shard_for(conversation_id, settings.CONVERSATION_QUEUES)
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+    return {"queue": QUEUE_NAME.format(shard)}
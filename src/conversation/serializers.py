@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .constants import MESSAGES_MAX_PAGE_SIZE
 from .models import Conversation, Message
 
 
@@ -16,6 +17,38 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = ["id", "status", "created_at", "updated_at", "messages"]
 
 
+class RecentMessagesConversationSerializer(ConversationSerializer):
+    messages = MessageSerializer(source="recent_messages", many=True, read_only=True)
+
+
+class RecentMessagesQuerySerializer(serializers.Serializer):
+    recent = serializers.IntegerField(
+        min_value=1, max_value=MESSAGES_MAX_PAGE_SIZE, required=False
+    )
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    format = serializers.ChoiceField(choices=["ndjson", "csv"], default="ndjson")
+    status = serializers.ChoiceField(
+        choices=[choice for choice, _ in Conversation.STATUS_CHOICES], required=False
+    )
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs) -> dict:
+        since, until = attrs.get("since"), attrs.get("until")
+        if since is not None and until is not None and since >= until:
+            raise serializers.ValidationError({"until": "Must be later than since"})
+        return attrs
+
+
+WEBHOOK_REQUIRED_DATA_FIELDS = {
+    "NEW_CONVERSATION": ("id",),
+    "NEW_MESSAGE": ("id", "content", "conversation_id"),
+    "CLOSE_CONVERSATION": ("id",),
+}
+
+
 class WebhookBaseSerializer(serializers.Serializer):
     FIELD_REQUIRED_ERROR = "This field is required"
 
@@ -29,22 +62,53 @@ class WebhookBaseSerializer(serializers.Serializer):
         event_type = attrs["type"]
         data = attrs["data"]
 
-        if event_type == "NEW_CONVERSATION":
-            if "id" not in data:
+        for field in WEBHOOK_REQUIRED_DATA_FIELDS[event_type]:
+            if field not in data:
                 raise serializers.ValidationError(
-                    {"data": {"id": self.FIELD_REQUIRED_ERROR}}
+                    {"data": {field: self.FIELD_REQUIRED_ERROR}}
                 )
 
-        elif event_type == "NEW_MESSAGE":
-            for field in ["id", "content", "conversation_id"]:
-                if field not in data:
-                    raise serializers.ValidationError(
-                        {"data": {field: self.FIELD_REQUIRED_ERROR}}
-                    )
+        return attrs
 
-        elif event_type == "CLOSE_CONVERSATION" and "id" not in data:
-            raise serializers.ValidationError(
-                {"data": {"id": self.FIELD_REQUIRED_ERROR}}
-            )
 
-        return attrs
+_webhook_timestamp_field = serializers.DateTimeField()
+
+
+def validate_webhook_event(data) -> dict | None:
+    """
+    Fast path for `WebhookBaseSerializer`, checking the known event shapes directly.
+
+    Args:
+        data: The parsed request body.
+    Returns:
+        dict | None: The same payload as `WebhookBaseSerializer(data=data).data` if the
+        event is valid, or None if it is not a well-formed event. In that case the
+        serializer must be run to report the errors.
+    """
+    if type(data) is not dict:
+        return None
+    event_type = data.get("type")
+    required = (
+        WEBHOOK_REQUIRED_DATA_FIELDS.get(event_type)
+        if type(event_type) is str
+        else None
+    )
+    event_data = data.get("data")
+    timestamp = data.get("timestamp")
+    if required is None or type(event_data) is not dict or type(timestamp) is not str:
+        return None
+    for field in required:
+        if field not in event_data:
+            return None
+
+    try:
+        timestamp = _webhook_timestamp_field.to_representation(
+            _webhook_timestamp_field.to_internal_value(timestamp)
+        )
+    except serializers.ValidationError:
+        return None
+    return {
+        "type": event_type,
+        "timestamp": timestamp,
+        "data": {str(key): value for key, value in event_data.items()},
+    }
@@ -0,0 +1,20 @@
+import uuid
+import zlib
+
+
+def shard_for(conversation_id, shards: int) -> int:
+    """
+    Maps a conversation to one of `shards` shards.
+    The mapping only depends on the conversation ID (in any of its string forms),
+    so it is the same in every process.
+
+    Args:
+        conversation_id: The ID of the conversation.
+        shards (int): The number of shards.
+    Returns:
+        int: The shard, between 0 and `shards - 1`.
+    Raises:
+        ValueError: If the ID is not a valid UUID.
+    """
+    canonical = str(uuid.UUID(str(conversation_id)))
+    return zlib.crc32(canonical.encode("ascii")) % shards
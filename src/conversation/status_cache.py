@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from .async_redis import get_async_redis_connection
+from .constants import STATUS_CACHE_RETRY, STATUS_CACHE_SIZE, STATUS_CACHE_TTL
+
+# Two-tier cache telling whether a conversation is closed, so that messages sent to
+# a closed conversation are refused without reaching the database:
+#
+# - a bounded LRU in each process (gunicorn, uvicorn and Celery workers);
+# - Redis (`conversation:status:{id}`), shared by every process and read on a miss.
+#
+# Closes are recorded on commit (handlers, batches, replays, and the refusals that
+# find a conversation closed in the database), and announced on a pub/sub channel
+# that a thread of each process listens to, to update its LRU.
+#
+# Only CLOSED is acted upon. It is terminal, so a cached CLOSED is never stale.
+# Anything else leads to the conditional insert, which checks the status in the
+# database in the same statement: a process that has not heard of a close yet
+# finds it there, so correctness never depends on the cache. Unknown
+# conversations are not cached, so creating one invalidates nothing.
+
+logger = logging.getLogger(__name__)
+
+STATUS_KEY = "conversation:status:{}"
+CHANNEL = "conversation:status:closed"
+
+_lock = threading.Lock()
+_closed = OrderedDict()
+_listener = {"pid": None, "thread": None, "retry_at": 0.0}
+
+
+def _local_get(conversation_id: str) -> bool | None:
+    with _lock:
+        closed = _closed.get(conversation_id)
+        if closed is not None:
+            _closed.move_to_end(conversation_id)
+        return closed
+
+
+def _local_set(conversation_id: str, closed: bool):
+    with _lock:
+        # CLOSED is terminal: an open entry never overrides it.
+        _closed[conversation_id] = closed or _closed.get(conversation_id, False)
+        _closed.move_to_end(conversation_id)
+        while len(_closed) > STATUS_CACHE_SIZE:
+            _closed.popitem(last=False)
+
+
+def _on_message(message):
+    for conversation_id in json.loads(message["data"]):
+        _local_set(conversation_id, True)
+
+
+def _on_listener_error(error, pubsub, thread):
+    # Closes published while disconnected are lost. The LRU keeps its CLOSED
+    # entries, which stay true, and the open ones are corrected by the database.
+    logger.warning("Conversation status listener disconnected: %s", error)
+    time.sleep(STATUS_CACHE_RETRY)
+
+
+def _ensure_listener():
+    """
+    Starts the thread listening to the closes, once per process (Celery forks its
+    workers, so the PID is checked).
+    """
+    pid = os.getpid()
+    if _listener["pid"] == pid or time.monotonic() < _listener["retry_at"]:
+        return
+    with _lock:
+        if _listener["pid"] == pid:
+            return
+        if _listener["pid"] is not None:
+            # Forked from a process that was already listening.
+            _closed.clear()
+        try:
+            pubsub = get_redis_connection("default").pubsub(
+                ignore_subscribe_messages=True
+            )
+            pubsub.subscribe(**{CHANNEL: _on_message})
+        except RedisError as e:
+            logger.warning("Could not listen to conversation statuses: %s", e)
+            _listener["retry_at"] = time.monotonic() + STATUS_CACHE_RETRY
+            return
+        _listener["thread"] = pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=_on_listener_error
+        )
+        _listener["pid"] = pid
+
+
+def is_closed(conversation_id) -> bool:
+    """
+    Tells whether a conversation is known to be closed, from the process LRU, then
+    from Redis. False means unknown, not open.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    """
+    if not settings.STATUS_CACHE_ENABLED:
+        return False
+    conversation_id = str(conversation_id)
+    _ensure_listener()
+    closed = _local_get(conversation_id)
+    if closed is not None:
+        return closed
+    try:
+        closed = bool(
+            get_redis_connection("default").exists(STATUS_KEY.format(conversation_id))
+        )
+    except RedisError as e:
+        logger.warning("Could not read conversation status: %s", e)
+        return False
+    if closed:
+        _local_set(conversation_id, True)
+    return closed
+
+
+async def ais_closed(conversation_id) -> bool:
+    """
+    Asynchronous version of `is_closed`, using the asyncio Redis client.
+    """
+    if not settings.STATUS_CACHE_ENABLED:
+        return False
+    conversation_id = str(conversation_id)
+    _ensure_listener()
+    closed = _local_get(conversation_id)
+    if closed is not None:
+        return closed
+    try:
+        closed = bool(
+            await get_async_redis_connection("default").exists(
+                STATUS_KEY.format(conversation_id)
+            )
+        )
+    except RedisError as e:
+        logger.warning("Could not read conversation status: %s", e)
+        return False
+    if closed:
+        _local_set(conversation_id, True)
+    return closed
+
+
+def remember_open(conversation_id):
+    """
+    Records in the process LRU that a conversation accepted a message, so the next
+    messages skip the Redis read until it is closed.
+
+    Args:
+        conversation_id: The ID of the conversation.
+    """
+    if settings.STATUS_CACHE_ENABLED:
+        _local_set(str(conversation_id), False)
+
+
+def mark_closed(conversation_ids):
+    """
+    Records closed conversations in Redis and announces them to every process.
+    Call it once the close is committed.
+
+    Args:
+        conversation_ids: The IDs of the closed conversations.
+    """
+    conversation_ids = [str(conversation_id) for conversation_id in conversation_ids]
+    if not settings.STATUS_CACHE_ENABLED or not conversation_ids:
+        return
+    for conversation_id in conversation_ids:
+        _local_set(conversation_id, True)
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for conversation_id in conversation_ids:
+            pipe.set(STATUS_KEY.format(conversation_id), 1, ex=STATUS_CACHE_TTL)
+        pipe.publish(CHANNEL, json.dumps(conversation_ids))
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record closed conversations: %s", e)
+
+
+async def amark_closed(conversation_ids):
+    """
+    Asynchronous version of `mark_closed`, using the asyncio Redis client.
+    """
+    conversation_ids = [str(conversation_id) for conversation_id in conversation_ids]
+    if not settings.STATUS_CACHE_ENABLED or not conversation_ids:
+        return
+    for conversation_id in conversation_ids:
+        _local_set(conversation_id, True)
+    try:
+        pipe = get_async_redis_connection("default").pipeline(transaction=False)
+        for conversation_id in conversation_ids:
+            pipe.set(STATUS_KEY.format(conversation_id), 1, ex=STATUS_CACHE_TTL)
+        pipe.publish(CHANNEL, json.dumps(conversation_ids))
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning("Could not record closed conversations: %s", e)
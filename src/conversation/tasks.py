@@ -1,36 +1,49 @@
+import itertools
+from collections import defaultdict
+from operator import attrgetter
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils.timezone import now, timedelta
 from .models import Conversation, Message
 from django.utils.dateparse import parse_datetime
 import time
-from django.core.cache import cache
-from django_redis import get_redis_connection
-from .constants import BUFFER_TIMEOUT, INVALID_TIMEOUT
-import json
+from .constants import (
+    ARCHIVE_BATCH_SIZE,
+    BUFFER_TIMEOUT,
+    DEBOUNCE_RECOVERY_BATCH_SIZE,
+    INVALID_TIMEOUT,
+    PROCESSING_DELAY,
+)
+from . import archive, buffer, bulk, debounce, detail_cache, events, metrics, partitions
+from .serializers import MessageSerializer
 
 
 @shared_task
 def buffer_message_until_conversation_exists(payload: dict):
     """
     Buffers a message until the conversation exists.
-    This task stores the message in a cache until the conversation is created.
+    This task stores the message in the conversation's buffer until the conversation is created.
+    If the conversation was created in the meantime, the message is handled right away.
 
     Args:
         payload (dict): The payload containing message data.
     Raises:
         ValueError: If the payload does not contain the required fields.
     """
-    conv_id = payload["data"]["conversation_id"]
-    msg_id = payload["data"]["id"]
-    cache_key = f"buffer:{conv_id}:{msg_id}"
-    cache.set(cache_key, json.dumps(payload), timeout=BUFFER_TIMEOUT)
+    conversation_timestamp = buffer.push(payload)
+    if conversation_timestamp is None:
+        metrics.increment("conversation_buffer_messages_total", outcome="buffered")
+    else:
+        _handle_buffered_message(payload, conversation_timestamp)
 
 
 @shared_task
 def process_buffer_for_conversation(conversation_id: str, timestamp: str):
     """
     Processes buffered messages for a conversation.
-    This task retrieves messages from the cache that were buffered while the conversation was being created.
+    This task retrieves messages from the buffer that were received while the conversation was being created.
 
     Args:
         conversation_id (str): The ID of the conversation.
@@ -38,114 +51,334 @@ def process_buffer_for_conversation(conversation_id: str, timestamp: str):
     Raises:
         ValueError: If the conversation does not exist.
     """
-    redis_conn = get_redis_connection("default")
-    prefix = f"*:buffer:{conversation_id}:*"
-    keys = redis_conn.keys(prefix)
+    for payload in buffer.drain(conversation_id, timestamp):
+        _handle_buffered_message(payload, timestamp)
 
-    for key in keys:
-        key_str = key.decode("utf-8")
-        if key_str.startswith(":1:"):
-            key_str = key_str[3:]
-        payload_str = cache.get(key_str)
-        if not payload_str:
-            continue
-        payload = json.loads(payload_str)
-        message_timestamp = parse_datetime(payload["timestamp"])
-
-        conversation_timestamp = parse_datetime(timestamp)
-        diff_timestamp = (
-            conversation_timestamp - message_timestamp
-            if message_timestamp and conversation_timestamp
-            else INVALID_TIMEOUT
-        )
-        total_seconds = (
-            diff_timestamp.total_seconds()
-            if isinstance(diff_timestamp, timedelta)
-            else diff_timestamp
+
+def _handle_buffered_message(payload: dict, timestamp: str):
+    message_timestamp = parse_datetime(payload["timestamp"])
+
+    conversation_timestamp = parse_datetime(timestamp)
+    diff_timestamp = (
+        conversation_timestamp - message_timestamp
+        if message_timestamp and conversation_timestamp
+        else INVALID_TIMEOUT
+    )
+    total_seconds = (
+        diff_timestamp.total_seconds()
+        if isinstance(diff_timestamp, timedelta)
+        else diff_timestamp
+    )
+
+    if total_seconds > BUFFER_TIMEOUT:
+        metrics.increment("conversation_buffer_messages_total", outcome="expired")
+        return
+
+    from .handlers import handle_new_message
+
+    try:
+        handle_new_message(payload, from_buffer=True)
+    except Exception:
+        metrics.increment("conversation_buffer_messages_total", outcome="failed")
+    else:
+        metrics.increment("conversation_buffer_messages_total", outcome="recovered")
+
+
+@shared_task
+def debounce_conversation_processing(conversation_id: str):
+    """
+    Fires the processing of a conversation once its quiet window has expired.
+    If new messages pushed the deadline forward meanwhile, the task reschedules
+    itself for the remaining time instead, so a burst of messages results in a
+    single processing job.
+
+    Args:
+        conversation_id (str): The ID of the conversation to process messages for.
+    """
+    remaining = debounce.claim(conversation_id)
+    if remaining is None:
+        return
+    if remaining > 0:
+        debounce_conversation_processing.apply_async(
+            args=[conversation_id], countdown=remaining
         )
+        return
+    metrics.observe("conversation_processing_delay_seconds", -remaining)
+    process_conversation_messages(conversation_id)
 
-        if total_seconds <= BUFFER_TIMEOUT:
-            from .handlers import handle_new_message
 
-            try:
-                handle_new_message(payload, from_buffer=True)
-            except Exception:
-                pass
-        cache.delete(key_str)
+@shared_task
+def recover_lost_processing_jobs() -> int:
+    """
+    Schedules a new processing job for every conversation whose deadline is overdue
+    by more than `DEBOUNCE_STALE_AFTER` seconds: its job was lost (a worker crash),
+    and it may never get another message to schedule one. Run by Celery beat when
+    `CONVERSATION_PROCESSING_MODE` is "task"; sweeps pick these conversations up
+    like any other.
+
+    Returns:
+        int: The number of rescheduled conversations.
+    """
+    total = 0
+    while True:
+        lost = debounce.recover_lost(DEBOUNCE_RECOVERY_BATCH_SIZE)
+        for conversation_id in lost:
+            debounce_conversation_processing.apply_async(args=[conversation_id])
+        total += len(lost)
+        if len(lost) < DEBOUNCE_RECOVERY_BATCH_SIZE:
+            return total
 
 
-@shared_task(bind=True)
+@shared_task
 def process_conversation_messages(conversation_id: str, *args, **kwargs):
     """
     Processes messages in a conversation to group inbound messages
     that were received within 5 seconds of each other and creates an outbound message
-    summarizing them.
+    summarizing each group.
+
+    Only inbound messages past the conversation's processing watermark are read,
+    and the watermark is moved forward in the same transaction as the outbound
+    insert, so the cost depends on the new messages only.
 
     Args:
         conversation_id (str): The ID of the conversation to process messages for.
     """
-    try:
-        conversation = Conversation.objects.get(id=conversation_id)
-    except Conversation.DoesNotExist:
-        return
+    process_conversations([conversation_id])
 
-    inbound_msgs = Message.objects.filter(
-        conversation=conversation,
-        type="INBOUND",
-    ).order_by("timestamp")
 
-    if not inbound_msgs.exists():
-        return
+@shared_task
+def sweep_due_conversations() -> int:
+    """
+    Processes every conversation whose quiet window has expired, in batches of
+    `CONVERSATION_SWEEP_BATCH_SIZE`, until none is left. Run by Celery beat when
+    `CONVERSATION_PROCESSING_MODE` is "sweep".
+
+    Returns:
+        int: The number of processed conversations.
+    """
+    batch_size = settings.CONVERSATION_SWEEP_BATCH_SIZE
+    total = 0
+    while True:
+        claimed = debounce.claim_due(batch_size)
+        if not claimed:
+            return total
+        conversation_ids = [conversation_id for conversation_id, _ in claimed]
+        try:
+            process_conversations(conversation_ids)
+        except Exception:
+            # Claimed conversations are out of the due-set, put them back so the
+            # next sweep retries them.
+            debounce.release(conversation_ids)
+            raise
+        metrics.observe_many(
+            "conversation_processing_delay_seconds", [late for _, late in claimed]
+        )
+        total += len(claimed)
+        if len(claimed) < batch_size:
+            return total
+
+
+def process_conversations(conversation_ids: list) -> int:
+    """
+    Groups the new inbound messages of several conversations and answers each
+    group with an outbound message, in one transaction: the conversations are
+    locked, their unprocessed messages read and their outbound messages inserted
+    with one query each, whatever their number.
+
+    Args:
+        conversation_ids (list): The IDs of the conversations. Missing ones are
+            ignored.
+    Returns:
+        int: The number of outbound messages created.
+    """
+    with transaction.atomic():
+        # Locked in ID order, so concurrent batches cannot deadlock.
+        locked_ids = list(
+            Conversation.objects.select_for_update()
+            .filter(id__in=conversation_ids)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        if not locked_ids:
+            return 0
 
-    latest_outbound = (
-        Message.objects.filter(conversation=conversation, type="OUTBOUND")
-        .order_by("-timestamp")
-        .first()
+        outbound_msgs = []
+        watermarks = []
+        for conversation_id, inbound_msgs in itertools.groupby(
+            unprocessed_inbound_messages(locked_ids),
+            key=attrgetter("conversation_id"),
+        ):
+            inbound_msgs = list(inbound_msgs)
+            outbound_msgs.extend(
+                Message(
+                    conversation_id=conversation_id,
+                    type="OUTBOUND",
+                    content=build_outbound_content(group),
+                    timestamp=now(),
+                )
+                for group in group_inbound_messages(inbound_msgs)
+            )
+            watermarks.append(
+                (conversation_id, inbound_msgs[-1].timestamp, inbound_msgs[-1].id)
+            )
+        if not outbound_msgs:
+            return 0
+
+        Message.objects.bulk_create(outbound_msgs)
+        bulk.update_rows(
+            Conversation,
+            ["last_processed_timestamp", "last_processed_message_id"],
+            watermarks,
+        )
+
+        serialized = defaultdict(list)
+        for message, data in zip(
+            outbound_msgs, MessageSerializer(outbound_msgs, many=True).data
+        ):
+            serialized[message.conversation_id].append(data)
+
+        def notify():
+            for conversation_id, messages in serialized.items():
+                detail_cache.append_messages(conversation_id, messages)
+                events.publish_messages(conversation_id, messages)
+            metrics.increment(
+                "conversation_outbound_messages_total", len(outbound_msgs)
+            )
+
+        transaction.on_commit(notify)
+        return len(outbound_msgs)
+
+
+@shared_task
+def maintain_message_partitions() -> dict:
+    """
+    Creates the monthly partitions of the messages table for the coming months, and
+    detaches (or drops) the ones past the retention. Run daily by Celery beat, it
+    does nothing unless the table is partitioned (PostgreSQL).
+
+    Returns:
+        dict: The names of the created and expired partitions.
+    """
+    return partitions.maintain(
+        ahead=settings.MESSAGES_PARTITIONS_AHEAD,
+        retention=settings.MESSAGES_RETENTION_MONTHS,
+        drop=settings.MESSAGES_RETENTION_DROP,
     )
 
-    if latest_outbound:
-        inbound_msgs = inbound_msgs.filter(timestamp__gt=latest_outbound.timestamp)
 
-    if not inbound_msgs.exists():
-        return
+@shared_task
+def archive_closed_conversations() -> int:
+    """
+    Archives the conversations closed for more than `CONVERSATION_ARCHIVE_AFTER_DAYS`
+    days, in batches, until none is left. Run hourly by Celery beat.
+
+    Returns:
+        int: The number of archived conversations.
+    """
+    if not settings.CONVERSATION_ARCHIVE_AFTER_DAYS:
+        return 0
+    closed_for = timedelta(days=settings.CONVERSATION_ARCHIVE_AFTER_DAYS)
+    total = 0
+    while True:
+        archived = archive.archive_closed_conversations(closed_for, ARCHIVE_BATCH_SIZE)
+        total += archived
+        if archived < ARCHIVE_BATCH_SIZE:
+            return total
 
-    grouped_ids = []
+
+def unprocessed_inbound_messages(conversation_ids: list):
+    """
+    Returns the inbound messages of conversations past their processing
+    watermarks, ordered by `(conversation, timestamp, id)`. Only the fields used
+    for grouping are loaded.
+
+    Args:
+        conversation_ids (list): The IDs of the conversations to read messages from.
+    """
+    return (
+        Message.objects.filter(
+            Q(conversation__last_processed_timestamp__isnull=True)
+            | Q(timestamp__gt=F("conversation__last_processed_timestamp"))
+            | Q(
+                timestamp=F("conversation__last_processed_timestamp"),
+                id__gt=F("conversation__last_processed_message_id"),
+            ),
+            conversation_id__in=conversation_ids,
+            type="INBOUND",
+        )
+        .only("id", "conversation_id", "timestamp")
+        .order_by("conversation_id", "timestamp", "id")
+    )
+
+
+def group_inbound_messages(messages) -> list[list[Message]]:
+    """
+    Groups messages received within 5 seconds of each other.
+
+    Args:
+        messages: The inbound messages, ordered by timestamp.
+    Returns:
+        list[list[Message]]: The groups of messages, in order.
+    """
+    groups = []
     current_group = []
     last_ts = None
 
-    for msg in inbound_msgs:
+    for msg in messages:
         if not current_group:
             current_group = [msg]
             last_ts = msg.timestamp
             continue
 
-        if last_ts and (msg.timestamp - last_ts).total_seconds() <= 5:
+        if last_ts and (msg.timestamp - last_ts).total_seconds() <= PROCESSING_DELAY:
             current_group.append(msg)
         else:
-            grouped_ids.append([str(m.id) for m in current_group])
+            groups.append(current_group)
             current_group = [msg]
         last_ts = msg.timestamp
 
     if current_group:
-        grouped_ids.append([str(m.id) for m in current_group])
+        groups.append(current_group)
+    return groups
 
-    content = "Mensagens recebidas:\n" + "\n".join(grouped_ids) + "\n"
 
-    Message.objects.create(
-        conversation=conversation,
-        type="OUTBOUND",
-        content=content,
-        timestamp=now(),
-    )
+def build_outbound_content(group: list[Message]) -> str:
+    """
+    Builds the content of the outbound message that answers a group of messages.
+
+    Args:
+        group (list[Message]): The grouped inbound messages.
+    """
+    return build_outbound_content_for_ids([m.id for m in group])
+
+
+def build_outbound_content_for_ids(message_ids: list) -> str:
+    """
+    Builds the content of the outbound message that answers a group of messages,
+    from their IDs.
+
+    Args:
+        message_ids (list): The IDs of the grouped inbound messages.
+    """
+    return "Mensagens recebidas:\n" + "\n".join(str(i) for i in message_ids) + "\n"
 
 
 def schedule_message_processing(conversation_id):
     """
     Schedules the processing of messages in a conversation.
     This function is called after a new message is added to a conversation.
-    It delays the processing of messages to allow for grouping of inbound messages.
+    Every call pushes the conversation's processing deadline forward, and only the
+    first call of a burst enqueues a (debounced) processing job, or the first call
+    after that job was lost (its deadline is long overdue; without a new message,
+    `recover_lost_processing_jobs` schedules it again). In the "sweep"
+    processing mode, no job is enqueued: `sweep_due_conversations` picks the
+    conversation up once its deadline has passed.
 
     Args:
         conversation_id (str): The ID of the conversation to process messages for.
     """
-    process_conversation_messages.apply_async(args=[str(conversation_id)], countdown=5)
+    added = debounce.touch(conversation_id, PROCESSING_DELAY)
+    if added and settings.CONVERSATION_PROCESSING_MODE != "sweep":
+        debounce_conversation_processing.apply_async(
+            args=[str(conversation_id)], countdown=PROCESSING_DELAY
+        )
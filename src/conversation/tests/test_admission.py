@@ -0,0 +1,186 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from redis.exceptions import ConnectionError
+from rest_framework import status
+from unittest.mock import patch
+import fakeredis
+import math
+import time
+import uuid
+
+from conversation import admission, debounce
+from conversation.constants import DEBOUNCE_KEY, DEBOUNCE_STALE_AFTER
+from conversation.models import Conversation
+
+
+@override_settings(
+    ADMISSION_ENABLED=True,
+    ADMISSION_MAX_QUEUE_DEPTH=10,
+    ADMISSION_MAX_PROCESSING_LAG=30,
+    CONVERSATION_RATE_LIMIT=1,
+    CONVERSATION_RATE_BURST=2,
+    CONVERSATION_QUEUES=2,
+)
+class AdmissionTestCase(SimpleTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        for target, client in [
+            ("get_redis_connection", self.redis),
+            ("get_async_redis_connection", fakeredis.FakeAsyncRedis(server=server)),
+            ("_broker_connection", self.redis),
+        ]:
+            patcher = patch(f"conversation.admission.{target}", return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch(
+            "conversation.debounce.get_redis_connection", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        admission._overload.update(checked_at=-math.inf, reason=None)
+        self.addCleanup(admission._overload.update, checked_at=-math.inf, reason=None)
+
+    def event(self, conversation_id=None) -> dict:
+        return {
+            "type": "NEW_MESSAGE",
+            "timestamp": now().isoformat(),
+            "data": {
+                "id": str(uuid.uuid4()),
+                "conversation_id": conversation_id or str(uuid.uuid4()),
+                "content": "Oi",
+            },
+        }
+
+    def test_conversations_are_rate_limited(self):
+        conversation_id = str(uuid.uuid4())
+        self.assertIsNone(admission.admit(self.event(conversation_id)))
+        self.assertIsNone(admission.admit(self.event(conversation_id)))
+        self.assertEqual(
+            admission.admit(self.event(conversation_id)),
+            (429, "Too many events for this conversation", 1),
+        )
+        # Other conversations have their own bucket.
+        self.assertIsNone(admission.admit(self.event()))
+
+        with patch("conversation.admission.time.time", return_value=time.time() + 1):
+            self.assertIsNone(admission.admit(self.event(conversation_id)))
+
+    def test_deep_queues_are_refused(self):
+        self.redis.rpush("celery", *range(5))
+        self.redis.rpush("conversation.1", *range(6))
+        self.assertEqual(
+            admission.admit(self.event()), (503, "Processing queues are full", 5)
+        )
+
+    def test_processing_lag_is_refused(self):
+        debounce.touch(uuid.uuid4(), -31)
+        self.assertEqual(
+            admission.admit(self.event())[:2], (503, "Processing is lagging behind")
+        )
+
+    def test_lost_jobs_are_not_processing_lag(self):
+        # A conversation whose job was lost keeps its old deadline until its next
+        # message: it does not refuse the events of every other conversation.
+        self.redis.zadd(
+            DEBOUNCE_KEY, {str(uuid.uuid4()): time.time() - DEBOUNCE_STALE_AFTER - 1}
+        )
+        debounce.touch(uuid.uuid4(), -10)
+        self.assertIsNone(admission.admit(self.event()))
+
+    def test_load_is_checked_once_per_interval(self):
+        self.assertIsNone(admission.admit(self.event()))
+        debounce.touch(uuid.uuid4(), -31)
+        self.assertIsNone(admission.admit(self.event()))
+
+        admission._overload["checked_at"] -= 1
+        self.assertIsNotNone(admission.admit(self.event()))
+
+    def test_fails_open(self):
+        with (
+            patch.object(self.redis, "evalsha", side_effect=ConnectionError),
+            patch("conversation.admission._check_load", side_effect=ConnectionError),
+        ):
+            with self.assertLogs("conversation.admission", "WARNING"):
+                self.assertIsNone(admission.admit(self.event()))
+
+    def test_batches_admit_each_conversation_in_order(self):
+        conversation_id = str(uuid.uuid4())
+        events = [self.event(conversation_id) for _ in range(3)] + [self.event()]
+        results = admission.admit_batch(events)
+        self.assertEqual(results[:2], [None, None])
+        self.assertEqual(results[2][0], 429)
+        self.assertIsNone(results[3])
+
+    def test_lag_threshold_must_be_below_lost_jobs(self):
+        admission.check_settings()
+        for lag in (DEBOUNCE_STALE_AFTER, DEBOUNCE_STALE_AFTER + 1):
+            with override_settings(ADMISSION_MAX_PROCESSING_LAG=lag):
+                with self.assertRaises(ImproperlyConfigured):
+                    admission.check_settings()
+
+    async def test_async_admission(self):
+        conversation_id = str(uuid.uuid4())
+        for _ in range(2):
+            self.assertIsNone(await admission.aadmit(self.event(conversation_id)))
+        rejection = await admission.aadmit(self.event(conversation_id))
+        self.assertEqual(rejection[0], 429)
+
+
+class WebhookAdmissionTestCase(TestCase):
+    def post(self, url_name: str, data):
+        return self.client.post(
+            reverse(url_name), data, content_type="application/json"
+        )
+
+    @patch(
+        "conversation.admission.admit",
+        return_value=(503, "Processing queues are full", 5),
+    )
+    def test_refused_events_are_not_handled(self, mock_admit):
+        response = self.post(
+            "webhook",
+            {
+                "type": "NEW_CONVERSATION",
+                "timestamp": now().isoformat(),
+                "data": {"id": str(uuid.uuid4())},
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertFalse(Conversation.objects.exists())
+
+    @patch("conversation.handlers.process_buffer_for_conversation.delay")
+    def test_batches_handle_the_admitted_events(self, mock_delay):
+        ids = [str(uuid.uuid4()) for _ in range(2)]
+        events = [
+            {
+                "type": "NEW_CONVERSATION",
+                "timestamp": now().isoformat(),
+                "data": {"id": conversation_id},
+            }
+            for conversation_id in ids
+        ]
+        with patch(
+            "conversation.admission.admit_batch",
+            return_value=[None, (429, "Too many events for this conversation", 2)],
+        ):
+            response = self.post("webhook-batch", events)
+
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {"status": 201},
+                {
+                    "status": 429,
+                    "error": "Too many events for this conversation",
+                    "retry_after": 2,
+                },
+            ],
+        )
+        self.assertEqual(
+            list(Conversation.objects.values_list("id", flat=True)),
+            [uuid.UUID(ids[0])],
+        )
@@ -0,0 +1,84 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now, timedelta
+
+from conversation import archive
+from conversation.models import Conversation, ConversationArchive, Message
+from conversation.tasks import archive_closed_conversations
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.conversation = Conversation.objects.create(status="CLOSED")
+        base = now() - timedelta(days=40)
+        for i in range(5):
+            Message.objects.create(
+                conversation=self.conversation,
+                type="INBOUND" if i % 2 == 0 else "OUTBOUND",
+                content=f"Message {i}",
+                timestamp=base + timedelta(seconds=i),
+            )
+        self.close(self.conversation, days_ago=31)
+        self.url = reverse("conversation-detail", args=[self.conversation.id])
+
+    def close(self, conversation, days_ago):
+        Conversation.objects.filter(id=conversation.id).update(
+            status="CLOSED", updated_at=now() - timedelta(days=days_ago)
+        )
+
+    def test_detail_is_read_from_the_archive(self):
+        before = self.client.get(self.url).json()
+        recent_before = self.client.get(f"{self.url}?recent=2").json()
+
+        self.assertTrue(archive.archive_conversation(self.conversation.id))
+        cache.clear()
+
+        self.assertFalse(Message.objects.exists())
+        stored = ConversationArchive.objects.get(conversation=self.conversation)
+        self.assertEqual(stored.message_count, 5)
+        self.assertEqual(self.client.get(self.url).json(), before)
+        self.assertEqual(self.client.get(f"{self.url}?recent=2").json(), recent_before)
+
+    def test_only_archives_conversations_closed_long_enough(self):
+        open_conversation = Conversation.objects.create(status="OPEN")
+        recently_closed = Conversation.objects.create(status="OPEN")
+        self.close(recently_closed, days_ago=1)
+
+        archived = archive.archive_closed_conversations(timedelta(days=30))
+
+        self.assertEqual(archived, 1)
+        self.assertEqual(
+            list(ConversationArchive.objects.values_list("conversation", flat=True)),
+            [self.conversation.id],
+        )
+        self.assertFalse(archive.archive_conversation(open_conversation.id))
+        self.assertFalse(archive.archive_conversation(self.conversation.id))
+
+    def test_archived_conversations_still_reject_messages(self):
+        archive.archive_conversation(self.conversation.id)
+        response = self.client.post(
+            reverse("webhook"),
+            {
+                "type": "NEW_MESSAGE",
+                "timestamp": now().isoformat(),
+                "data": {
+                    "id": "49108c71-4dca-4af3-9f32-61bc745926e2",
+                    "conversation_id": str(self.conversation.id),
+                    "content": "Hello?",
+                },
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(CONVERSATION_ARCHIVE_AFTER_DAYS=30)
+    def test_task(self):
+        self.assertEqual(archive_closed_conversations(), 1)
+        self.assertEqual(archive_closed_conversations(), 0)
+
+    @override_settings(CONVERSATION_ARCHIVE_AFTER_DAYS=0)
+    def test_task_disabled(self):
+        self.assertEqual(archive_closed_conversations(), 0)
+        self.assertEqual(Message.objects.count(), 5)
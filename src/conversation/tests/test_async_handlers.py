@@ -0,0 +1,83 @@
+from django.test import TestCase
+from django.utils.timezone import now
+from unittest.mock import AsyncMock, patch
+import uuid
+
+from conversation import async_handlers
+from conversation.models import Conversation, Message
+
+
+class AsyncHandlersTestCase(TestCase):
+    def setUp(self):
+        self.conversation_id = str(uuid.uuid4())
+        self.message_id = str(uuid.uuid4())
+        self.timestamp = now().isoformat()
+        self.conversation_data = {
+            "data": {"id": self.conversation_id},
+            "timestamp": self.timestamp,
+        }
+        self.message_data = {
+            "data": {
+                "id": self.message_id,
+                "conversation_id": self.conversation_id,
+                "content": "Hello!",
+            },
+            "timestamp": self.timestamp,
+        }
+
+    @patch("conversation.async_handlers._publish", new_callable=AsyncMock)
+    async def test_handle_new_conversation_creates_conversation(self, mock_publish):
+        await async_handlers.handle_new_conversation(self.conversation_data)
+        conv = await Conversation.objects.aget(id=self.conversation_id)
+        self.assertEqual(conv.status, "OPEN")
+        mock_publish.assert_awaited_once_with(
+            async_handlers.process_buffer_for_conversation,
+            self.conversation_id,
+            self.timestamp,
+        )
+
+    async def test_handle_new_conversation_raises_if_exists(self):
+        await Conversation.objects.acreate(id=self.conversation_id, status="OPEN")
+        with self.assertRaises(ValueError):
+            await async_handlers.handle_new_conversation(self.conversation_data)
+
+    @patch("conversation.async_handlers._publish", new_callable=AsyncMock)
+    @patch("conversation.async_handlers.buffer.apush", return_value=None)
+    async def test_handle_new_message_buffers_if_conversation_missing(
+        self, mock_push, mock_publish
+    ):
+        await async_handlers.handle_new_message(self.message_data)
+        mock_push.assert_awaited_once_with(self.message_data)
+        mock_publish.assert_not_awaited()
+
+    async def test_handle_new_message_raises_if_conversation_closed(self):
+        await Conversation.objects.acreate(id=self.conversation_id, status="CLOSED")
+        with self.assertRaises(ValueError):
+            await async_handlers.handle_new_message(self.message_data)
+
+    @patch(
+        "conversation.async_handlers.schedule_message_processing",
+        new_callable=AsyncMock,
+    )
+    async def test_handle_new_message_creates_message(self, mock_schedule):
+        await Conversation.objects.acreate(id=self.conversation_id, status="OPEN")
+        await async_handlers.handle_new_message(self.message_data)
+        msg = await Message.objects.aget(id=self.message_id)
+        self.assertEqual(msg.content, "Hello!")
+        mock_schedule.assert_awaited_once_with(uuid.UUID(self.conversation_id))
+
+        with self.assertRaises(ValueError):
+            await async_handlers.handle_new_message(self.message_data)
+
+    async def test_handle_close_conversation(self):
+        await Conversation.objects.acreate(id=self.conversation_id, status="OPEN")
+        await async_handlers.handle_close_conversation(self.conversation_data)
+        conv = await Conversation.objects.aget(id=self.conversation_id)
+        self.assertEqual(conv.status, "CLOSED")
+
+        with self.assertRaisesMessage(ValueError, "Already closed"):
+            await async_handlers.handle_close_conversation(self.conversation_data)
+
+    async def test_handle_close_conversation_raises_if_not_found(self):
+        with self.assertRaisesMessage(ValueError, "Conversation not found"):
+            await async_handlers.handle_close_conversation(self.conversation_data)
@@ -0,0 +1,97 @@
+import asyncio
+from contextlib import AsyncExitStack
+from unittest.mock import patch
+
+import fakeredis
+import redis.asyncio as redis
+from django.test import SimpleTestCase, override_settings
+from fakeredis.aioredis import FakeConnection
+
+from conversation import events
+from conversation.async_redis import (
+    get_async_pubsub_connection,
+    get_async_redis_connection,
+)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://redis:6379/0",
+        "OPTIONS": {"CONNECTION_POOL_KWARGS": {"max_connections": 3, "timeout": 2}},
+    }
+}
+
+
+@override_settings(CACHES=CACHES)
+class AsyncRedisConnectionTestCase(SimpleTestCase):
+    def test_pool_has_the_bounds_of_the_cache(self):
+        async def get():
+            return get_async_redis_connection("default")
+
+        client = asyncio.run(get())
+        pool = client.connection_pool
+        self.assertEqual(pool.max_connections, 3)
+        self.assertEqual(pool.timeout, 2)
+
+    def test_one_client_per_event_loop(self):
+        async def get_twice():
+            return get_async_redis_connection(), get_async_redis_connection()
+
+        first, second = asyncio.run(get_twice())
+        self.assertIs(first, second)
+        self.assertIsNot(asyncio.run(get_twice())[0], first)
+
+    def test_pubsub_pool_is_not_bounded(self):
+        async def get():
+            return get_async_pubsub_connection(), get_async_redis_connection()
+
+        pubsub_client, client = asyncio.run(get())
+        self.assertIsNot(pubsub_client, client)
+        self.assertNotIsInstance(
+            pubsub_client.connection_pool, redis.BlockingConnectionPool
+        )
+
+    @staticmethod
+    async def receive(subscription):
+        # The subscribe confirmation comes first, and is skipped as None.
+        for _ in range(2):
+            messages = await subscription.get(timeout=1)
+            if messages is not None:
+                return messages
+
+    def test_subscriptions_do_not_starve_the_pool(self):
+        # More open subscriptions than the 3 connections of the cache pool, and
+        # the cache pool still serves the other commands right away.
+        server = fakeredis.FakeServer()
+
+        def fake_from_url(pool_class):
+            def from_url(url, **kwargs):
+                return pool_class(
+                    connection_class=FakeConnection, server=server, **kwargs
+                )
+
+            return from_url
+
+        async def subscribe_past_the_pool():
+            channel = events.CHANNEL.format("a")
+            async with AsyncExitStack() as stack:
+                subscriptions = [
+                    await stack.enter_async_context(events.subscribe("a"))
+                    for _ in range(5)
+                ]
+                client = get_async_redis_connection()
+                await asyncio.wait_for(client.publish(channel, '["hi"]'), timeout=1)
+                return [await self.receive(s) for s in subscriptions]
+
+        with (
+            patch.object(
+                redis.BlockingConnectionPool,
+                "from_url",
+                fake_from_url(redis.BlockingConnectionPool),
+            ),
+            patch.object(
+                redis.ConnectionPool, "from_url", fake_from_url(redis.ConnectionPool)
+            ),
+        ):
+            received = asyncio.run(subscribe_past_the_pool())
+        self.assertEqual(received, [["hi"]] * 5)
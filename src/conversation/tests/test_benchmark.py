@@ -0,0 +1,110 @@
+from django.test import SimpleTestCase
+from django.utils.dateparse import parse_datetime
+
+from conversation.benchmark import (
+    build_events,
+    compare,
+    connection_modes,
+    percentile,
+    summarize,
+)
+from conversation.constants import BUFFER_TIMEOUT
+from conversation.serializers import WebhookBaseSerializer
+
+
+class BuildEventsTestCase(SimpleTestCase):
+    def test_is_reproducible(self):
+        first = build_events("mixed", 6, 3, seed=1)
+        second = build_events("mixed", 6, 3, seed=1)
+        self.assertEqual(
+            [event["data"] for event in first], [event["data"] for event in second]
+        )
+        self.assertNotEqual(first, build_events("mixed", 6, 3, seed=2))
+
+    def test_events_are_valid(self):
+        for event in build_events("mixed", 6, 3):
+            self.assertTrue(WebhookBaseSerializer(data=event).is_valid())
+
+    def test_burst(self):
+        events = build_events("burst", 2, 3)
+        self.assertEqual(len(events), 8)
+        self.assertEqual(
+            [event["type"] for event in events[:2]], ["NEW_CONVERSATION"] * 2
+        )
+
+    def test_out_of_order(self):
+        events = build_events("out_of_order", 2, 3)
+        conversations = [e for e in events if e["type"] == "NEW_CONVERSATION"]
+        self.assertEqual(events[-2:], conversations)
+
+        for conversation, late in zip(conversations, [False, True]):
+            messages = [
+                parse_datetime(e["timestamp"])
+                for e in events
+                if e["data"].get("conversation_id") == conversation["data"]["id"]
+            ]
+            delays = [
+                (parse_datetime(conversation["timestamp"]) - ts).total_seconds()
+                for ts in messages
+            ]
+            self.assertEqual(min(delays) > BUFFER_TIMEOUT, late)
+            self.assertEqual(max(delays) <= BUFFER_TIMEOUT, not late)
+
+    def test_close(self):
+        events = build_events("close", 1, 2)
+        self.assertEqual(
+            [event["type"] for event in events],
+            [
+                "NEW_CONVERSATION",
+                "NEW_MESSAGE",
+                "NEW_MESSAGE",
+                "CLOSE_CONVERSATION",
+                "NEW_MESSAGE",
+            ],
+        )
+
+    def test_unknown_scenario(self):
+        with self.assertRaises(ValueError):
+            build_events("unknown", 1, 1)
+
+
+class StatisticsTestCase(SimpleTestCase):
+    def test_percentile(self):
+        values = [4, 1, 3, 2, 5]
+        self.assertEqual(percentile(values, 0.5), 3)
+        self.assertEqual(percentile(values, 0.95), 4.8)
+        self.assertEqual(percentile(values, 1), 5)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_summarize(self):
+        self.assertEqual(summarize([0.001, 0.003])["mean"], 2)
+        self.assertIsNone(summarize([])["p99"])
+
+    def test_compare(self):
+        baseline = {"metrics": {"latency_ms": {"p50": 2.0}, "drained": True}}
+        current = {"metrics": {"latency_ms": {"p50": 3.0}, "events": 10}}
+        self.assertEqual(
+            compare(baseline, current),
+            [("events", None, 10, None), ("latency_ms.p50", 2.0, 3.0, 0.5)],
+        )
+
+
+class ConnectionModesTestCase(SimpleTestCase):
+    def test_modes(self):
+        database = {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": "realmate",
+            "CONN_MAX_AGE": 0,
+            "OPTIONS": {"pool": {"max_size": 2}, "sslmode": "prefer"},
+        }
+        modes = connection_modes(database, pool_size=8)
+
+        self.assertEqual(modes["off"]["CONN_MAX_AGE"], 0)
+        self.assertEqual(modes["off"]["OPTIONS"], {"sslmode": "prefer"})
+        self.assertIsNone(modes["persistent"]["CONN_MAX_AGE"])
+        self.assertEqual(modes["pool"]["CONN_MAX_AGE"], 0)
+        self.assertEqual(
+            modes["pool"]["OPTIONS"],
+            {"sslmode": "prefer", "pool": {"min_size": 8, "max_size": 8}},
+        )
+        self.assertEqual(database["OPTIONS"]["pool"], {"max_size": 2})
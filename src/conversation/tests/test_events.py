@@ -0,0 +1,109 @@
+from asgiref.sync import sync_to_async
+from contextlib import aclosing
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now, timedelta
+from unittest.mock import patch
+import asyncio
+import fakeredis
+import json
+
+from conversation import events
+from conversation.models import Conversation, Message
+from conversation.pagination import encode_position
+from conversation.serializers import MessageSerializer
+from conversation.views import ConversationEventsView
+
+
+@override_settings(MESSAGE_EVENTS_ENABLED=True)
+class ConversationEventsTestCase(TestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        async_redis = fakeredis.FakeAsyncRedis(server=server)
+        for target, client in [
+            ("get_redis_connection", self.redis),
+            ("get_async_redis_connection", async_redis),
+            ("get_async_pubsub_connection", async_redis),
+        ]:
+            patcher = patch(f"conversation.events.{target}", return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.conversation = Conversation.objects.create(status="OPEN")
+        base = now()
+        self.messages = [
+            Message.objects.create(
+                conversation=self.conversation,
+                type="INBOUND",
+                content=f"Message {i}",
+                timestamp=base + timedelta(seconds=i),
+            )
+            for i in range(3)
+        ]
+        self.url = reverse("conversation-events", args=[self.conversation.id])
+
+    async def next_event(self, stream) -> dict:
+        while True:
+            chunk = await asyncio.wait_for(anext(stream), timeout=5)
+            if chunk.startswith("id: "):
+                fields = dict(
+                    line.split(": ", 1) for line in chunk.strip().splitlines()
+                )
+                return {"id": fields["id"], "data": json.loads(fields["data"])}
+
+    def test_publish_messages(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(events.CHANNEL.format(self.conversation.id))
+        messages = MessageSerializer(self.messages[:1], many=True).data
+        events.publish_messages(self.conversation.id, messages)
+
+        pubsub.get_message(timeout=1)  # subscribe confirmation
+        message = pubsub.get_message(timeout=1)
+        self.assertEqual(json.loads(message["data"])[0]["id"], str(self.messages[0].id))
+
+    async def test_view(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    async def test_streams_published_messages(self):
+        stream = ConversationEventsView().stream(self.conversation.id, None)
+        async with aclosing(stream):
+            self.assertTrue((await anext(stream)).startswith("retry: "))
+
+            message = await sync_to_async(
+                lambda: MessageSerializer(self.messages[1]).data
+            )()
+            await events.apublish_messages(self.conversation.id, [message])
+
+            event = await self.next_event(stream)
+            self.assertEqual(event["data"], message)
+            self.assertEqual(
+                event["id"],
+                encode_position(self.messages[1].timestamp, self.messages[1].id),
+            )
+
+    async def test_replays_missed_messages(self):
+        position = (self.messages[0].timestamp, self.messages[0].id)
+        stream = ConversationEventsView().stream(self.conversation.id, position)
+        async with aclosing(stream):
+            first = await self.next_event(stream)
+            second = await self.next_event(stream)
+        self.assertEqual(
+            [first["data"]["id"], second["data"]["id"]],
+            [str(self.messages[1].id), str(self.messages[2].id)],
+        )
+
+    async def test_unknown_conversation(self):
+        response = await self.async_client.get(
+            reverse(
+                "conversation-events", args=["6a41b347-8d80-4ce9-84ba-7af66f369f6a"]
+            )
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_asgi(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 501)
@@ -0,0 +1,113 @@
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.timezone import now, timedelta
+from io import StringIO
+import csv
+import json
+
+from conversation import archive
+from conversation.export import EXPORT_FIELDS, export_rows, stream_export
+from conversation.models import Conversation, Message
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        base = now()
+        self.open = Conversation.objects.create(status="OPEN")
+        self.closed = Conversation.objects.create(status="CLOSED")
+        self.empty = Conversation.objects.create(status="OPEN")
+        self.messages = [
+            Message.objects.create(
+                conversation=self.open,
+                type="INBOUND",
+                content=f"Message {i}, with a comma",
+                timestamp=base + timedelta(seconds=i),
+            )
+            for i in range(3)
+        ]
+        Message.objects.create(
+            conversation=self.closed,
+            type="OUTBOUND",
+            content="Bye",
+            timestamp=base,
+        )
+        self.url = reverse("conversation-export")
+
+    def test_export_rows(self):
+        rows = list(export_rows(chunk_size=2))
+        self.assertEqual(len(rows), 5)
+        by_conversation = [row for row in rows if row[0] == str(self.open.id)]
+        self.assertEqual(
+            [row[4] for row in by_conversation], [str(m.id) for m in self.messages]
+        )
+        empty = next(row for row in rows if row[0] == str(self.empty.id))
+        self.assertEqual(empty[4:], [None, None, None, None])
+
+    def test_archived_conversations_are_exported_from_their_archive(self):
+        before = list(export_rows(status="CLOSED"))
+        self.assertTrue(archive.archive_conversation(self.closed.id))
+        self.assertFalse(Message.objects.filter(conversation=self.closed).exists())
+
+        self.assertEqual(list(export_rows(status="CLOSED")), before)
+        self.assertEqual(before[0][5:7], ["OUTBOUND", "Bye"])
+        self.assertEqual(len(list(export_rows(chunk_size=2))), 5)
+
+    def test_rows_are_read_in_a_transaction(self):
+        # Server-side cursors only survive transaction-level pooling inside a
+        # transaction, and are not materialized at commit there.
+        depth = len(connection.savepoint_ids)
+        rows = export_rows(chunk_size=2)
+        next(rows)
+        self.assertEqual(len(connection.savepoint_ids), depth + 1)
+        list(rows)
+        self.assertEqual(len(connection.savepoint_ids), depth)
+
+    def test_filters(self):
+        rows = list(export_rows(status="CLOSED"))
+        self.assertEqual([row[0] for row in rows], [str(self.closed.id)])
+        self.assertEqual(list(export_rows(since=now() + timedelta(hours=1))), [])
+        self.assertEqual(len(list(export_rows(until=now() + timedelta(hours=1)))), 5)
+
+    def test_stream_export_chunks(self):
+        rows = [["a"] * len(EXPORT_FIELDS)] * 5
+        chunks = list(stream_export("ndjson", iter(rows), chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len("".join(chunks).splitlines()), 5)
+
+    def test_ndjson_view(self):
+        response = self.client.get(self.url, {"status": "OPEN"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0]["content"], "Message 0, with a comma")
+        self.assertEqual(set(records[0]), set(EXPORT_FIELDS))
+
+    def test_csv_view(self):
+        response = self.client.get(self.url, {"format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("conversations.csv", response["Content-Disposition"])
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), 5)
+        self.assertIn("Message 1, with a comma", [row["content"] for row in rows])
+
+    def test_invalid_query(self):
+        response = self.client.get(self.url, {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("format", response.json())
+
+        response = self.client.get(
+            self.url, {"since": "2025-01-02T00:00:00Z", "until": "2025-01-01T00:00:00Z"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command("export_conversations", "--status", "CLOSED", stdout=stdout)
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["content"], "Bye")
@@ -0,0 +1,83 @@
+from django.test import SimpleTestCase
+from django.utils.timezone import now
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+import io
+import uuid
+
+from conversation.parsers import FastJSONParser
+from conversation.renderers import FastJSONRenderer
+from conversation.serializers import WebhookBaseSerializer, validate_webhook_event
+
+
+class ValidateWebhookEventTestCase(SimpleTestCase):
+    def test_matches_serializer_data(self):
+        events = [
+            {
+                "type": "NEW_CONVERSATION",
+                "timestamp": "2025-02-21T10:20:41.349308",
+                "data": {"id": str(uuid.uuid4())},
+            },
+            {
+                "type": "NEW_MESSAGE",
+                "timestamp": "2025-02-21T10:20:42Z",
+                "data": {
+                    "id": str(uuid.uuid4()),
+                    "content": "Olá",
+                    "conversation_id": str(uuid.uuid4()),
+                    "direction": "RECEIVED",
+                },
+            },
+            {
+                "type": "CLOSE_CONVERSATION",
+                "timestamp": "2025-02-21T13:20:45.000+03:00",
+                "data": {"id": str(uuid.uuid4())},
+            },
+        ]
+        for event in events:
+            serializer = WebhookBaseSerializer(data=event)
+            self.assertTrue(serializer.is_valid())
+            self.assertEqual(validate_webhook_event(event), serializer.data)
+
+    def test_invalid_events_fall_back(self):
+        events = [
+            [],
+            {"type": "UNKNOWN", "timestamp": "2025-02-21T10:20:41", "data": {}},
+            {"type": "NEW_CONVERSATION", "timestamp": "2025-02-21T10:20:41"},
+            {"type": "NEW_CONVERSATION", "timestamp": "yesterday", "data": {"id": 1}},
+            {
+                "type": "NEW_MESSAGE",
+                "timestamp": "2025-02-21T10:20:41",
+                "data": {"id": str(uuid.uuid4()), "content": "Olá"},
+            },
+        ]
+        for event in events:
+            self.assertIsNone(validate_webhook_event(event))
+            self.assertFalse(WebhookBaseSerializer(data=event).is_valid())
+
+
+class FastJSONTestCase(SimpleTestCase):
+    def test_parser_matches_json_parser(self):
+        body = '{"type": "NEW_MESSAGE", "data": {"content": "Olá"}}'.encode()
+        self.assertEqual(
+            FastJSONParser().parse(io.BytesIO(body)),
+            JSONParser().parse(io.BytesIO(body)),
+        )
+
+    def test_parser_errors_match_json_parser(self):
+        for body in [b'{"type": ', b'{"value": NaN}']:
+            with self.assertRaises(ParseError) as expected:
+                JSONParser().parse(io.BytesIO(body))
+            with self.assertRaises(ParseError) as raised:
+                FastJSONParser().parse(io.BytesIO(body))
+            self.assertEqual(str(raised.exception), str(expected.exception))
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            "id": uuid.uuid4(),
+            "timestamp": now(),
+            "content": "Olá mundo",
+            "messages": [{"count": 1, "ratio": 0.5, "ok": True, "none": None}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
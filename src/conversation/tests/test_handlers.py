@@ -1,10 +1,13 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 from unittest.mock import patch
 import uuid
 
 from conversation.models import Conversation, Message
 from conversation.handlers import (
+    handle_batch,
     handle_new_conversation,
     handle_new_message,
     handle_close_conversation,
@@ -90,3 +93,193 @@ class HandlersTestCase(TestCase):
     def test_handle_close_conversation_raises_if_not_found(self):
         with self.assertRaises(ValueError):
             handle_close_conversation(self.conversation_data)
+
+
+@patch("conversation.handlers.schedule_message_processing")
+@patch("conversation.handlers.buffer_message_until_conversation_exists.delay")
+@patch("conversation.handlers.process_buffer_for_conversation.delay")
+class HandlerStatementsTestCase(TestCase):
+    """
+    Pins the statements each handler sends to the database. The savepoints of the
+    handlers' atomic blocks (nested in the test transaction) are not counted.
+    """
+
+    def setUp(self):
+        self.conversation_id = uuid.uuid4()
+        self.timestamp = now().isoformat()
+
+    def assertStatements(self, count, handler, payload, error=None):
+        with CaptureQueriesContext(connection) as context:
+            if error is None:
+                handler(payload)
+            else:
+                with self.assertRaisesMessage(ValueError, error):
+                    handler(payload)
+        statements = [
+            query["sql"]
+            for query in context.captured_queries
+            if "SAVEPOINT" not in query["sql"]
+        ]
+        self.assertEqual(len(statements), count, statements)
+
+    def conversation_event(self):
+        return {"data": {"id": self.conversation_id}, "timestamp": self.timestamp}
+
+    def message_event(self, message_id=None):
+        return {
+            "data": {
+                "id": message_id or uuid.uuid4(),
+                "conversation_id": self.conversation_id,
+                "content": "Hello!",
+            },
+            "timestamp": self.timestamp,
+        }
+
+    def test_new_conversation(self, *mocks):
+        self.assertStatements(1, handle_new_conversation, self.conversation_event())
+        self.assertStatements(
+            1,
+            handle_new_conversation,
+            self.conversation_event(),
+            "Conversation already exists",
+        )
+
+    def test_new_message(self, *mocks):
+        Conversation.objects.create(id=self.conversation_id, status="OPEN")
+        payload = self.message_event()
+        self.assertStatements(1, handle_new_message, payload)
+        self.assertStatements(
+            2, handle_new_message, payload, "Message ID already exists"
+        )
+        self.assertEqual(Message.objects.get().content, "Hello!")
+
+    def test_new_message_refused(self, mock_process_buffer, mock_buffer, mock_schedule):
+        payload = self.message_event()
+        self.assertStatements(2, handle_new_message, payload)
+        mock_buffer.assert_called_once_with(payload)
+
+        Conversation.objects.create(id=self.conversation_id, status="CLOSED")
+        self.assertStatements(
+            2, handle_new_message, self.message_event(), "Conversation is closed"
+        )
+        self.assertFalse(Message.objects.exists())
+
+    def test_close_conversation(self, *mocks):
+        self.assertStatements(
+            2,
+            handle_close_conversation,
+            self.conversation_event(),
+            "Conversation not found",
+        )
+        Conversation.objects.create(id=self.conversation_id, status="OPEN")
+        self.assertStatements(1, handle_close_conversation, self.conversation_event())
+        self.assertStatements(
+            2, handle_close_conversation, self.conversation_event(), "Already closed"
+        )
+
+
+@patch("conversation.handlers.schedule_message_processing")
+@patch("conversation.handlers.buffer_message_until_conversation_exists.delay")
+@patch("conversation.handlers.process_buffer_for_conversation.delay")
+class HandleBatchTestCase(TestCase):
+    def setUp(self):
+        self.conversation_id = str(uuid.uuid4())
+        self.timestamp = "2025-06-04T14:20:00Z"
+
+    def conversation_event(self, event_type, timestamp=None):
+        return {
+            "type": event_type,
+            "timestamp": timestamp or self.timestamp,
+            "data": {"id": self.conversation_id},
+        }
+
+    def message_event(self, message_id=None, timestamp=None):
+        return {
+            "type": "NEW_MESSAGE",
+            "timestamp": timestamp or self.timestamp,
+            "data": {
+                "id": message_id or str(uuid.uuid4()),
+                "conversation_id": self.conversation_id,
+                "content": "Hello!",
+            },
+        }
+
+    def test_applies_mixed_events_in_order(
+        self, mock_process_buffer, mock_buffer, mock_schedule
+    ):
+        results = handle_batch(
+            [
+                self.conversation_event("NEW_CONVERSATION"),
+                self.message_event(),
+                self.message_event(),
+                self.conversation_event("CLOSE_CONVERSATION"),
+                self.message_event(),
+            ]
+        )
+        self.assertEqual(results, [None, None, None, None, "Conversation is closed"])
+        conv = Conversation.objects.get(id=self.conversation_id)
+        self.assertEqual(conv.status, "CLOSED")
+        self.assertEqual(conv.messages.count(), 2)
+        mock_process_buffer.assert_called_once_with(
+            self.conversation_id, self.timestamp
+        )
+        mock_schedule.assert_called_once_with(conv.id)
+        mock_buffer.assert_not_called()
+
+    def test_reports_duplicates_and_missing_conversations(
+        self, mock_process_buffer, mock_buffer, mock_schedule
+    ):
+        conv = Conversation.objects.create(id=self.conversation_id, status="OPEN")
+        message_id = str(uuid.uuid4())
+        Message.objects.create(
+            id=message_id,
+            conversation=conv,
+            type="INBOUND",
+            content="Hi",
+            timestamp=now(),
+        )
+        results = handle_batch(
+            [
+                self.conversation_event("NEW_CONVERSATION"),
+                self.message_event(message_id=message_id),
+                self.message_event(message_id=message_id.replace("-", "")),
+            ]
+        )
+        self.assertEqual(
+            results,
+            [
+                "Conversation already exists",
+                "Message ID already exists",
+                "Message ID already exists",
+            ],
+        )
+        self.assertEqual(Message.objects.count(), 1)
+        mock_schedule.assert_not_called()
+
+    def test_recovers_out_of_order_messages_within_tolerance(
+        self, mock_process_buffer, mock_buffer, mock_schedule
+    ):
+        early = self.message_event(timestamp="2025-06-04T14:19:50Z")
+        recent = self.message_event(timestamp="2025-06-04T14:19:57Z")
+        results = handle_batch(
+            [early, recent, self.conversation_event("NEW_CONVERSATION")]
+        )
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(
+            list(Message.objects.values_list("id", flat=True)),
+            [uuid.UUID(recent["data"]["id"])],
+        )
+        mock_buffer.assert_not_called()
+
+    def test_buffers_messages_for_unknown_conversations(
+        self, mock_process_buffer, mock_buffer, mock_schedule
+    ):
+        payload = self.message_event()
+        results = handle_batch([payload, self.conversation_event("CLOSE_CONVERSATION")])
+        self.assertEqual(results, [None, "Conversation not found"])
+        mock_buffer.assert_called_once_with(payload)
+        self.assertFalse(Message.objects.exists())
+
+    def test_rejects_invalid_ids(self, mock_process_buffer, mock_buffer, mock_schedule):
+        payload = self.message_event(message_id="not-a-uuid")
+        self.assertEqual(handle_batch([payload]), ["Invalid ID"])
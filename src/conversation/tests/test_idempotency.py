@@ -0,0 +1,85 @@
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from redis.exceptions import ConnectionError
+from unittest.mock import patch
+import fakeredis
+import time
+import uuid
+
+from conversation import idempotency
+from conversation.constants import IDEMPOTENCY_BUCKET, IDEMPOTENCY_TTL
+from conversation.models import Conversation, Message
+from conversation.repository import Repository
+
+
+@override_settings(IDEMPOTENCY_ENABLED=True)
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        for target, client in [
+            ("get_redis_connection", self.redis),
+            ("get_async_redis_connection", fakeredis.FakeAsyncRedis(server=server)),
+        ]:
+            patcher = patch(f"conversation.idempotency.{target}", return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.conversation = Conversation.objects.create(status="OPEN")
+        self.payload = {
+            "type": "NEW_MESSAGE",
+            "timestamp": now().isoformat(),
+            "data": {
+                "id": str(uuid.uuid4()),
+                "conversation_id": str(self.conversation.id),
+                "content": "Hello!",
+            },
+        }
+
+    @patch("conversation.handlers.schedule_message_processing")
+    def test_retry_is_answered_without_the_database(self, mock_schedule):
+        self.assertEqual(Repository.handle_hook(self.payload).status_code, 202)
+
+        with self.assertNumQueries(0):
+            response = Repository.handle_hook(self.payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_failed_events_are_not_recorded(self):
+        Conversation.objects.filter(id=self.conversation.id).update(status="CLOSED")
+
+        self.assertEqual(Repository.handle_hook(self.payload).status_code, 400)
+        self.assertFalse(idempotency.seen(self.payload))
+
+    def test_events_are_told_apart_by_type(self):
+        conversation_event = {
+            "type": "NEW_CONVERSATION",
+            "timestamp": now().isoformat(),
+            "data": {"id": str(self.conversation.id)},
+        }
+        idempotency.record(conversation_event)
+
+        self.assertTrue(idempotency.seen(conversation_event))
+        self.assertFalse(
+            idempotency.seen({**conversation_event, "type": "CLOSE_CONVERSATION"})
+        )
+
+    def test_events_expire(self):
+        idempotency.record(self.payload)
+        self.assertTrue(idempotency.seen(self.payload))
+
+        later = time.time() + IDEMPOTENCY_TTL + IDEMPOTENCY_BUCKET
+        with patch("conversation.idempotency.time.time", return_value=later):
+            self.assertFalse(idempotency.seen(self.payload))
+
+    def test_redis_errors_let_events_through(self):
+        with patch.object(self.redis, "pipeline") as mock_pipeline:
+            mock_pipeline.return_value.execute.side_effect = ConnectionError()
+            with self.assertLogs("conversation.idempotency", "WARNING"):
+                self.assertFalse(idempotency.seen(self.payload))
+
+    async def test_async_version(self):
+        self.assertFalse(await idempotency.aseen(self.payload))
+        await idempotency.arecord(self.payload)
+        self.assertTrue(await idempotency.aseen(self.payload))
+        self.assertTrue(idempotency.seen(self.payload))
@@ -0,0 +1,183 @@
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from unittest.mock import patch
+import fakeredis
+import uuid
+
+from conversation import ingest
+from conversation.constants import INGEST_GROUP
+from conversation.handlers import handle_close_conversation
+from conversation.models import Conversation, Message
+from conversation.sharding import shard_for
+
+SHARDS = 2
+
+
+@override_settings(INGEST_ENABLED=True, INGEST_STREAM_SHARDS=SHARDS)
+class IngestTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = patch(
+            "conversation.ingest.get_redis_connection", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conversation_id = str(uuid.uuid4())
+        self.timestamp = "2025-06-04T14:20:00Z"
+
+    def conversation_event(self, event_type):
+        return {
+            "type": event_type,
+            "timestamp": self.timestamp,
+            "data": {"id": self.conversation_id},
+        }
+
+    def message_event(self, message_id=None):
+        return {
+            "type": "NEW_MESSAGE",
+            "timestamp": self.timestamp,
+            "data": {
+                "id": message_id or str(uuid.uuid4()),
+                "conversation_id": self.conversation_id,
+                "content": "Hello!",
+            },
+        }
+
+    def stream(self) -> str:
+        return ingest.STREAM_KEY.format(shard_for(self.conversation_id, SHARDS))
+
+
+class AppendTestCase(IngestTestCase):
+    def test_applies_the_handler_rules(self):
+        message_id = str(uuid.uuid4())
+        results = [
+            ingest.append(event)
+            for event in (
+                self.conversation_event("CLOSE_CONVERSATION"),
+                self.message_event(),
+                self.conversation_event("NEW_CONVERSATION"),
+                self.conversation_event("NEW_CONVERSATION"),
+                self.message_event(message_id),
+                self.message_event(message_id),
+                self.conversation_event("CLOSE_CONVERSATION"),
+                self.conversation_event("CLOSE_CONVERSATION"),
+                self.message_event(),
+            )
+        ]
+
+        self.assertEqual(
+            results,
+            [
+                "Conversation not found",
+                None,
+                None,
+                "Conversation already exists",
+                None,
+                "Message ID already exists",
+                None,
+                "Already closed",
+                "Conversation is closed",
+            ],
+        )
+        self.assertEqual(self.redis.xlen(self.stream()), 4)
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_reads_unknown_conversations_from_the_database_once(self):
+        Conversation.objects.create(id=self.conversation_id, status="CLOSED")
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                ingest.append(self.message_event()), "Conversation is closed"
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ingest.append(self.conversation_event("NEW_CONVERSATION")),
+                "Conversation already exists",
+            )
+
+    def test_rejects_invalid_ids(self):
+        event = self.conversation_event("NEW_CONVERSATION")
+        event["data"]["id"] = "not-a-uuid"
+        with self.assertRaises(ValueError):
+            ingest.append(event)
+
+    def test_direct_close_updates_the_state(self):
+        ingest.append(self.conversation_event("NEW_CONVERSATION"))
+        Conversation.objects.create(id=self.conversation_id, status="OPEN")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_close_conversation(self.conversation_event("CLOSE_CONVERSATION"))
+
+        self.assertEqual(ingest.append(self.message_event()), "Conversation is closed")
+
+    def test_webhook_answers_without_writing_to_the_database(self):
+        url = reverse("webhook")
+        response = self.client.post(
+            url, self.conversation_event("NEW_CONVERSATION"), "application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(url, self.message_event(), "application/json")
+        self.assertEqual(response.status_code, 202)
+        response = self.client.post(
+            url, self.conversation_event("NEW_CONVERSATION"), "application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.assertFalse(Conversation.objects.exists())
+        self.assertEqual(self.redis.xlen(self.stream()), 2)
+
+
+@patch("conversation.handlers.schedule_message_processing")
+@patch("conversation.handlers.buffer_message_until_conversation_exists.delay")
+@patch("conversation.handlers.process_buffer_for_conversation.delay")
+class IngestWorkerTestCase(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.worker = ingest.IngestWorker("worker-1", block_ms=10)
+        self.worker.setup()
+
+    def test_applies_and_acknowledges_events(self, *mocks):
+        for event in (
+            self.conversation_event("NEW_CONVERSATION"),
+            self.message_event(),
+            self.message_event(),
+        ):
+            ingest.append(event)
+
+        self.assertEqual(self.worker.run_once(), 3)
+
+        self.assertEqual(
+            Conversation.objects.get(id=self.conversation_id).status, "OPEN"
+        )
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(self.redis.xlen(self.stream()), 0)
+        self.assertEqual(self.worker.run_once(), 0)
+
+    def test_failed_batch_is_applied_again(self, *mocks):
+        ingest.append(self.conversation_event("NEW_CONVERSATION"))
+
+        with patch(
+            "conversation.handlers.handle_batch", side_effect=DatabaseError("down")
+        ):
+            with self.assertRaises(DatabaseError):
+                self.worker.run_once()
+        self.assertFalse(Conversation.objects.exists())
+
+        self.assertEqual(self.worker.run_once(), 1)
+        self.assertTrue(Conversation.objects.filter(id=self.conversation_id).exists())
+
+    def test_new_owner_claims_pending_events(self, *mocks):
+        ingest.append(self.conversation_event("NEW_CONVERSATION"))
+        ingest.append(self.message_event())
+        # The first worker reads the events and dies before applying them.
+        self.worker.acquire()
+        self.redis.xreadgroup(INGEST_GROUP, "worker-1", {self.stream(): ">"}, count=10)
+        self.redis.delete(*[ingest.LEASE_KEY.format(shard) for shard in range(SHARDS)])
+
+        other = ingest.IngestWorker("worker-2", block_ms=10)
+        self.assertEqual(other.run_once(), 2)
+        self.assertEqual(Message.objects.count(), 1)
+        with self.assertLogs("conversation.ingest", "WARNING"):
+            self.assertEqual(self.worker.run_once(), 0)
+        self.assertFalse(self.worker.owned)
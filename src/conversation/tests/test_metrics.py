@@ -0,0 +1,129 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now, timedelta
+from redis.exceptions import ConnectionError
+from unittest.mock import patch
+import fakeredis
+import time
+import uuid
+
+from conversation import metrics
+from conversation.constants import BUFFER_TIMEOUT, DEBOUNCE_KEY, DEBOUNCE_STALE_AFTER
+from conversation.tasks import process_buffer_for_conversation
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for module in ("metrics", "debounce"):
+            patcher = patch(
+                f"conversation.{module}.get_redis_connection", return_value=self.redis
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_counter(self):
+        metrics.increment("conversation_buffer_messages_total", outcome="buffered")
+        metrics.increment("conversation_buffer_messages_total", 2, outcome="buffered")
+        metrics.increment("conversation_outbound_messages_total")
+
+        rendered = metrics.render()
+        self.assertIn(
+            'conversation_buffer_messages_total{outcome="buffered"} 3.0', rendered
+        )
+        self.assertIn("conversation_outbound_messages_total 1.0", rendered)
+        self.assertIn("# TYPE conversation_outbound_messages_total counter", rendered)
+
+    def test_histogram_buckets_are_cumulative(self):
+        for value in (0.003, 0.2, 20):
+            metrics.observe(
+                "conversation_event_duration_seconds", value, type="NEW_MESSAGE"
+            )
+
+        lines = metrics.render().splitlines()
+        name = "conversation_event_duration_seconds"
+        labels = 'type="NEW_MESSAGE"'
+        self.assertIn(f'{name}_bucket{{{labels},le="0.005"}} 1.0', lines)
+        self.assertIn(f'{name}_bucket{{{labels},le="0.1"}} 1.0', lines)
+        self.assertIn(f'{name}_bucket{{{labels},le="0.25"}} 2.0', lines)
+        self.assertIn(f'{name}_bucket{{{labels},le="10"}} 2.0', lines)
+        self.assertIn(f'{name}_bucket{{{labels},le="+Inf"}} 3.0', lines)
+        self.assertIn(f"{name}_count{{{labels}}} 3.0", lines)
+        self.assertIn(f"{name}_sum{{{labels}}} 20.203", lines)
+
+    def test_observe_many_matches_single_observations(self):
+        name = "conversation_processing_delay_seconds"
+        metrics.observe_many(name, [0.05, 0.2, 400], stage="batch")
+        for value in (0.05, 0.2, 400):
+            metrics.observe(name, value, stage="single")
+
+        lines = metrics.render().splitlines()
+        for labels in ('stage="batch"', 'stage="single"'):
+            self.assertIn(f'{name}_bucket{{{labels},le="0.1"}} 1.0', lines)
+            self.assertIn(f'{name}_bucket{{{labels},le="0.25"}} 2.0', lines)
+            self.assertIn(f'{name}_bucket{{{labels},le="+Inf"}} 3.0', lines)
+            self.assertIn(f"{name}_count{{{labels}}} 3.0", lines)
+
+    def test_processing_lag_gauge(self):
+        self.assertIn("conversation_processing_lag_seconds 0", metrics.render())
+
+        self.redis.zadd(DEBOUNCE_KEY, {str(uuid.uuid4()): time.time() - 3})
+        self.redis.zadd(DEBOUNCE_KEY, {str(uuid.uuid4()): time.time() + 5})
+        line = next(
+            line
+            for line in metrics.render().splitlines()
+            if line.startswith("conversation_processing_lag_seconds ")
+        )
+        self.assertAlmostEqual(float(line.split()[1]), 3, delta=1)
+
+    def test_processing_lag_gauge_leaves_lost_jobs_out(self):
+        # Nothing claims the deadline of a lost job until its conversation gets a
+        # new message: the gauge does not grow with it.
+        self.redis.zadd(
+            DEBOUNCE_KEY, {str(uuid.uuid4()): time.time() - DEBOUNCE_STALE_AFTER - 60}
+        )
+        self.assertIn("conversation_processing_lag_seconds 0", metrics.render())
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        metrics.increment("conversation_outbound_messages_total")
+        self.assertFalse(self.redis.exists(metrics.COUNTERS_KEY))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 404)
+
+    def test_redis_errors_are_ignored(self):
+        with patch.object(self.redis, "pipeline") as mock_pipeline:
+            mock_pipeline.return_value.execute.side_effect = ConnectionError()
+            with self.assertLogs("conversation.metrics", "WARNING"):
+                metrics.observe("conversation_processing_delay_seconds", 1)
+
+    def test_view(self):
+        metrics.increment("conversation_outbound_messages_total")
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"conversation_outbound_messages_total 1.0", response.content)
+
+    @patch("conversation.handlers.handle_new_message")
+    @patch("conversation.tasks.buffer.drain")
+    def test_buffer_outcomes(self, mock_drain, mock_handle):
+        timestamp = now()
+        mock_drain.return_value = [
+            {"timestamp": (timestamp - timedelta(seconds=1)).isoformat()},
+            {"timestamp": (timestamp - timedelta(seconds=1)).isoformat()},
+            {
+                "timestamp": (
+                    timestamp - timedelta(seconds=BUFFER_TIMEOUT + 1)
+                ).isoformat()
+            },
+        ]
+        mock_handle.side_effect = [None, ValueError("Message ID already exists")]
+
+        process_buffer_for_conversation(str(uuid.uuid4()), timestamp.isoformat())
+        rendered = metrics.render()
+        for outcome in ("recovered", "failed", "expired"):
+            self.assertIn(
+                f'conversation_buffer_messages_total{{outcome="{outcome}"}} 1.0',
+                rendered,
+            )
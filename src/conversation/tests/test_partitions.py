@@ -0,0 +1,141 @@
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils.timezone import now
+from unittest import skipUnless
+import datetime
+import uuid
+
+from conversation import partitions
+from conversation.handlers import handle_batch
+from conversation.models import Conversation, Message
+from conversation.tasks import maintain_message_partitions
+
+
+class PlanTestCase(SimpleTestCase):
+    def test_add_months(self):
+        month = datetime.date(2025, 11, 1)
+        self.assertEqual(partitions.add_months(month, 2), datetime.date(2026, 1, 1))
+        self.assertEqual(partitions.add_months(month, -11), datetime.date(2024, 12, 1))
+
+    def test_creates_the_missing_months_ahead(self):
+        existing = [datetime.date(2025, 6, 1), datetime.date(2025, 7, 1)]
+        to_create, to_expire = partitions.plan(
+            existing, datetime.date(2025, 6, 18), ahead=2, retention=0
+        )
+        self.assertEqual(to_create, [datetime.date(2025, 8, 1)])
+        self.assertEqual(to_expire, [])
+
+    def test_expires_the_months_past_the_retention(self):
+        existing = [datetime.date(2025, month, 1) for month in range(1, 7)]
+        _, to_expire = partitions.plan(
+            existing, datetime.date(2025, 6, 18), ahead=0, retention=3
+        )
+        self.assertEqual(
+            to_expire,
+            [
+                datetime.date(2025, 1, 1),
+                datetime.date(2025, 2, 1),
+                datetime.date(2025, 3, 1),
+            ],
+        )
+
+
+class MaintainTestCase(TestCase):
+    @skipUnless(connection.vendor != "postgresql", "Tests the unpartitioned table.")
+    def test_does_nothing_without_partitions(self):
+        self.assertEqual(maintain_message_partitions(), {"created": [], "expired": []})
+
+    @skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL.")
+    def test_creates_and_expires_partitions(self):
+        self.assertTrue(partitions.is_partitioned())
+        conversation = Conversation.objects.create(status="OPEN")
+        future = partitions.add_months(partitions.month_start(now().date()), 12)
+        Message.objects.create(
+            conversation=conversation,
+            type="INBOUND",
+            content="Hello!",
+            timestamp=datetime.datetime.combine(
+                future, datetime.time(12), datetime.timezone.utc
+            ),
+        )
+
+        result = partitions.maintain(ahead=12, retention=1, drop=True)
+
+        self.assertIn(partitions.PARTITION_NAME.format(future), result["created"])
+        self.assertTrue(result["expired"])
+        self.assertEqual(
+            partitions.existing_partitions()[0], partitions.month_start(now().date())
+        )
+        self.assertEqual(partitions.existing_partitions()[-1], future)
+        self.assertEqual(Message.objects.get().content, "Hello!")
+
+    @skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL.")
+    def test_expired_partitions_release_their_message_ids(self):
+        conversation = Conversation.objects.create(status="OPEN")
+        message = Message.objects.create(
+            conversation=conversation,
+            type="INBOUND",
+            content="Hello!",
+            timestamp=now() - datetime.timedelta(days=62),
+        )
+        # Runs the deferred foreign key checks of the insert, as its commit would.
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        partitions.maintain(ahead=0, retention=1, drop=True)
+
+        self.assertEqual(Message.objects.existing_ids([message.id]), set())
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL.")
+class MessageIdsTestCase(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(status="OPEN")
+        self.message = Message.objects.create(
+            conversation=self.conversation,
+            type="INBOUND",
+            content="Hello!",
+            timestamp=now(),
+        )
+        # In another partition than the message.
+        self.later = now() + datetime.timedelta(days=40)
+
+    def test_ids_are_unique_across_partitions(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Message.objects.bulk_create(
+                [
+                    Message(
+                        id=self.message.id,
+                        conversation=self.conversation,
+                        type="INBOUND",
+                        content="Again",
+                        timestamp=self.later,
+                    )
+                ]
+            )
+        self.assertEqual(
+            Message.objects.existing_ids([self.message.id, uuid.uuid4()]),
+            {self.message.id},
+        )
+
+    def test_writes_check_ids_across_partitions(self):
+        self.assertIsNone(
+            Message.objects.create_in_open_conversation(
+                id=self.message.id,
+                conversation_id=self.conversation.id,
+                type="INBOUND",
+                content="Again",
+                timestamp=self.later,
+            )
+        )
+        payload = {
+            "type": "NEW_MESSAGE",
+            "timestamp": self.later.isoformat(),
+            "data": {
+                "id": str(self.message.id),
+                "conversation_id": str(self.conversation.id),
+                "content": "Again",
+            },
+        }
+        self.assertEqual(handle_batch([payload]), ["Message ID already exists"])
+        self.assertEqual(Message.objects.count(), 1)
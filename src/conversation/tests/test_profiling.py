@@ -0,0 +1,92 @@
+import tempfile
+import uuid
+from io import StringIO
+from pathlib import Path
+from unittest.mock import Mock
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from conversation import profiling
+from conversation.profiling import PROFILE_PATTERN, ProfilingMiddleware
+
+
+class ProfilingTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = override_settings(
+            PROFILING_ENABLED=True,
+            PROFILING_SAMPLE_RATE=1,
+            PROFILING_MIN_DURATION_MS=0,
+            PROFILING_DIR=directory.name,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.conversation_id = str(uuid.uuid4())
+
+    def view(self, request):
+        profiling.tag_event(
+            {"type": "NEW_MESSAGE", "data": {"conversation_id": self.conversation_id}}
+        )
+        return HttpResponse()
+
+    def profiles(self) -> list:
+        return [PROFILE_PATTERN.match(path.name) for path in self.directory.iterdir()]
+
+    def test_requests_are_profiled_with_their_event(self):
+        ProfilingMiddleware(self.view)(RequestFactory().post("/webhook/"))
+
+        (profile,) = self.profiles()
+        self.assertEqual(profile["kind"], "request")
+        self.assertEqual(profile["event"], "NEW_MESSAGE")
+        self.assertEqual(profile["conversation"], self.conversation_id)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_profiled(self):
+        ProfilingMiddleware(self.view)(RequestFactory().post("/webhook/"))
+        self.assertEqual(self.profiles(), [])
+
+    @override_settings(PROFILING_MIN_DURATION_MS=60000)
+    def test_only_slow_profiles_are_kept(self):
+        ProfilingMiddleware(self.view)(RequestFactory().post("/webhook/"))
+        self.assertEqual(self.profiles(), [])
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_middleware_removes_itself(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(self.view)
+
+    async def test_async_requests_are_profiled(self):
+        async def view(request):
+            return self.view(request)
+
+        await ProfilingMiddleware(view)(RequestFactory().post("/webhook/"))
+
+        (profile,) = self.profiles()
+        self.assertEqual(profile["event"], "NEW_MESSAGE")
+
+    def test_tasks_are_profiled_with_their_conversation(self):
+        task = Mock()
+        task.name = "conversation.tasks.process_conversation_messages"
+        profiling._on_task_prerun("task-id", task, args=(self.conversation_id,))
+        profiling._on_task_postrun("task-id", task, args=(self.conversation_id,))
+
+        (profile,) = self.profiles()
+        self.assertEqual(profile["kind"], "task")
+        self.assertEqual(profile["event"], "process_conversation_messages")
+        self.assertEqual(profile["conversation"], self.conversation_id)
+
+    def test_summary(self):
+        for _ in range(2):
+            ProfilingMiddleware(self.view)(RequestFactory().post("/webhook/"))
+
+        output = StringIO()
+        call_command("profile_summary", str(self.directory), stdout=output)
+
+        self.assertIn("2 profiles", output.getvalue())
+        self.assertIn("NEW_MESSAGE", output.getvalue())
+        self.assertIn("tag_event", output.getvalue())
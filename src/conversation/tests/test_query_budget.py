@@ -0,0 +1,121 @@
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework import status
+from unittest.mock import patch
+import uuid
+
+from conversation import query_budget
+from conversation.models import Conversation, Message
+from conversation.query_budget import QueryBudgetExceeded, track
+from conversation.tasks import process_conversation_messages
+
+
+def run_queries(count: int):
+    with connection.cursor() as cursor:
+        for _ in range(count):
+            cursor.execute("SELECT 1")
+
+
+@patch.dict(query_budget.BUDGETS, {"test": (2, 1000)})
+class QueryBudgetTestCase(TestCase):
+    def test_raises_on_query_overruns(self):
+        with track("test"):
+            run_queries(2)
+
+        with self.assertRaisesMessage(QueryBudgetExceeded, "3 queries (budget 2)"):
+            with track("test"):
+                run_queries(3)
+
+    @override_settings(QUERY_BUDGET_MODE="log")
+    def test_logs_overruns_with_their_sql(self):
+        with self.assertLogs("conversation.query_budget", "WARNING") as logs:
+            with track("test"):
+                run_queries(3)
+        self.assertIn("SELECT 1", logs.output[0])
+
+    @override_settings(QUERY_BUDGET_MODE="off")
+    def test_disabled(self):
+        with track("test"):
+            run_queries(3)
+
+    def test_savepoints_are_not_counted(self):
+        with track("test"):
+            with transaction.atomic():
+                run_queries(1)
+            with transaction.atomic():
+                run_queries(1)
+
+    def test_unbudgeted_work_is_not_measured(self):
+        with patch.object(connection, "execute_wrapper") as mock_wrapper:
+            with track("unknown"):
+                run_queries(3)
+        mock_wrapper.assert_not_called()
+
+    @patch.dict(
+        query_budget.BUDGETS,
+        {"conversation.tasks.process_conversation_messages": (0, 1000)},
+    )
+    def test_tasks_are_checked(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            process_conversation_messages(str(uuid.uuid4()))
+
+
+@patch("conversation.handlers.process_buffer_for_conversation.delay")
+@patch("conversation.handlers.schedule_message_processing")
+class BudgetsTestCase(TestCase):
+    """
+    The endpoints and tasks fit their budgets (overruns raise in tests).
+    """
+
+    def post(self, event_type: str, **data):
+        return self.client.post(
+            reverse("webhook"),
+            {"type": event_type, "timestamp": now().isoformat(), "data": data},
+            content_type="application/json",
+        )
+
+    def test_webhook_and_processing(self, mock_schedule, mock_delay):
+        conversation_id = str(uuid.uuid4())
+        self.assertEqual(
+            self.post("NEW_CONVERSATION", id=conversation_id).status_code,
+            status.HTTP_201_CREATED,
+        )
+        for _ in range(3):
+            response = self.post(
+                "NEW_MESSAGE",
+                id=str(uuid.uuid4()),
+                conversation_id=conversation_id,
+                content="Oi",
+            )
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_conversation_messages(conversation_id)
+        self.assertEqual(Message.objects.filter(type="OUTBOUND").count(), 1)
+
+        response = self.client.get(
+            reverse("conversation-detail", args=[conversation_id])
+        )
+        self.assertEqual(len(response.data["messages"]), 4)
+
+        self.assertEqual(
+            self.post("CLOSE_CONVERSATION", id=conversation_id).status_code,
+            status.HTTP_200_OK,
+        )
+        # Refusals read the conversation to tell why.
+        for event_type, data in (
+            (
+                "NEW_MESSAGE",
+                {
+                    "id": str(uuid.uuid4()),
+                    "conversation_id": conversation_id,
+                    "content": "Oi",
+                },
+            ),
+            ("CLOSE_CONVERSATION", {"id": conversation_id}),
+        ):
+            response = self.post(event_type, **data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Conversation.objects.get().status, "CLOSED")
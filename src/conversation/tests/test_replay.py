@@ -0,0 +1,201 @@
+import json
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from conversation.models import Conversation, Message
+from conversation.replay import Replayer
+from conversation.tasks import process_conversation_messages
+
+START = datetime(2025, 6, 4, 14, 20, tzinfo=timezone.utc)
+
+
+def event(event_type: str, seconds: float, **data) -> str:
+    return json.dumps(
+        {
+            "type": event_type,
+            "timestamp": (START + timedelta(seconds=seconds)).isoformat(),
+            "data": data,
+        }
+    )
+
+
+class ReplayTestCase(TestCase):
+    def setUp(self):
+        self.conversation_id = str(uuid.uuid4())
+
+    def conversation(self, event_type: str, seconds: float) -> str:
+        return event(event_type, seconds, id=self.conversation_id)
+
+    def message(self, seconds: float, message_id=None) -> str:
+        return event(
+            "NEW_MESSAGE",
+            seconds,
+            id=message_id or str(uuid.uuid4()),
+            conversation_id=self.conversation_id,
+            content="Hello!",
+        )
+
+    def replay(self, lines: list[str], **options) -> Replayer:
+        replayer = Replayer(**{"chunk_size": 2, "window": 10, **options})
+        with self.captureOnCommitCallbacks(execute=True):
+            replayer.run(lines)
+        return replayer
+
+    def test_applies_events_in_timestamp_order(self):
+        replayer = self.replay(
+            [
+                self.message(2),
+                self.conversation("CLOSE_CONVERSATION", 3),
+                self.conversation("NEW_CONVERSATION", 0),
+                self.message(4),
+                "not json",
+            ]
+        )
+
+        conversation = Conversation.objects.get(id=self.conversation_id)
+        self.assertEqual(conversation.status, "CLOSED")
+        self.assertEqual(conversation.created_at, START)
+        self.assertEqual(conversation.updated_at, START + timedelta(seconds=3))
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(replayer.stats["applied"], 3)
+        self.assertEqual(replayer.stats["invalid"], 1)
+        self.assertEqual(replayer.rejected, {"Conversation is closed": 1})
+
+    def test_holds_messages_until_their_conversation_exists(self):
+        recovered = str(uuid.uuid4())
+        other = str(uuid.uuid4())
+        replayer = self.replay(
+            [
+                self.message(0),
+                self.message(4, recovered),
+                self.conversation("NEW_CONVERSATION", 7),
+                event(
+                    "NEW_MESSAGE",
+                    8,
+                    id=str(uuid.uuid4()),
+                    conversation_id=other,
+                    content="Never created",
+                ),
+            ]
+        )
+
+        self.assertEqual(
+            list(Message.objects.values_list("id", flat=True)), [uuid.UUID(recovered)]
+        )
+        self.assertEqual(replayer.stats["held"], 3)
+        self.assertEqual(replayer.stats["recovered"], 1)
+        self.assertEqual(replayer.stats["expired"], 2)
+
+    def test_outbound_messages_follow_the_live_grouping(self):
+        self.replay(
+            [
+                self.conversation("NEW_CONVERSATION", 0),
+                self.message(1),
+                self.message(3),
+                self.message(20),
+                self.message(30),
+                self.message(32),
+            ],
+            outbound=True,
+        )
+
+        outbound = Message.objects.filter(type="OUTBOUND").order_by("timestamp")
+        self.assertEqual(
+            [message.content.count("\n") - 1 for message in outbound], [2, 1, 2]
+        )
+        self.assertEqual(
+            [message.timestamp for message in outbound],
+            [START + timedelta(seconds=seconds) for seconds in (8, 25, 37)],
+        )
+        last = Message.objects.filter(type="INBOUND").latest("timestamp")
+        conversation = Conversation.objects.get(id=self.conversation_id)
+        self.assertEqual(conversation.last_processed_timestamp, last.timestamp)
+        self.assertEqual(conversation.last_processed_message_id, last.id)
+
+        # Nothing is left for the live processing.
+        process_conversation_messages(self.conversation_id)
+        self.assertEqual(outbound.count(), 3)
+
+    def test_history_replayed_without_outbound_is_not_answered(self):
+        self.replay(
+            [
+                self.conversation("NEW_CONVERSATION", 0),
+                self.message(1),
+                self.message(20),
+            ],
+        )
+        live = Message.objects.create(
+            conversation_id=self.conversation_id,
+            type="INBOUND",
+            content="Hello!",
+            timestamp=START + timedelta(seconds=60),
+        )
+
+        process_conversation_messages(self.conversation_id)
+
+        (outbound,) = Message.objects.filter(type="OUTBOUND")
+        self.assertEqual(outbound.content.count("\n") - 1, 1)
+        self.assertIn(str(live.id), outbound.content)
+
+    def test_watermarks_only_move_forward(self):
+        watermark = START + timedelta(seconds=100)
+        Conversation.objects.create(
+            id=self.conversation_id,
+            last_processed_timestamp=watermark,
+            last_processed_message_id=uuid.uuid4(),
+        )
+
+        self.replay([self.message(1)], outbound=True)
+
+        conversation = Conversation.objects.get(id=self.conversation_id)
+        self.assertEqual(conversation.last_processed_timestamp, watermark)
+
+    def test_invalidates_the_cached_conversations(self):
+        Conversation.objects.create(id=self.conversation_id)
+        created = str(uuid.uuid4())
+
+        with patch("conversation.replay.detail_cache.invalidate") as invalidate:
+            self.replay(
+                [self.message(1), event("NEW_CONVERSATION", 2, id=created)],
+            )
+
+        invalidate.assert_called_once_with(uuid.UUID(self.conversation_id))
+
+    def test_replaying_again_changes_nothing(self):
+        lines = [
+            self.conversation("NEW_CONVERSATION", 0),
+            self.message(1),
+            self.message(2),
+        ]
+        self.replay(lines, outbound=True)
+
+        replayer = self.replay(lines, outbound=True)
+
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(
+            replayer.rejected,
+            {"Conversation already exists": 1, "Message ID already exists": 2},
+        )
+
+
+class ReplayEventsCommandTestCase(TestCase):
+    def test_reports_the_outcome(self):
+        conversation_id = str(uuid.uuid4())
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as file:
+            file.write(event("NEW_CONVERSATION", 0, id=conversation_id) + "\n")
+            file.write(event("NEW_CONVERSATION", 1, id=conversation_id) + "\n")
+            file.flush()
+            output = StringIO()
+            call_command("replay_events", file.name, stdout=output, stderr=StringIO())
+
+        report = json.loads(output.getvalue())
+        self.assertEqual(report["events"], 2)
+        self.assertEqual(report["applied"], 1)
+        self.assertEqual(report["rejected"], {"Conversation already exists": 1})
+        self.assertIn("events_per_second", report)
@@ -58,3 +58,47 @@ class RepositoryTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIsNotNone(response.data)
         self.assertIn("error", response.data)
+
+    @patch(
+        "conversation.handlers.handle_batch",
+        return_value=[None, "Conversation is closed", None],
+    )
+    def test_handle_batch_maps_statuses(self, mock_handler):
+        payloads = [
+            {**self.payload_base, "type": "NEW_CONVERSATION"},
+            {**self.payload_base, "type": "NEW_MESSAGE"},
+            {**self.payload_base, "type": "CLOSE_CONVERSATION"},
+        ]
+        results = Repository.handle_batch(payloads)
+        self.assertEqual(
+            results,
+            [
+                {"status": status.HTTP_201_CREATED},
+                {
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "error": "Conversation is closed",
+                },
+                {"status": status.HTTP_200_OK},
+            ],
+        )
+        mock_handler.assert_called_once_with(payloads)
+
+    @patch("conversation.async_handlers.handle_new_message")
+    async def test_ahandle_hook_new_message_success(self, mock_handler):
+        payload = {**self.payload_base, "type": "NEW_MESSAGE"}
+        response = await Repository.ahandle_hook(payload)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_handler.assert_awaited_once_with(payload)
+
+    @patch(
+        "conversation.async_handlers.handle_close_conversation", side_effect=ValueError
+    )
+    async def test_ahandle_hook_close_conversation_error(self, mock_handler):
+        payload = {**self.payload_base, "type": "CLOSE_CONVERSATION"}
+        response = await Repository.ahandle_hook(payload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_ahandle_hook_unknown_type(self):
+        payload = {**self.payload_base, "type": "UNKNOWN_TYPE"}
+        response = await Repository.ahandle_hook(payload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
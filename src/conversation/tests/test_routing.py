@@ -0,0 +1,69 @@
+from django.test import SimpleTestCase, override_settings
+import uuid
+
+from config.celery import app
+from conversation.routing import route_task
+from conversation.sharding import shard_for
+from conversation.tasks import (
+    buffer_message_until_conversation_exists,
+    debounce_conversation_processing,
+    process_buffer_for_conversation,
+    process_conversation_messages,
+)
+
+
+@override_settings(CONVERSATION_QUEUES=4)
+class RouteTaskTestCase(SimpleTestCase):
+    def setUp(self):
+        self.conversation_id = str(uuid.uuid4())
+        self.queue = f"conversation.{shard_for(self.conversation_id, 4)}"
+
+    def route(self, task, *args, **kwargs):
+        return route_task(task.name, args, kwargs, {})
+
+    def test_routes_the_tasks_of_a_conversation_to_the_same_queue(self):
+        payload = {
+            "type": "NEW_MESSAGE",
+            "timestamp": "2025-06-04T14:20:00Z",
+            "data": {
+                "id": str(uuid.uuid4()),
+                "conversation_id": self.conversation_id,
+                "content": "Hello!",
+            },
+        }
+        routes = [
+            self.route(buffer_message_until_conversation_exists, payload),
+            self.route(
+                process_buffer_for_conversation,
+                uuid.UUID(self.conversation_id),
+                payload["timestamp"],
+            ),
+            self.route(debounce_conversation_processing, self.conversation_id),
+            self.route(
+                process_conversation_messages, conversation_id=self.conversation_id
+            ),
+        ]
+        self.assertEqual(routes, [{"queue": self.queue}] * 4)
+
+    def test_spreads_conversations_over_the_queues(self):
+        queues = {
+            self.route(debounce_conversation_processing, str(uuid.uuid4()))["queue"]
+            for _ in range(100)
+        }
+        self.assertEqual(queues, {f"conversation.{shard}" for shard in range(4)})
+
+    def test_leaves_other_tasks_to_the_default_queue(self):
+        self.assertIsNone(route_task("celery.chord_unlock", (), {}, {}))
+        self.assertIsNone(self.route(debounce_conversation_processing, "not-a-uuid"))
+
+    @override_settings(CONVERSATION_QUEUES=0)
+    def test_disabled(self):
+        self.assertIsNone(
+            self.route(debounce_conversation_processing, self.conversation_id)
+        )
+
+    def test_is_used_by_the_celery_app(self):
+        route = app.amqp.router.route(
+            {}, debounce_conversation_processing.name, args=(self.conversation_id,)
+        )
+        self.assertEqual(route["queue"].name, self.queue)
@@ -0,0 +1,128 @@
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from redis.exceptions import ConnectionError
+from unittest.mock import patch
+import fakeredis
+import json
+import time
+import uuid
+
+from conversation import status_cache
+from conversation.handlers import handle_close_conversation, handle_new_message
+from conversation.models import Conversation, Message
+
+# Patched in the tests, except where the listener itself is tested.
+ensure_listener = status_cache._ensure_listener
+
+
+@override_settings(STATUS_CACHE_ENABLED=True)
+class StatusCacheTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = patch(
+            "conversation.status_cache.get_redis_connection", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        listener = patch("conversation.status_cache._ensure_listener")
+        listener.start()
+        self.addCleanup(listener.stop)
+        status_cache._closed.clear()
+        self.addCleanup(status_cache._closed.clear)
+        self.conversation_id = str(uuid.uuid4())
+
+    def test_closes_are_read_from_redis_then_kept_locally(self):
+        self.assertFalse(status_cache.is_closed(self.conversation_id))
+
+        status_cache.mark_closed([self.conversation_id])
+        status_cache._closed.clear()
+        self.assertTrue(status_cache.is_closed(self.conversation_id))
+
+        self.redis.flushall()
+        self.assertTrue(status_cache.is_closed(self.conversation_id))
+
+    def test_open_conversations_skip_redis(self):
+        status_cache.remember_open(self.conversation_id)
+        with patch.object(self.redis, "exists") as mock_exists:
+            self.assertFalse(status_cache.is_closed(self.conversation_id))
+        mock_exists.assert_not_called()
+
+        # A close announced by another process overrides the open entry.
+        status_cache._on_message({"data": json.dumps([self.conversation_id])})
+        self.assertTrue(status_cache.is_closed(self.conversation_id))
+        status_cache.remember_open(self.conversation_id)
+        self.assertTrue(status_cache.is_closed(self.conversation_id))
+
+    @patch("conversation.status_cache.STATUS_CACHE_SIZE", 2)
+    def test_local_cache_is_bounded(self):
+        ids = [str(uuid.uuid4()) for _ in range(3)]
+        for conversation_id in ids:
+            status_cache.remember_open(conversation_id)
+        self.assertEqual(list(status_cache._closed), ids[1:])
+
+    def test_redis_errors_are_ignored(self):
+        with patch.object(self.redis, "exists", side_effect=ConnectionError()):
+            with self.assertLogs("conversation.status_cache", "WARNING"):
+                self.assertFalse(status_cache.is_closed(self.conversation_id))
+
+    def test_listener_receives_closes(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{status_cache.CHANNEL: status_cache._on_message})
+        thread = pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+        self.addCleanup(thread.stop)
+
+        self.redis.publish(status_cache.CHANNEL, json.dumps([self.conversation_id]))
+        deadline = time.monotonic() + 2
+        while status_cache._local_get(self.conversation_id) is None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertTrue(status_cache._local_get(self.conversation_id))
+
+    def test_listener_is_started_once_per_process(self):
+        state = {"pid": None, "thread": None, "retry_at": 0.0}
+        with patch.dict(status_cache._listener, state):
+            ensure_listener()
+            ensure_listener()
+            self.addCleanup(status_cache._listener["thread"].stop)
+
+            self.assertEqual(
+                self.redis.pubsub_numsub(status_cache.CHANNEL),
+                [(status_cache.CHANNEL.encode(), 1)],
+            )
+
+    def message_payload(self):
+        return {
+            "data": {
+                "id": str(uuid.uuid4()),
+                "conversation_id": self.conversation_id,
+                "content": "Oi",
+            },
+            "timestamp": now().isoformat(),
+        }
+
+    @patch("conversation.handlers.schedule_message_processing")
+    def test_handlers_refuse_known_closed_conversations(self, mock_schedule):
+        Conversation.objects.create(id=self.conversation_id)
+        handle_new_message(self.message_payload())
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_close_conversation({"data": {"id": self.conversation_id}})
+
+        with patch.object(
+            Message.objects, "create_in_open_conversation"
+        ) as mock_create:
+            with self.assertRaisesMessage(ValueError, "Conversation is closed"):
+                handle_new_message(self.message_payload())
+        mock_create.assert_not_called()
+
+    def test_stale_open_entries_fall_back_to_the_database(self):
+        Conversation.objects.create(id=self.conversation_id, status="CLOSED")
+        status_cache.remember_open(self.conversation_id)
+
+        with self.assertRaisesMessage(ValueError, "Conversation is closed"):
+            handle_new_message(self.message_payload())
+
+        self.assertFalse(Message.objects.exists())
+        self.assertTrue(status_cache.is_closed(self.conversation_id))
+        self.assertTrue(
+            self.redis.exists(status_cache.STATUS_KEY.format(self.conversation_id))
+        )
@@ -1,14 +1,23 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
+import fakeredis
+import time
+from conversation import debounce
+from conversation.constants import DEBOUNCE_KEY, DEBOUNCE_STALE_AFTER
 from conversation.tasks import (
     buffer_message_until_conversation_exists,
+    debounce_conversation_processing,
     process_buffer_for_conversation,
     process_conversation_messages,
+    process_conversations,
+    recover_lost_processing_jobs,
     schedule_message_processing,
+    sweep_due_conversations,
 )
 from conversation.models import Conversation, Message
 from django.utils.timezone import now, timedelta
-import json
 import uuid
 from src.conversation.constants import BUFFER_TIMEOUT
 
@@ -27,31 +36,311 @@ class TasksTestCase(TestCase):
             "timestamp": self.timestamp,
         }
 
-    @patch("conversation.tasks.cache")
-    def test_buffer_message_until_conversation_exists(self, mock_cache):
+    @patch("conversation.handlers.handle_new_message")
+    @patch("conversation.tasks.buffer.push", return_value=None)
+    def test_buffer_message_until_conversation_exists(self, mock_push, mock_handle):
         buffer_message_until_conversation_exists(self.payload)
-        cache_key = f"buffer:{self.conv_id.hex}:{self.msg_id.hex}"
-        mock_cache.set.assert_called_once_with(
-            cache_key,
-            json.dumps(self.payload),
-            timeout=BUFFER_TIMEOUT,
-        )
+        mock_push.assert_called_once_with(self.payload)
+        mock_handle.assert_not_called()
+
+    @patch("conversation.handlers.handle_new_message")
+    @patch("conversation.tasks.buffer.push")
+    def test_buffer_message_handles_directly_if_already_drained(
+        self, mock_push, mock_handle
+    ):
+        mock_push.return_value = (now() + timedelta(seconds=2)).isoformat()
+        buffer_message_until_conversation_exists(self.payload)
+        mock_handle.assert_called_once_with(self.payload, from_buffer=True)
 
-    @patch("conversation.tasks.cache")
-    @patch("conversation.tasks.get_redis_connection")
     @patch("conversation.handlers.handle_new_message")
+    @patch("conversation.tasks.buffer.drain")
     def test_process_buffer_for_conversation_calls_handle_new_message(
-        self, mock_handle, mock_redis, mock_cache
+        self, mock_drain, mock_handle
     ):
-        mock_redis.return_value.keys.return_value = [b"buffer:conv1:msg1"]
-        mock_cache.get.return_value = json.dumps(self.payload)
-        mock_cache.delete.return_value = None
+        mock_drain.return_value = [self.payload]
 
         process_buffer_for_conversation(self.conv_id.hex, self.timestamp)
-        mock_handle.assert_called_once()
-        mock_cache.delete.assert_called_once()
+        mock_drain.assert_called_once_with(self.conv_id.hex, self.timestamp)
+        mock_handle.assert_called_once_with(self.payload, from_buffer=True)
+
+    @patch("conversation.handlers.handle_new_message")
+    @patch("conversation.tasks.buffer.drain")
+    def test_process_buffer_for_conversation_drops_expired_messages(
+        self, mock_drain, mock_handle
+    ):
+        mock_drain.return_value = [self.payload]
+        timestamp = (now() + timedelta(seconds=BUFFER_TIMEOUT + 1)).isoformat()
+
+        process_buffer_for_conversation(self.conv_id.hex, timestamp)
+        mock_handle.assert_not_called()
 
-    @patch("conversation.tasks.process_conversation_messages.apply_async")
-    def test_schedule_message_processing(self, mock_apply_async):
+    @patch("conversation.tasks.debounce.touch", return_value=True)
+    @patch("conversation.tasks.debounce_conversation_processing.apply_async")
+    def test_schedule_message_processing(self, mock_apply_async, mock_touch):
         schedule_message_processing(self.conv_id.hex)
-        mock_apply_async.assert_called_once()
+        mock_touch.assert_called_once_with(self.conv_id.hex, 5)
+        mock_apply_async.assert_called_once_with(args=[self.conv_id.hex], countdown=5)
+
+    @patch("conversation.tasks.debounce.touch", return_value=False)
+    @patch("conversation.tasks.debounce_conversation_processing.apply_async")
+    def test_schedule_message_processing_debounces_pending(
+        self, mock_apply_async, mock_touch
+    ):
+        schedule_message_processing(self.conv_id.hex)
+        mock_apply_async.assert_not_called()
+
+    @override_settings(CONVERSATION_PROCESSING_MODE="sweep")
+    @patch("conversation.tasks.debounce.touch", return_value=True)
+    @patch("conversation.tasks.debounce_conversation_processing.apply_async")
+    def test_schedule_message_processing_leaves_sweep_to_the_sweeper(
+        self, mock_apply_async, mock_touch
+    ):
+        schedule_message_processing(self.conv_id.hex)
+        mock_touch.assert_called_once_with(self.conv_id.hex, 5)
+        mock_apply_async.assert_not_called()
+
+    @patch("conversation.tasks.process_conversation_messages")
+    @patch("conversation.tasks.debounce_conversation_processing.apply_async")
+    @patch("conversation.tasks.debounce.claim", return_value=2.5)
+    def test_debounce_reschedules_until_quiet(
+        self, mock_claim, mock_apply_async, mock_process
+    ):
+        debounce_conversation_processing(self.conv_id.hex)
+        mock_apply_async.assert_called_once_with(args=[self.conv_id.hex], countdown=2.5)
+        mock_process.assert_not_called()
+
+    @patch("conversation.tasks.process_conversation_messages")
+    @patch("conversation.tasks.debounce_conversation_processing.apply_async")
+    @patch("conversation.tasks.debounce.claim", return_value=-0.2)
+    def test_debounce_processes_when_expired(
+        self, mock_claim, mock_apply_async, mock_process
+    ):
+        debounce_conversation_processing(self.conv_id.hex)
+        mock_process.assert_called_once_with(self.conv_id.hex)
+        mock_apply_async.assert_not_called()
+
+    @patch("conversation.tasks.process_conversation_messages")
+    @patch("conversation.tasks.debounce.claim", return_value=None)
+    def test_debounce_skips_already_claimed(self, mock_claim, mock_process):
+        debounce_conversation_processing(self.conv_id.hex)
+        mock_process.assert_not_called()
+
+
+class DebounceTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = patch(
+            "conversation.debounce.get_redis_connection", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conv_id = str(uuid.uuid4())
+
+    def test_touch_only_asks_to_schedule_the_first_message(self):
+        self.assertTrue(debounce.touch(self.conv_id, 5))
+        self.assertFalse(debounce.touch(self.conv_id, 5))
+        self.assertAlmostEqual(
+            self.redis.zscore(DEBOUNCE_KEY, self.conv_id), time.time() + 5, delta=1
+        )
+
+    @patch("conversation.tasks.debounce_conversation_processing.apply_async")
+    def test_lost_jobs_are_scheduled_again(self, mock_apply_async):
+        # The job of a conversation was lost long ago: its deadline stayed behind.
+        self.redis.zadd(
+            DEBOUNCE_KEY, {self.conv_id: time.time() - DEBOUNCE_STALE_AFTER - 1}
+        )
+
+        schedule_message_processing(self.conv_id)
+        schedule_message_processing(self.conv_id)
+
+        mock_apply_async.assert_called_once_with(args=[self.conv_id], countdown=5)
+
+    @patch("conversation.tasks.DEBOUNCE_RECOVERY_BATCH_SIZE", 1)
+    @patch("conversation.tasks.debounce_conversation_processing.apply_async")
+    def test_lost_jobs_are_recovered_without_new_messages(self, mock_apply_async):
+        # The last burst of a conversation lost its job, and nothing follows it.
+        self.redis.zadd(
+            DEBOUNCE_KEY, {self.conv_id: time.time() - DEBOUNCE_STALE_AFTER - 1}
+        )
+        pending = str(uuid.uuid4())
+        debounce.touch(pending, -10)
+
+        self.assertEqual(recover_lost_processing_jobs(), 1)
+        mock_apply_async.assert_called_once_with(args=[self.conv_id])
+        # Due right away, it is not picked again while its new job is pending.
+        self.assertAlmostEqual(
+            self.redis.zscore(DEBOUNCE_KEY, self.conv_id), time.time(), delta=1
+        )
+        self.assertEqual(recover_lost_processing_jobs(), 0)
+
+        debounce_conversation_processing(self.conv_id)
+        self.assertIsNone(self.redis.zscore(DEBOUNCE_KEY, self.conv_id))
+
+
+class ProcessConversationMessagesTestCase(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(status="OPEN")
+        self.base = now()
+
+    def create_inbound(self, seconds):
+        return Message.objects.create(
+            conversation=self.conversation,
+            type="INBOUND",
+            content="Oi",
+            timestamp=self.base + timedelta(seconds=seconds),
+        )
+
+    def outbound_contents(self):
+        return list(
+            Message.objects.filter(
+                conversation=self.conversation, type="OUTBOUND"
+            ).values_list("content", flat=True)
+        )
+
+    def test_groups_messages_within_five_seconds(self):
+        first = self.create_inbound(0)
+        second = self.create_inbound(2)
+        third = self.create_inbound(20)
+
+        process_conversation_messages(str(self.conversation.id))
+
+        self.assertCountEqual(
+            self.outbound_contents(),
+            [
+                f"Mensagens recebidas:\n{first.id}\n{second.id}\n",
+                f"Mensagens recebidas:\n{third.id}\n",
+            ],
+        )
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_processed_message_id, third.id)
+        self.assertEqual(self.conversation.last_processed_timestamp, third.timestamp)
+
+    def test_only_processes_messages_past_watermark(self):
+        self.create_inbound(0)
+        process_conversation_messages(str(self.conversation.id))
+        process_conversation_messages(str(self.conversation.id))
+        self.assertEqual(len(self.outbound_contents()), 1)
+
+        new = self.create_inbound(30)
+        process_conversation_messages(str(self.conversation.id))
+        self.assertEqual(len(self.outbound_contents()), 2)
+        self.assertIn(f"Mensagens recebidas:\n{new.id}\n", self.outbound_contents())
+
+    def test_ignores_missing_conversation(self):
+        process_conversation_messages(str(uuid.uuid4()))
+        self.assertFalse(Message.objects.filter(type="OUTBOUND").exists())
+
+
+class ProcessConversationsTestCase(TestCase):
+    def setUp(self):
+        self.base = now()
+        self.conversations = [
+            Conversation.objects.create(status="OPEN") for _ in range(3)
+        ]
+
+    def create_inbound(self, conversation, seconds):
+        return Message.objects.create(
+            conversation=conversation,
+            type="INBOUND",
+            content="Oi",
+            timestamp=self.base + timedelta(seconds=seconds),
+        )
+
+    def test_matches_the_processing_of_each_conversation(self):
+        first, second, third = self.conversations
+        a = self.create_inbound(first, 0)
+        b = self.create_inbound(first, 2)
+        c = self.create_inbound(first, 20)
+        d = self.create_inbound(second, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = process_conversations([c.id for c in self.conversations])
+
+        self.assertEqual(created, 3)
+        self.assertCountEqual(
+            Message.objects.filter(type="OUTBOUND").values_list(
+                "conversation_id", "content"
+            ),
+            [
+                (first.id, f"Mensagens recebidas:\n{a.id}\n{b.id}\n"),
+                (first.id, f"Mensagens recebidas:\n{c.id}\n"),
+                (second.id, f"Mensagens recebidas:\n{d.id}\n"),
+            ],
+        )
+        for conversation, last in ((first, c), (second, d), (third, None)):
+            conversation.refresh_from_db()
+            self.assertEqual(conversation.last_processed_message_id, last and last.id)
+
+        # Nothing is left past the watermarks.
+        self.assertEqual(process_conversations([first.id, second.id]), 0)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        for conversation in self.conversations:
+            self.create_inbound(conversation, 0)
+            self.create_inbound(conversation, 10)
+
+        with CaptureQueriesContext(connection) as single:
+            process_conversations([self.conversations[0].id])
+        with CaptureQueriesContext(connection) as batch:
+            process_conversations([c.id for c in self.conversations[1:]])
+
+        self.assertEqual(len(batch), len(single))
+        self.assertEqual(Message.objects.filter(type="OUTBOUND").count(), 6)
+
+
+class SweepDueConversationsTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = patch(
+            "conversation.debounce.get_redis_connection", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conversations = [
+            Conversation.objects.create(status="OPEN") for _ in range(3)
+        ]
+        for conversation in self.conversations:
+            Message.objects.create(
+                conversation=conversation, type="INBOUND", content="Oi", timestamp=now()
+            )
+
+    def make_due(self, conversation, seconds_ago):
+        self.redis.zadd(DEBOUNCE_KEY, {str(conversation.id): time.time() - seconds_ago})
+
+    def answered(self):
+        return set(
+            Message.objects.filter(type="OUTBOUND").values_list(
+                "conversation_id", flat=True
+            )
+        )
+
+    @override_settings(CONVERSATION_SWEEP_BATCH_SIZE=1)
+    @patch("conversation.tasks.metrics.observe_many")
+    def test_processes_due_conversations_in_batches(self, mock_observe):
+        due, also_due, waiting = self.conversations
+        self.make_due(due, 3)
+        self.make_due(also_due, 1)
+        self.make_due(waiting, -5)
+
+        self.assertEqual(sweep_due_conversations(), 2)
+
+        self.assertEqual(self.answered(), {due.id, also_due.id})
+        self.assertEqual(
+            self.redis.zrange(DEBOUNCE_KEY, 0, -1), [str(waiting.id).encode()]
+        )
+        # The most overdue conversation is claimed first.
+        delays = [call.args[1][0] for call in mock_observe.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertAlmostEqual(delays[0], 3, delta=1)
+        self.assertAlmostEqual(delays[1], 1, delta=1)
+
+    @patch("conversation.tasks.process_conversations", side_effect=RuntimeError)
+    def test_failed_batches_stay_due(self, mock_process):
+        self.make_due(self.conversations[0], 1)
+
+        with self.assertRaises(RuntimeError):
+            sweep_due_conversations()
+
+        self.assertIsNotNone(
+            self.redis.zscore(DEBOUNCE_KEY, str(self.conversations[0].id))
+        )
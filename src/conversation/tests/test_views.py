@@ -0,0 +1,147 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.timezone import now, timedelta
+from rest_framework import status
+from unittest.mock import patch
+import uuid
+
+from conversation import detail_cache
+from conversation.handlers import handle_close_conversation, handle_new_message
+from conversation.models import Conversation, Message
+from conversation.serializers import MessageSerializer
+
+
+class ConversationMessagesViewTestCase(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(status="OPEN")
+        base = now()
+        self.messages = [
+            Message.objects.create(
+                conversation=self.conversation,
+                type="INBOUND",
+                content=f"Message {i}",
+                timestamp=base + timedelta(seconds=i // 2),
+            )
+            for i in range(5)
+        ]
+        self.messages.sort(key=lambda m: (m.timestamp, m.id))
+        self.url = reverse("conversation-messages", args=[self.conversation.id])
+
+    def test_paginates_by_timestamp_and_id(self):
+        ids = []
+        url = f"{self.url}?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            ids.extend(message["id"] for message in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(ids, [str(m.id) for m in self.messages])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f"{self.url}?cursor=invalid")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unknown_conversation(self):
+        url = reverse("conversation-messages", args=[uuid.uuid4()])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ConversationDetailViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.conversation = Conversation.objects.create(status="OPEN")
+        base = now()
+        self.messages = [
+            Message.objects.create(
+                conversation=self.conversation,
+                type="INBOUND",
+                content=f"Message {i}",
+                timestamp=base + timedelta(seconds=i),
+            )
+            for i in range(5)
+        ]
+        self.url = reverse("conversation-detail", args=[self.conversation.id])
+
+    def test_returns_all_messages(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["messages"]), 5)
+
+    def test_embeds_recent_messages(self):
+        response = self.client.get(f"{self.url}?recent=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [message["id"] for message in response.data["messages"]],
+            [str(m.id) for m in self.messages[-2:]],
+        )
+
+    def test_rejects_invalid_recent(self):
+        response = self.client.get(f"{self.url}?recent=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_serves_cached_representation(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_returns_not_modified_for_current_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @patch("conversation.handlers.schedule_message_processing")
+    def test_new_message_is_appended_to_cached_representation(self, mock_schedule):
+        etag = self.client.get(self.url)["ETag"]
+        message_id = uuid.uuid4()
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_new_message(
+                {
+                    "data": {
+                        "id": str(message_id),
+                        "conversation_id": str(self.conversation.id),
+                        "content": "Hello!",
+                    },
+                    "timestamp": (now() - timedelta(days=1)).isoformat(),
+                }
+            )
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["messages"][0]["id"], str(message_id))
+        self.assertEqual(len(response.data["messages"]), 6)
+
+    def test_message_cached_before_its_append_is_not_duplicated(self):
+        # A reader renders the conversation after the message was committed, but
+        # before the writer appends it to the cached representation.
+        message = Message.objects.create(
+            conversation=self.conversation,
+            type="INBOUND",
+            content="Hello!",
+            timestamp=now(),
+        )
+        self.client.get(self.url)
+        detail_cache.append_messages(
+            self.conversation.id, [MessageSerializer(message).data]
+        )
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        ids = [item["id"] for item in response.data["messages"]]
+        self.assertEqual(ids.count(str(message.id)), 1)
+        self.assertEqual(len(ids), 6)
+
+    def test_close_invalidates_cached_representation(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_close_conversation({"data": {"id": str(self.conversation.id)}})
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["status"], "CLOSED")
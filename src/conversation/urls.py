@@ -1,11 +1,38 @@
 from django.urls import path
-from .views import WebhookView, ConversationDetailView
+from .views import (
+    AsyncWebhookView,
+    WebhookView,
+    WebhookBatchView,
+    ConversationDetailView,
+    ConversationEventsView,
+    ConversationExportView,
+    ConversationMessagesView,
+    MetricsView,
+)
 
 urlpatterns = [
     path("webhook/", WebhookView.as_view(), name="webhook"),
+    path("webhook/batch/", WebhookBatchView.as_view(), name="webhook-batch"),
+    path("webhook/async/", AsyncWebhookView.as_view(), name="webhook-async"),
+    path(
+        "conversations/export/",
+        ConversationExportView.as_view(),
+        name="conversation-export",
+    ),
     path(
         "conversations/<uuid:pk>/",
         ConversationDetailView.as_view(),
         name="conversation-detail",
     ),
+    path(
+        "conversations/<uuid:pk>/messages/",
+        ConversationMessagesView.as_view(),
+        name="conversation-messages",
+    ),
+    path(
+        "conversations/<uuid:pk>/events/",
+        ConversationEventsView.as_view(),
+        name="conversation-events",
+    ),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]
@@ -1,25 +1,362 @@
+import io
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser
 from rest_framework import status
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .serializers import ConversationSerializer, WebhookBaseSerializer
-from .models import Conversation
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.exceptions import ParseError, ValidationError
+from . import admission, archive, detail_cache, events, metrics, profiling, query_budget
+from .constants import (
+    BATCH_MAX_SIZE,
+    EVENTS_HEARTBEAT_INTERVAL,
+    EVENTS_REPLAY_LIMIT,
+    EVENTS_RETRY_MS,
+)
+from .export import EXPORT_CONTENT_TYPES, export_rows, stream_export
+from .pagination import MessageKeysetPagination, decode_position, encode_position
+from .parsers import FastJSONParser, NDJSONParser
+from .renderers import FastJSONRenderer
+from .serializers import (
+    ConversationSerializer,
+    ExportQuerySerializer,
+    MessageSerializer,
+    RecentMessagesConversationSerializer,
+    RecentMessagesQuerySerializer,
+    WebhookBaseSerializer,
+    validate_webhook_event,
+)
+from .models import Conversation, Message
 from .repository import Repository
 
+FAST_PATH = settings.WEBHOOK_FAST_PATH and FastJSONParser.available
+JSON_PARSER_CLASS = FastJSONParser if FAST_PATH else JSONParser
+JSON_RENDERER_CLASS = FastJSONRenderer if FAST_PATH else JSONRenderer
 
-class WebhookView(APIView):
-    def post(self, request):
-        serializer = WebhookBaseSerializer(data=request.data)
+
+def parse_webhook_event(data) -> dict:
+    """
+    Validates a webhook event, through the fast path when it is enabled.
+
+    Args:
+        data: The parsed request body.
+    Returns:
+        dict: The validated payload.
+    Raises:
+        ValidationError: If the event is invalid.
+    """
+    payload = validate_webhook_event(data) if FAST_PATH else None
+    if payload is None:
+        serializer = WebhookBaseSerializer(data=data)
         serializer.is_valid(raise_exception=True)
         payload = serializer.data
+    return payload
+
+
+class WebhookView(APIView):
+    parser_classes = [JSON_PARSER_CLASS]
+    renderer_classes = [JSON_RENDERER_CLASS]
+
+    def post(self, request):
+        payload = parse_webhook_event(request.data)
+        profiling.tag_event(payload)
+        rejection = admission.admit(payload)
+        if rejection is not None:
+            status_code, error, retry_after = rejection
+            return Response(
+                {"error": error},
+                status=status_code,
+                headers={"Retry-After": str(retry_after)},
+            )
         try:
-            return Repository.handle_hook(payload)
+            with query_budget.track(f"webhook.{payload['type']}"):
+                if settings.INGEST_ENABLED:
+                    return Repository.enqueue_hook(payload)
+                return Repository.handle_hook(payload)
         except (KeyError, ValueError) as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncWebhookView(View):
+    """
+    Asynchronous version of `WebhookView`, served by the ASGI application.
+    Parsing, validation and status codes follow `WebhookView`.
+    """
+
+    async def post(self, request):
+        if request.content_type != "application/json":
+            return self.error(
+                {
+                    "detail": f'Unsupported media type "{request.content_type}" in request.'
+                },
+                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        try:
+            data = JSON_PARSER_CLASS().parse(io.BytesIO(request.body))
+        except ParseError as e:
+            return self.error({"detail": e.detail})
+
+        try:
+            payload = parse_webhook_event(data)
+        except ValidationError as e:
+            return self.error(e.detail)
+        profiling.tag_event(payload)
+        rejection = await admission.aadmit(payload)
+        if rejection is not None:
+            status_code, error, retry_after = rejection
+            response = self.error({"error": error}, status_code)
+            response["Retry-After"] = str(retry_after)
+            return response
+        try:
+            return await Repository.ahandle_hook(payload)
+        except (KeyError, ValueError) as e:
+            return self.error({"error": str(e)})
+
+    @staticmethod
+    def error(data, status_code=status.HTTP_400_BAD_REQUEST) -> HttpResponse:
+        return HttpResponse(
+            JSON_RENDERER_CLASS().render(data),
+            status=status_code,
+            content_type="application/json",
+        )
+
+
+class WebhookBatchView(APIView):
+    parser_classes = [JSON_PARSER_CLASS, NDJSONParser]
+    renderer_classes = [JSON_RENDERER_CLASS]
+
+    def post(self, request):
+        events = request.data
+        if not isinstance(events, list):
+            return Response(
+                {"error": "Expected a list of events"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(events) > BATCH_MAX_SIZE:
+            return Response(
+                {"error": f"Batch exceeds the maximum of {BATCH_MAX_SIZE} events"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = [None] * len(events)
+        indexes, payloads = [], []
+        for index, event in enumerate(events):
+            try:
+                payloads.append(parse_webhook_event(event))
+                indexes.append(index)
+            except ValidationError as e:
+                results[index] = {
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "error": e.detail,
+                }
+
+        admitted_indexes, admitted = [], []
+        for index, payload, rejection in zip(
+            indexes, payloads, admission.admit_batch(payloads)
+        ):
+            if rejection is None:
+                admitted_indexes.append(index)
+                admitted.append(payload)
+                continue
+            status_code, error, retry_after = rejection
+            results[index] = {
+                "status": status_code,
+                "error": error,
+                "retry_after": retry_after,
+            }
+
+        if admitted:
+            for index, result in zip(
+                admitted_indexes, Repository.handle_batch(admitted)
+            ):
+                results[index] = result
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class ConversationDetailView(APIView):
+    renderer_classes = [JSON_RENDERER_CLASS, BrowsableAPIRenderer]
+
     def get(self, request, pk):
-        conversation = get_object_or_404(Conversation, pk=pk)
-        serializer = ConversationSerializer(conversation)
-        return Response(serializer.data)
+        query = RecentMessagesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        recent = query.validated_data.get("recent")
+        variant = f"-r{recent}" if recent is not None else ""
+
+        version, cached = detail_cache.get(pk)
+        if version is not None:
+            etag = detail_cache.etag(pk, version, variant)
+            if request.headers.get("If-None-Match") == etag:
+                return Response(
+                    status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+                )
+            if cached is not None and recent is None:
+                return Response(cached, headers={"ETag": etag})
+
+        version = detail_cache.current_version(pk)
+        with query_budget.track("conversation_detail"):
+            data = self.render(pk, recent)
+        if recent is None:
+            detail_cache.store(pk, version, data)
+        return Response(data, headers={"ETag": detail_cache.etag(pk, version, variant)})
+
+    def render(self, pk, recent: int | None) -> dict:
+        conversations = Conversation.objects.select_related("archive")
+        if recent is None:
+            messages = Prefetch(
+                "messages", queryset=Message.objects.order_by("timestamp", "id")
+            )
+            conversation = get_object_or_404(
+                conversations.prefetch_related(messages), pk=pk
+            )
+            data = ConversationSerializer(conversation).data
+        else:
+            recent_messages = Prefetch(
+                "messages",
+                queryset=Message.objects.order_by("-timestamp", "-id")[:recent],
+                to_attr="recent_messages",
+            )
+            conversation = get_object_or_404(
+                conversations.prefetch_related(recent_messages), pk=pk
+            )
+            conversation.recent_messages.reverse()
+            data = RecentMessagesConversationSerializer(conversation).data
+
+        archived = archive.archived_messages(conversation)
+        if archived is not None:
+            data["messages"] = archived if recent is None else archived[-recent:]
+        return data
+
+
+class ConversationMessagesView(APIView):
+    renderer_classes = [JSON_RENDERER_CLASS, BrowsableAPIRenderer]
+    pagination_class = MessageKeysetPagination
+
+    def get(self, request, pk):
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(
+            Message.objects.filter(conversation_id=pk), request, view=self
+        )
+        if not page and not Conversation.objects.filter(pk=pk).exists():
+            raise Http404
+        serializer = MessageSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ConversationEventsView(View):
+    """
+    Streams the new messages of a conversation as Server-Sent Events, as soon as
+    they are committed, through Redis pub/sub. Only served by the ASGI application,
+    where an open stream does not hold a worker.
+
+    A reconnecting client sends the `Last-Event-ID` header and first receives the
+    messages that follow that position, read from the database.
+    """
+
+    async def get(self, request, pk):
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(
+                JSON_RENDERER_CLASS().render(
+                    {"detail": "Only available on the ASGI application."}
+                ),
+                status=status.HTTP_501_NOT_IMPLEMENTED,
+                content_type="application/json",
+            )
+        if not await Conversation.objects.filter(pk=pk).aexists():
+            raise Http404
+
+        try:
+            position = decode_position(request.headers["Last-Event-ID"])
+        except (KeyError, ValueError):
+            position = None
+
+        response = StreamingHttpResponse(
+            self.stream(pk, position), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def stream(self, pk, position):
+        async with events.subscribe(pk) as subscription:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n"
+
+            replayed = set()
+            if position is not None:
+                async for message in self.missed_messages(pk, position):
+                    replayed.add(message["id"])
+                    yield self.event(message)
+
+            while True:
+                messages = await subscription.get(timeout=EVENTS_HEARTBEAT_INTERVAL)
+                if messages is None:
+                    yield ": keepalive\n\n"
+                    continue
+                for message in messages:
+                    if message["id"] not in replayed:
+                        yield self.event(message)
+
+    async def missed_messages(self, pk, position):
+        timestamp, message_id = position
+        queryset = (
+            Message.objects.filter(conversation_id=pk, timestamp__gte=timestamp)
+            .exclude(timestamp=timestamp, id__lte=message_id)
+            .order_by("timestamp", "id")
+        )
+        async for message in queryset[:EVENTS_REPLAY_LIMIT]:
+            yield MessageSerializer(message).data
+
+    @staticmethod
+    def event(message: dict) -> str:
+        event_id = encode_position(parse_datetime(message["timestamp"]), message["id"])
+        data = JSON_RENDERER_CLASS().render(message).decode("utf-8")
+        return f"id: {event_id}\nevent: message\ndata: {data}\n\n"
+
+
+class ConversationExportView(View):
+    """
+    Streams every conversation and message matching the filters, as NDJSON or CSV.
+    Rows are read through a server-side cursor and written as they are read, so
+    memory usage does not depend on the size of the export.
+    """
+
+    def get(self, request):
+        query = ExportQuerySerializer(data=request.GET)
+        if not query.is_valid():
+            return HttpResponse(
+                JSON_RENDERER_CLASS().render(query.errors),
+                status=status.HTTP_400_BAD_REQUEST,
+                content_type="application/json",
+            )
+        filters = query.validated_data
+        export_format = filters.pop("format")
+
+        response = StreamingHttpResponse(
+            stream_export(export_format, export_rows(**filters)),
+            content_type=EXPORT_CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="conversations.{export_format}"'
+        )
+        return response
+
+
+class MetricsView(View):
+    """
+    Serves the metrics of every web and worker process in the Prometheus text format.
+    """
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            raise Http404
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )